@@ -28,6 +28,117 @@ class Settings(BaseSettings):
 
     CATALOG_IMAGE_URL: str
 
+    # Cliente HTTP compartido para la Graph API de Instagram
+    INSTAGRAM_HTTP2: bool = True
+    INSTAGRAM_MAX_CONNECTIONS: int = 20
+    INSTAGRAM_KEEPALIVE_SECONDS: float = 120.0
+    INSTAGRAM_TIMEOUT_SECONDS: float = 10.0
+    INSTAGRAM_CONNECT_TIMEOUT_SECONDS: float = 5.0
+
+    # Cola de envíos salientes a Instagram
+    INSTAGRAM_SEND_RATE_PER_SECOND: float = 100.0  # Límite global de la Send API
+    INSTAGRAM_SEND_BURST: int = 20
+    INSTAGRAM_SEND_MAX_ATTEMPTS: int = 6
+    INSTAGRAM_SEND_BACKOFF_SECONDS: float = 1.0
+    INSTAGRAM_SEND_BACKOFF_MAX_SECONDS: float = 60.0
+    INSTAGRAM_SEND_LEASE_SECONDS: float = 120.0  # Cuánto es "nuestro" un envío pendiente sin renovar
+
+    # Buffer de mensajes entrantes (debounce)
+    BUFFER_POLICY: str = "adaptive"  # 'adaptive' o 'fixed'
+    BUFFER_WAIT_SECONDS: float = 15.0  # Espera fija / espera base de la adaptativa
+    BUFFER_MIN_WAIT_SECONDS: float = 3.0
+    BUFFER_BURST_CAP_SECONDS: float = 30.0
+    BUFFER_MAX_WAIT_SECONDS: float = 60.0
+    BUFFER_TICK_SECONDS: float = 0.25
+
+    # Idempotencia del webhook: cuántos 'mid' recientes recordamos en memoria
+    WEBHOOK_DEDUP_CACHE_SIZE: int = 50000
+
+    # Cola durable de conversaciones (True = el web solo encola y los procesa app/worker.py)
+    USE_JOB_QUEUE: bool = False
+    JOB_VISIBILITY_TIMEOUT_SECONDS: float = 300.0
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BACKOFF_SECONDS: float = 10.0
+    JOB_POLL_SECONDS: float = 1.0
+    WORKER_PROCESSES: int = 2
+    WORKER_CONCURRENCY: int = 8
+
+    # Admin (endpoints internos; vacío = deshabilitados)
+    ADMIN_TOKEN: str = ""
+
+    # Pools de hilos para integraciones bloqueantes (SDKs sync)
+    EXECUTOR_CALENDAR_WORKERS: int = 4
+    EXECUTOR_PAYMENTS_WORKERS: int = 2
+    EXECUTOR_DB_WORKERS: int = 8
+    EXECUTOR_GEMINI_WORKERS: int = 2
+
+    # Espejo local de la agenda (Google Calendar)
+    CALENDAR_MIRROR_ENABLED: bool = True
+    CALENDAR_MIRROR_SYNC_SECONDS: int = 60
+    CALENDAR_MIRROR_MAX_STALENESS_SECONDS: int = 300
+
+    # Control de admisión de llamadas a Gemini (cuota del proyecto)
+    GEMINI_MAX_IN_FLIGHT: int = 16
+    GEMINI_TOKENS_PER_MINUTE: int = 1_000_000
+    GEMINI_MAX_QUEUE: int = 500
+    GEMINI_MAX_QUEUE_WAIT_SECONDS: float = 30.0
+
+    # Topes del bucle de function calling
+    TOOL_TIMEOUT_SECONDS: float = 20.0
+    GEMINI_MAX_TOOL_STEPS: int = 5
+    CONVERSATION_DEADLINE_SECONDS: float = 60.0
+
+    # Memoria de lecturas (consultar_disponibilidad) por conversación
+    TOOL_MEMO_ENABLED: bool = True
+    TOOL_MEMO_TTL_SECONDS: float = 60.0
+    TOOL_MEMO_MAX_CONVERSATIONS: int = 5000
+    # Cada cuánto se relee la versión compartida de la agenda (invalida cachés de otros procesos)
+    AGENDA_VERSION_TTL_SECONDS: float = 1.0
+
+    # Foto de turnos libres de los próximos días que viaja en el contexto (ahorra consultar_disponibilidad)
+    AVAILABILITY_SNAPSHOT_ENABLED: bool = True
+    AVAILABILITY_SNAPSHOT_DAYS: int = 7
+    AVAILABILITY_SNAPSHOT_SLOTS_PER_DAY: int = 4
+    AVAILABILITY_SNAPSHOT_REFRESH_SECONDS: float = 120.0
+    AVAILABILITY_SNAPSHOT_MAX_AGE_SECONDS: float = 300.0
+
+    # Caché del prefijo estático (system prompt + tools) del lado de Google
+    GEMINI_CONTEXT_CACHE_ENABLED: bool = False
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: float = 3600.0
+    GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS: float = 300.0
+
+    # Reintentos y circuit breaker de Gemini
+    GEMINI_RETRY_MAX_ATTEMPTS: int = 3  # Intentos por llamada (429/5xx)
+    GEMINI_RETRY_BASE_SECONDS: float = 0.5
+    GEMINI_RETRY_MAX_BACKOFF_SECONDS: float = 8.0
+    GEMINI_BREAKER_FAILURE_THRESHOLD: int = 5  # Fallas seguidas que abren el circuito
+    GEMINI_BREAKER_RESET_SECONDS: float = 30.0  # Cuánto queda abierto antes de probar de nuevo
+    GEMINI_QUEUED_RETRY: bool = True  # Con Gemini caído, guardar el bloque y re-ejecutarlo cuando vuelva
+    GEMINI_MAX_PARKED_BLOCKS: int = 1000
+
+    # Ruteo por complejidad: charla liviana -> modelo chico sin tools; reservas -> modelo completo
+    GEMINI_ROUTING_ENABLED: bool = True
+    # Por negocio: {"barberia": {"light": "...", "full": "...", "max_light_words": 6, "min_smalltalk_ratio": 0.75}}
+    # (lo que falte toma los valores de gemini.TIER_DEFAULTS)
+    GEMINI_MODEL_TIERS: dict = {"barberia": {"light": "gemini-2.5-flash-lite", "full": "gemini-2.5-flash"}}
+
+    # Historial del prompt con presupuesto de tokens + resumen acumulado por cliente
+    HISTORY_TOKEN_BUDGET: int = 1500  # Tokens de mensajes textuales (los más recientes)
+    HISTORY_MESSAGE_MAX_TOKENS: int = 300  # Un mensaje más largo (texto pegado) se recorta
+    HISTORY_FETCH_LIMIT: int = 40  # Mensajes que se leen de la DB para armar la ventana
+    HISTORY_SUMMARY_ENABLED: bool = True
+    HISTORY_SUMMARY_MAX_TOKENS: int = 250
+
+    # Respuesta en vivo: "escribiendo..." al arrancar y la respuesta del modelo por oraciones a medida que llega
+    INSTAGRAM_TYPING_INDICATOR: bool = True
+    GEMINI_STREAMING: bool = True
+    STREAM_FLUSH_MIN_CHARS: int = 120  # Después de la primera oración, se junta al menos esto por mensaje
+
+    # Respuestas directas a preguntas frecuentes (dirección, precio, horarios) sin pasar por Gemini
+    FAQ_ENABLED: bool = True
+    FAQ_MIN_CONFIDENCE: float = 0.75  # Proporción del mensaje que tiene que explicar la FAQ
+    FAQ_TABLE_PATH: str = ""  # JSON con la tabla; vacío = la de app/services/faq.py
+
     model_config = SettingsConfigDict(
         env_file="/home/fabri/Escritorio/optica-bot/.env",  # <-- Le pasamos la ruta absoluta
         env_file_encoding='utf-8',
@@ -1,10 +1,12 @@
 # app/core/database.py
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
 
 connect_args = {"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 
+# --- Motor SYNC (scripts, init_db, tareas que ya corren en el pool de DB) ---
 engine = create_engine(
     settings.DATABASE_URL,
     connect_args=connect_args
@@ -14,10 +16,37 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+
+def get_async_database_url(url: str) -> str:
+    """
+    Traduce la URL sync a su driver async:
+    sqlite:///optica.db -> sqlite+aiosqlite:///optica.db
+    postgresql://...    -> postgresql+asyncpg://...
+    """
+    scheme, rest = url.split("://", 1)
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme.startswith("postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
+# --- Motor ASYNC (webhook, pipeline de conversación, tools) ---
+async_engine = create_async_engine(get_async_database_url(settings.DATABASE_URL))
+
+# expire_on_commit=False: en async no se pueden recargar atributos "a escondidas" después del commit
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
 # Dependencia para obtener la DB en cada request de FastAPI
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,32 @@
+# app/core/events.py
+import json
+import threading
+import time
+from collections import deque
+
+
+class EventLog:
+    """
+    Eventos estructurados del proceso (ej: cada paso del pipeline de conversación).
+    Cada evento se imprime como una línea JSON (fácil de filtrar en los logs de producción)
+    y los últimos `max_events` quedan en memoria para consultarlos por GET /admin/events.
+    """
+
+    def __init__(self, max_events: int = 1000):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+
+    def emit(self, event: str, **fields):
+        record = {"ts": round(time.time(), 3), "event": event, **fields}
+        with self._lock:
+            self._events.append(record)
+        print(f"📊 {json.dumps(record, ensure_ascii=False, default=str)}")
+
+    def recent(self, limit: int = 100, event: str = None) -> list:
+        with self._lock:
+            events = [e for e in self._events if event is None or e["event"] == event]
+        return events[-limit:]
+
+
+# Instancia global
+events = EventLog()
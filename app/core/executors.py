@@ -0,0 +1,93 @@
+# app/core/executors.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+class BlockingExecutor:
+    """
+    Pool de hilos acotado para UNA integración bloqueante (SDK de Google, MercadoPago, DB sync).
+    Así una llamada lenta no congela el event loop de uvicorn, y una integración
+    saturada no le roba hilos a las demás.
+    Métricas: executor.<nombre>.queued / .in_flight (gauges) y .queue_wait_seconds / .run_seconds.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+
+    def _update_gauges(self):
+        metrics.set_gauge(f"executor.{self.name}.queued", self.queued)
+        metrics.set_gauge(f"executor.{self.name}.in_flight", self.in_flight)
+
+    async def run(self, fn, *args, **kwargs):
+        """Ejecuta `fn(*args, **kwargs)` en el pool y espera el resultado sin bloquear el loop."""
+        loop = asyncio.get_running_loop()
+        enqueued_at = time.perf_counter()
+        state = {"dequeued": False}
+
+        with self._lock:
+            self.queued += 1
+            self._update_gauges()
+
+        def _dequeue():
+            # Se llama con el lock tomado; descuenta de la cola una sola vez
+            if not state["dequeued"]:
+                state["dequeued"] = True
+                self.queued -= 1
+
+        def _call():
+            with self._lock:
+                _dequeue()
+                self.in_flight += 1
+                self._update_gauges()
+            started_at = time.perf_counter()
+            metrics.observe(f"executor.{self.name}.queue_wait_seconds", started_at - enqueued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe(f"executor.{self.name}.run_seconds", time.perf_counter() - started_at)
+                with self._lock:
+                    self.in_flight -= 1
+                    self._update_gauges()
+
+        try:
+            return await loop.run_in_executor(self._pool, _call)
+        finally:
+            # Si nos cancelaron antes de que el hilo arrancara, el trabajo nunca salió de la cola
+            with self._lock:
+                _dequeue()
+                self._update_gauges()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Un pool por integración (tamaños configurables)
+executors = {
+    "calendar": BlockingExecutor("calendar", settings.EXECUTOR_CALENDAR_WORKERS),
+    "payments": BlockingExecutor("payments", settings.EXECUTOR_PAYMENTS_WORKERS),
+    "db": BlockingExecutor("db", settings.EXECUTOR_DB_WORKERS),
+    "gemini": BlockingExecutor("gemini", settings.EXECUTOR_GEMINI_WORKERS),
+}
+
+
+async def run_blocking(integration: str, fn, *args, **kwargs):
+    """
+    Atajo para correr código bloqueante fuera del event loop.
+    Uso: await run_blocking("calendar", calendar.agendar_evento, start_time=..., ...)
+    """
+    return await executors[integration].run(fn, *args, **kwargs)
+
+
+def shutdown_executors():
+    for executor in executors.values():
+        executor.shutdown()
@@ -0,0 +1,88 @@
+# app/core/metrics.py
+import threading
+from collections import defaultdict
+
+# Buckets por defecto (segundos) para histogramas de latencia
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Histograma acumulativo simple: cuenta, suma, min/max y conteo por bucket."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # El último es "+Inf"
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, limite in enumerate(self.buckets):
+            if value <= limite:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def to_dict(self) -> dict:
+        etiquetas = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "buckets": dict(zip(etiquetas, self.bucket_counts)),
+        }
+
+
+class Metrics:
+    """
+    Registro en memoria de métricas del proceso (contadores, gauges e histogramas).
+    Es thread-safe porque lo usan tanto el event loop como los hilos de los SDKs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name: str, value: int = 1):
+        """Incrementa un contador."""
+        with self._lock:
+            self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        """Fija el valor actual de un gauge (ej: profundidad de una cola)."""
+        with self._lock:
+            self.gauges[name] = value
+
+    def add_gauge(self, name: str, delta: float):
+        """Suma (o resta) al valor actual de un gauge."""
+        with self._lock:
+            self.gauges[name] += delta
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS):
+        """Registra una observación en un histograma (se crea en el primer uso)."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def snapshot(self) -> dict:
+        """Foto de todas las métricas, lista para devolver como JSON."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+            }
+
+
+# Instancia global del proceso
+metrics = Metrics()
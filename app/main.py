@@ -1,8 +1,42 @@
 # app/main.py
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Query
+from app.core.config import settings
+from app.core.database import async_engine
+from app.core.events import events
+from app.core.executors import run_blocking, shutdown_executors
+from app.core.metrics import metrics
 from app.routers import webhook # <--- Importamos el router
+from app.services import availability, calendar_mirror, instagram
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque: clientes compartidos y tareas de fondo
+    await instagram.startup()
+    background_tasks = []
+    if settings.CALENDAR_MIRROR_ENABLED:
+        background_tasks.append(asyncio.create_task(
+            calendar_mirror.mirror.run_forever(settings.CALENDAR_MIRROR_SYNC_SECONDS)
+        ))
+    if availability.snapshot:
+        background_tasks.append(asyncio.create_task(
+            availability.snapshot.run_forever(settings.AVAILABILITY_SNAPSHOT_REFRESH_SECONDS)
+        ))
+
+    yield
 
-app = FastAPI(title="Optica Bot")
+    # Apagado
+    for task in background_tasks:
+        task.cancel()
+    await instagram.shutdown()
+    shutdown_executors()
+    await async_engine.dispose()
+
+
+app = FastAPI(title="Optica Bot", lifespan=lifespan)
 
 # Conectamos el router del webhook a la app principal
 app.include_router(webhook.router)
@@ -10,3 +44,31 @@ app.include_router(webhook.router)
 @app.get("/")
 def read_root():
     return {"status": "El sistema está activo", "version": "1.0.0"}
+
+
+@app.get("/metrics")
+def read_metrics():
+    """Contadores, gauges e histogramas del proceso (cache de Calendar, colas, latencias...)."""
+    return metrics.snapshot()
+
+
+@app.get("/admin/events")
+def read_events(token: str = Query(...), event: str = None, limit: int = 100):
+    """Últimos eventos estructurados (ej: event=pipeline.step para ver los pasos lentos)."""
+    if not settings.ADMIN_TOKEN or token != settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token incorrecto")
+    return events.recent(limit=limit, event=event)
+
+
+@app.post("/admin/calendar/resync")
+async def force_calendar_resync(token: str = Query(...)):
+    """Fuerza una resincronización completa del espejo local de la agenda."""
+    if not settings.ADMIN_TOKEN or token != settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token incorrecto")
+
+    await run_blocking("calendar", calendar_mirror.mirror.force_resync)
+    return {
+        "status": "ok",
+        "busy_intervals": len(calendar_mirror.mirror),
+        "last_synced_at": calendar_mirror.mirror.last_synced_at
+    }
@@ -39,10 +39,44 @@ class MensajeBarberia(Base):
     role = Column(String)  # 'user' o 'model'
     content = Column(Text)  # El mensaje en sí
     timestamp = Column(DateTime, default=func.now())  # Fecha y hora automática
+    mid = Column(String, unique=True, index=True, nullable=True)  # ID de Meta (solo mensajes entrantes)
 
     cliente = relationship("ClienteBarberia", back_populates="mensajes")
 
 
+class ResumenBarberia(Base):
+    """Resumen acumulado de la parte vieja de la conversación (lo que ya no entra en el historial del prompt)"""
+    __tablename__ = 'barberia_resumenes'
+
+    id = Column(Integer, primary_key=True)
+    cliente_id = Column(Integer, ForeignKey('barberia_clientes.id'), unique=True, index=True)
+    resumen = Column(Text)
+    hasta_mensaje_id = Column(Integer, default=0)  # Último mensaje ya incluido en el resumen
+    actualizado = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class OcupadoAgendaBarberia(Base):
+    """Espejo local de los intervalos ocupados del calendario de la Barbería"""
+    __tablename__ = 'barberia_agenda_espejo'
+
+    id = Column(Integer, primary_key=True)
+    calendar_id = Column(String, index=True)
+    google_event_id = Column(String, index=True)
+    inicio = Column(DateTime)  # UTC
+    fin = Column(DateTime)  # UTC
+
+
+class SyncAgendaBarberia(Base):
+    """Estado de la sincronización incremental del espejo (syncToken de Google)"""
+    __tablename__ = 'barberia_agenda_sync'
+
+    id = Column(Integer, primary_key=True)
+    calendar_id = Column(String, unique=True, index=True)
+    sync_token = Column(String, nullable=True)
+    ultima_sync = Column(DateTime, nullable=True)  # UTC
+    version = Column(Integer, default=0)  # Sube con cada cambio de agenda hecho por el bot (ver agenda_version)
+
+
 # ==========================================
 # 2. MÓDULO LOMITERÍA
 # ==========================================
@@ -99,4 +133,35 @@ class MensajeLomiteria(Base):
     role = Column(String)  # 'user' o 'model'
     content = Column(Text)
     timestamp = Column(DateTime, default=func.now())
-    cliente = relationship("ClienteLomiteria", back_populates="mensajes")
\ No newline at end of file
+    mid = Column(String, unique=True, index=True, nullable=True)  # ID de Meta (solo mensajes entrantes)
+    cliente = relationship("ClienteLomiteria", back_populates="mensajes")
+
+# ==========================================
+# 3. INFRAESTRUCTURA (COLAS)
+# ==========================================
+
+class EnvioPendienteInstagram(Base):
+    """Respuesta encolada para Instagram que todavía no se entregó (sobrevive reinicios)"""
+    __tablename__ = 'instagram_envios_pendientes'
+    id = Column(Integer, primary_key=True)
+    recipient_id = Column(String, index=True)
+    tipo = Column(String)  # 'Texto' o 'Imagen'
+    payload = Column(Text)  # JSON del campo "message" de la Graph API
+    intentos = Column(Integer, default=0)
+    creado = Column(DateTime, default=func.now())
+    proceso = Column(String, nullable=True, index=True)  # Proceso que lo tiene en su cola (lease)
+    visible_desde = Column(DateTime, nullable=True)  # UTC. Lease del proceso; vencido, lo retoma otro (restore)
+
+
+class TrabajoConversacion(Base):
+    """Bloque de conversación pendiente de procesar por un worker de IA (ver app/worker.py)"""
+    __tablename__ = 'conversacion_trabajos'
+    id = Column(Integer, primary_key=True)
+    sender_id = Column(String, index=True)
+    texto = Column(Text)  # Bloque(s) del usuario; si llega otro antes de tomarlo, se concatena
+    estado = Column(String, default='pendiente', index=True)  # 'pendiente', 'en_proceso' o 'muerto'
+    intentos = Column(Integer, default=0)
+    visible_desde = Column(DateTime, index=True)  # UTC. Antes de esto nadie lo toma (backoff / visibility timeout)
+    worker = Column(String, nullable=True)  # Quién lo tiene tomado
+    ultimo_error = Column(Text, nullable=True)
+    creado = Column(DateTime, default=func.now())
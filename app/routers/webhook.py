@@ -1,166 +1,396 @@
 # app/routers/webhook.py
 import asyncio
-from datetime import datetime
-from zoneinfo import ZoneInfo
+import time
+from datetime import datetime, timezone
 from fastapi import APIRouter, Request, HTTPException, Query, BackgroundTasks
 from app.core.config import settings
-from app.services import instagram, gemini, crud
-from app.core.database import SessionLocal
+from app.core.metrics import metrics
+from app.services import availability, instagram, gemini, crud, prompts, faq, history
+from app.core.database import AsyncSessionLocal
+from app.services.debounce import DebouncePolicy, build_policy
+from app.services.dedup import RecentIds
+from app.services.jobs import job_queue
+from app.services.scheduler import TimerWheel
 from app.services.tools import TOOLS_SCHEMA
 
 router = APIRouter()
 
+# Buckets para el histograma de eventos por POST del webhook
+EVENTS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
 # Zona horaria Argentina
-TZ_ARG = ZoneInfo("America/Argentina/Cordoba")
-now_arg = datetime.now(TZ_ARG)
-fecha_actual_str = now_arg.strftime("%A %d de %B de %Y, %H:%Mhs")
-# Prompt Base
-SYSTEM_PROMPT_BARBERIA = f"""
-Sos el asistente virtual de "Barbería Demo". Tu objetivo principal es lograr usar agendar_turno, para eso antes deberas usar registrar_cliente (si hace falta) y consultar_disponibilidad.
-
-### CONTEXTO TEMPORAL (MUY IMPORTANTE):
-- **HOY ES:** {fecha_actual_str}
-- Usa esta fecha como referencia absoluta para calcular "mañana", "el miércoles", "la semana que viene".
-- Si el usuario dice "miercoles" se refiere al proximo miercoles (de esta semana o la que sigue)
-_ Nunca agendes turnos para fechas anteriores, o horas ya pasadas del mismo dia.
-- No agendes dos turnos para la misma fecha y hora para el mismo cliente, por lo general el cliente quiere un solo turno.
-
-###PREGUNTAS FRECUENTES:
-Queda en la ciudad de cordoba, argentina, barrio san martin. La direccion es Castro Barros 1234. El corte sale 12000. El horario de atencion es de martes a domingos de 9 a 20hs.
-
-### PERSONALIDAD:
-- Hablá en español argentino, tono urbano, moderno ("Que onda", "Dale", "Quedamos asi", "Bro", "Pana", "Hermano", "Hermanito").
-- Sos un empleado del lugar
-- No uses la apertura de los signos de exclamacion/interrogacion. Solo el cierre
--No des informacion que no te pidan.
--No trates a los clientes por su nombre, usa bro, pana, hermanito, brody, genio, etc.
-
-### REGLAS DE NEGOCIO (MEMORIA):
-1. **Datos del Cliente**: 
-   - Si el usuario te da su nombre y teléfono, PRIMERO usá `registrar_cliente`.
-   - INMEDIATAMENTE después, si ya tenés fecha y hora pactada, pedile confirmacion y usá `agendar_turno`.
-
-2. **Turnos**:
-   - Primero usá `consultar_disponibilidad`.
-   - Para confirmar, ejecutá `agendar_turno`.
-
-### REGLA DE ORO (ANTI-MENTIRAS) :
-- **PROHIBIDO** decir "Turno agendado", "Te espero", "Listo" o similares SI NO has ejecutado exitosamente la tool `agendar_turno` en este mismo turno.
-- Si la tool `agendar_turno` no se ejecutó, NO le mientas al usuario. Decile: "Tengo tus datos, confirmame si querés que cierre la reserva para el [fecha/hora]".
-- Si usas la tool `registrar_cliente`, NO asumas que el turno se agendó solo. Tenés que llamar a `agendar_turno` después.
-"""
+TZ_ARG = prompts.TZ_ARG
 
 
 # ==============================================================================
 # SISTEMA DE BUFFER (DEBOUNCE)
 # ==============================================================================
 class MessageBuffer:
-    def __init__(self):
+    """
+    Junta los mensajes que un usuario manda seguidos y los procesa como UN bloque.
+    Todos los temporizadores viven en una sola rueda de timers (TimerWheel):
+    cada mensaje nuevo reinicia el reloj del usuario en O(1), sin crear ni cancelar tasks.
+    Cuánto esperar lo decide una política enchufable (ver app/services/debounce.py).
+    """
+
+    def __init__(self, policy: DebouncePolicy, max_wait: float, tick: float, on_block=None):
         # Almacena los textos: {sender_id: ["Hola", "Quiero turno"]}
         self.buffers = {}
-        # Almacena las tareas de espera: {sender_id: Task}
-        self.tasks = {}
-        # Tiempo de espera en segundos (Ajustado a 15s, 40s puede ser muy lento para chat)
-        self.WAIT_TIME = 15
+        # Momento del primer y del último mensaje del bloque: {sender_id: monotonic}
+        self.first_seen = {}
+        self.last_seen = {}
+        # Política de espera después de cada mensaje (debounce fijo o adaptativo)
+        self.policy = policy
+        # Tope desde el PRIMER mensaje: un usuario que no para de escribir igual recibe respuesta
+        self.MAX_WAIT = max_wait
+        # Qué hacer con el bloque (por defecto, mandarlo al actor del usuario)
+        self.on_block = on_block
+        self.wheel = TimerWheel(on_expire=self._on_expire, tick=tick)
 
     async def add_message(self, sender_id: str, text: str):
         """
         Recibe un mensaje, lo guarda en el buffer y reinicia el temporizador.
         """
-        # 1. Inicializar buffer si no existe
-        if sender_id not in self.buffers:
-            self.buffers[sender_id] = []
+        now = time.monotonic()
 
-        # 2. Agregar mensaje a la lista
-        self.buffers[sender_id].append(text)
-        print(f"⏳ Buffer {sender_id}: Mensaje agregado. Esperando {self.WAIT_TIME}s...")
+        # 1. Agregar mensaje al buffer (se inicializa si no existe)
+        self.buffers.setdefault(sender_id, []).append(text)
+        first = self.first_seen.setdefault(sender_id, now)
 
-        # 3. Cancelar tarea anterior si existe (reinicio del reloj)
-        if sender_id in self.tasks:
-            self.tasks[sender_id].cancel()
+        self.last_seen[sender_id] = now
 
-        # 4. Crear nueva tarea de procesamiento diferido
-        self.tasks[sender_id] = asyncio.create_task(self.process_later(sender_id))
+        # 2. Reiniciar el reloj, sin pasarnos del tope desde el primer mensaje
+        wait = await self.policy.wait_for(sender_id, text, now)
+        delay = max(0.0, min(wait, first + self.MAX_WAIT - now))
+        self.wheel.schedule(sender_id, delay)
+        print(f"⏳ Buffer {sender_id}: Mensaje agregado. Esperando {delay:.1f}s...")
 
-    async def process_later(self, sender_id: str):
-        """
-        Espera X segundos y luego dispara el procesamiento de la IA.
-        """
-        try:
-            await asyncio.sleep(self.WAIT_TIME)
+    def _on_expire(self, sender_id: str):
+        """Lo llama la rueda cuando venció el reloj del usuario."""
+        messages = self.buffers.pop(sender_id, [])
+        now = time.monotonic()
+        first = self.first_seen.pop(sender_id, now)
+        last = self.last_seen.pop(sender_id, now)
+        if messages:
+            self.policy.on_block(sender_id, waited=now - last, span=now - first)
+            combined_text = " ".join(messages)  # Unimos todo en un solo string
+            (self.on_block or conversation_actors.submit)(sender_id, combined_text)
 
-            # Si llegamos acá sin ser cancelados, procesamos todo el bloque
-            messages = self.buffers.pop(sender_id, [])
-            if messages:
-                combined_text = " ".join(messages)  # Unimos todo en un solo string
-                print(f"🚀 Procesando bloque para {sender_id}: {combined_text}")
-                await process_conversation_block(sender_id, combined_text)
 
-        except asyncio.CancelledError:
-            # La tarea fue cancelada porque llegó otro mensaje nuevo. No hacemos nada.
-            pass
+class ConversationActors:
+    """
+    Un "actor" por usuario: a lo sumo UN pipeline (Gemini + tools) corriendo por sender_id.
+    - Si llega un bloque mientras el anterior todavía se procesa, se guarda en el buzón
+      y se procesa junto con lo que siga llegando en la PRÓXIMA corrida (no en paralelo).
+    - Cuando el buzón queda vacío el actor termina y se desaloja: la memoria queda acotada
+      a los usuarios que tienen algo en proceso.
+    """
+
+    def __init__(self, handler=None):
+        # Bloques pendientes: {sender_id: ["texto bloque 1", "texto bloque 2"]}
+        self.mailboxes = {}
+        # Actores vivos: {sender_id: Task}
+        self.running = {}
+        # Qué corre cada actor (por defecto, process_conversation_block)
+        self.handler = handler
+
+    def submit(self, sender_id: str, text: str):
+        self.mailboxes.setdefault(sender_id, []).append(text)
+        if sender_id in self.running:
+            metrics.inc("actors.folded_blocks")
+            return
+        self.running[sender_id] = asyncio.create_task(self._run(sender_id))
+        metrics.set_gauge("actors.active", len(self.running))
+
+    async def _run(self, sender_id: str):
+        handler = self.handler or process_conversation_block
+        try:
+            while True:
+                textos = self.mailboxes.pop(sender_id, None)
+                if not textos:
+                    break
+                combined_text = " ".join(textos)
+                print(f"🚀 Procesando bloque para {sender_id}: {combined_text}")
+                try:
+                    await handler(sender_id, combined_text)
+                except Exception as e:
+                    print(f"❌ Error en el actor de {sender_id}: {e}")
         finally:
-            # Limpieza de la referencia a la tarea
-            self.tasks.pop(sender_id, None)
+            # Buzón vacío: desalojamos el actor
+            self.running.pop(sender_id, None)
+            metrics.set_gauge("actors.active", len(self.running))
+
+
+# Instancia global de los actores
+conversation_actors = ConversationActors()
+
+
+# Encolados a la cola durable en vuelo (referencia fuerte para que no los junte el GC)
+_encolados = set()
+
+
+def encolar_trabajo(sender_id: str, text: str):
+    """
+    Destino de los bloques con USE_JOB_QUEUE: van a la cola durable y los procesa app/worker.py.
+    Si la DB no responde, el bloque se procesa acá mismo con los actores (fallback).
+    """
+    async def _encolar():
+        try:
+            await job_queue.enqueue(sender_id, text)
+        except Exception as e:
+            metrics.inc("jobs.enqueue_fallbacks")
+            print(f"⚠️ No se pudo encolar el bloque de {sender_id}, se procesa en este proceso: {e}")
+            conversation_actors.submit(sender_id, text)
+
+    task = asyncio.create_task(_encolar())
+    _encolados.add(task)
+    task.add_done_callback(_encolados.discard)
+
+
+# 'mid' de Meta vistos hace poco (idempotencia del webhook)
+recent_mids = RecentIds(max_size=settings.WEBHOOK_DEDUP_CACHE_SIZE)
 
 
 # Instancia global del buffer
-buffer_manager = MessageBuffer()
+buffer_manager = MessageBuffer(
+    policy=build_policy(
+        settings.BUFFER_POLICY,
+        base_wait=settings.BUFFER_WAIT_SECONDS,
+        min_wait=settings.BUFFER_MIN_WAIT_SECONDS,
+        burst_cap=settings.BUFFER_BURST_CAP_SECONDS
+    ),
+    max_wait=settings.BUFFER_MAX_WAIT_SECONDS,
+    tick=settings.BUFFER_TICK_SECONDS,
+    on_block=encolar_trabajo if settings.USE_JOB_QUEUE else None
+)
 
 
 # ==============================================================================
 # LÓGICA DE PROCESAMIENTO (IA + DB)
 # ==============================================================================
-async def process_conversation_block(sender_id: str, user_text: str):
+# Aviso (una vez por caída) cuando el bloque queda esperando a que Gemini vuelva
+AVISO_CAIDA = "Se me cayó el sistema un toque, bro. Apenas vuelva te contesto"
+
+
+async def reintentar_bloque(sender_id: str, text: str):
+    """Re-ejecuta un bloque guardado durante una caída, por el actor del usuario (nunca en paralelo con otro)."""
+    conversation_actors.submit(sender_id, text)
+    task = conversation_actors.running.get(sender_id)
+    if task:
+        await asyncio.shield(task)
+
+
+def _medir_primer_texto(started: float):
+    """Callback de entrega: registra UNA vez cuánto tardó el usuario en ver el primer texto del bloque."""
+    pendiente = [True]
+
+    def on_delivered():
+        if pendiente:
+            pendiente.clear()
+            metrics.observe("pipeline.first_visible_seconds", time.monotonic() - started)
+
+    return on_delivered
+
+
+class BloqueYaAtendido(Exception):
+    """
+    El bloque falló DESPUÉS de tener efectos (tools de escritura ejecutadas o texto enviado al usuario):
+    re-ejecutarlo entero agendaría el turno o mandaría la respuesta de nuevo. El worker no lo reintenta.
+    """
+
+
+async def process_conversation_block(sender_id: str, user_text: str, park_on_outage: bool = True):
     """
     Esta función se ejecuta SOLO después de que pasó el tiempo de espera.
     Contiene la lógica pesada (Gemini, Tools, DB).
+    Los errores se propagan: el actor los loguea y el worker (app/worker.py) los reintenta,
+    salvo que el bloque ya haya tenido efectos: ahí salen como BloqueYaAtendido (no se reintenta).
+    Si Gemini está caído (gemini.GeminiUnavailable) y `park_on_outage`, el bloque queda en
+    gemini.outage_queue y se re-ejecuta cuando vuelva; el worker pasa False y usa los reintentos de la cola.
+    La respuesta del modelo se manda por oraciones a medida que llega (GEMINI_STREAMING) y se guarda una vez.
     """
-    db = SessionLocal()
+    started = time.monotonic()
+    # "Escribiendo..." ya: el usuario ve que lo estamos atendiendo
+    instagram.start_typing(sender_id)
+    on_delivered = _medir_primer_texto(started)
+    efectos = False  # Ya se ejecutó una tool de escritura o se le mandó texto al usuario
+
+    async def enviar(texto: str):
+        nonlocal efectos
+        efectos = True
+        await instagram.enqueue_text(sender_id, texto, on_delivered=on_delivered)
+
+    db = AsyncSessionLocal()
     try:
         # 1. Obtener / Crear Cliente
-        client = crud.cliente_barberia.get_one(db, ig_id=sender_id)
+        client = await crud.cliente_barberia.aget_one(db, ig_id=sender_id)
         if not client:
-            client = crud.cliente_barberia.create(db, ig_id=sender_id)
+            client = await crud.cliente_barberia.acreate(db, ig_id=sender_id)
 
         # NOTA: Los mensajes de usuario ya se guardaron individualmente al llegar
         # (ver 'receive_instagram_message'), así que aquí solo nos preocupamos por responder.
 
-        # 2. Preparar Contexto
-        datos_usuario = "No registrados aún."
-        if client.nombre or client.telefono:
-            datos_usuario = f"Nombre: {client.nombre or 'Falta'}\nTeléfono: {client.telefono or 'Falta'}"
-
-        full_system_prompt = f"{SYSTEM_PROMPT_BARBERIA}\n\n### DATOS DEL CLIENTE ACTUAL (ID: {sender_id}):\n{datos_usuario}"
-
-        history_for_ai = crud.get_chat_history(db, crud.mensaje_barberia.model, client.id)
-
-        # 3. Llamar a Gemini con el texto acumulado
-        ai_response_text = await gemini.chat_with_gemini(
-            user_message=user_text,
-            recipient_id=sender_id,
-            db_history=history_for_ai,
-            tools_schema=TOOLS_SCHEMA,
-            system_instruction=full_system_prompt
-        )
+        # 2. Atajo: preguntas frecuentes (dirección, precio, horarios) se responden sin Gemini,
+        #    salvo que el bloque dependa de la charla (nombra un día u hora, o contesta una pregunta de reserva)
+        ai_response_text = None
+        if faq.matcher:
+            recientes = await crud.aget_chat_history(db, crud.mensaje_barberia.model, client.id, limit=4)
+            if gemini.faq_applies(user_text, recientes):
+                ai_response_text = faq.matcher.answer(user_text)
+        ya_enviado = False
+
+        if not ai_response_text:
+            # 3. Preparar Contexto: prefijo estático (modelo cacheado) + bloque chico por request
+            #    Historial: lo reciente textual (con presupuesto de tokens) + resumen de lo anterior
+            #    Turnos libres: la foto precalculada, si está fresca (evita una vuelta de consultar_disponibilidad)
+            ventana = await history.aload(db, client.id)
+            libres = await availability.snapshot.context_text() if availability.snapshot else None
+            prompt = prompts.assemble("barberia", sender_id, client, summary=ventana.summary, availability=libres)
+            history_for_ai = ventana.history
+
+            # Llamar a Gemini con el texto acumulado (en streaming: se va mandando por oraciones)
+            stream = None
+            if settings.GEMINI_STREAMING:
+                stream = gemini.SentenceStream(enviar, settings.STREAM_FLUSH_MIN_CHARS)
+            trace = gemini.BlockTrace(sender_id, settings.CONVERSATION_DEADLINE_SECONDS)
+            try:
+                ai_response_text = await gemini.chat_with_gemini(
+                    user_message=user_text,
+                    recipient_id=sender_id,
+                    db_history=history_for_ai,
+                    tools_schema=TOOLS_SCHEMA,
+                    system_instruction=prompt["system_instruction"],
+                    context=prompt["context"],
+                    tenant="barberia",
+                    stream=stream,
+                    trace=trace
+                )
+            except gemini.GeminiUnavailable:
+                if not park_on_outage:
+                    raise
+                if not gemini.outage_queue.park(sender_id, user_text, reintentar_bloque):
+                    ai_response_text = "Disculpa, estoy teniendo problemas de conexión. ¿Me repetís?"
+                else:
+                    # Queda guardado: solo avisamos (sin persistir, la respuesta real llega después)
+                    if gemini.outage_queue.notify_once(sender_id):
+                        await instagram.enqueue_text(sender_id, AVISO_CAIDA)
+                    return
+            finally:
+                # Lo que ya salió por el stream se está mandando de fondo: cuenta como enviado
+                efectos = efectos or trace.write_calls > 0 or bool(stream and stream.flushes)
+            if stream:
+                # Lo que quedó en el buffer (o la respuesta entera si no salió por el stream)
+                ai_response_text = await stream.close(ai_response_text)
+                ya_enviado = True
 
         # 4. Responder y Guardar
         if ai_response_text:
-            await instagram.send_text(sender_id, ai_response_text)
+            if not ya_enviado:
+                await enviar(ai_response_text)
 
-            now_arg_response = datetime.now(TZ_ARG)
-            crud.mensaje_barberia.create(
+            await crud.mensaje_barberia.acreate(
                 db,
                 cliente_id=client.id,
                 role="model",
                 content=ai_response_text,
-                timestamp=now_arg_response
+                timestamp=crud.hora_local()
             )
 
+        # 5. Plegar en el resumen lo que quedó fuera de la ventana de historial (de fondo: ya se respondió)
+        history.schedule_summary(client.id, sender_id)
+
     except Exception as e:
-        print(f"❌ Error procesando bloque barbería: {e}")
+        if efectos:
+            raise BloqueYaAtendido(f"{type(e).__name__}: {e}") from e
+        raise
     finally:
-        db.close()
+        await db.close()
+
+
+def _extraer_mensajes(payload: dict) -> list:
+    """
+    Recorre TODAS las entradas y eventos del payload (Meta agrupa varios por POST cuando hay carga).
+    Retorna [{"sender_id": ..., "text": ..., "mid": ..., "timestamp": ...}] en el orden de llegada;
+    ignora ecos y no-texto. `timestamp` es el de Meta (epoch en ms), o None si no vino.
+    """
+    mensajes = []
+    for entry in payload.get("entry", []):
+        for messaging in entry.get("messaging", []):
+            message_data = messaging.get("message", {})
+            if message_data.get("is_echo") or "text" not in message_data:
+                continue
+            sender_id = messaging.get("sender", {}).get("id")
+            if not sender_id:
+                continue
+            mensajes.append({
+                "sender_id": sender_id,
+                "text": message_data["text"],
+                "mid": message_data.get("mid"),
+                "timestamp": messaging.get("timestamp"),
+            })
+    return mensajes
+
+
+def _descartar_duplicados(mensajes: list) -> list:
+    """
+    Primera barrera de idempotencia, en memoria: saca los 'mid' que ya vimos hace poco
+    (Meta reentrega el webhook si tardamos en responder). Los marca como vistos.
+    """
+    nuevos = []
+    for m in mensajes:
+        if m["mid"] and not recent_mids.add(m["mid"]):
+            metrics.inc("webhook.duplicates_suppressed")
+            continue
+        nuevos.append(m)
+    return nuevos
+
+
+def _hora_del_evento(mensaje: dict, ahora: datetime) -> datetime:
+    """Hora en que el usuario mandó el mensaje según Meta (así un lote queda en orden en el historial)."""
+    if isinstance(mensaje.get("timestamp"), (int, float)):
+        return crud.hora_local(datetime.fromtimestamp(mensaje["timestamp"] / 1000, tz=timezone.utc))
+    return ahora
+
+
+async def _guardar_mensajes_usuario(mensajes: list) -> list:
+    """
+    Resuelve los clientes de todos los remitentes con una consulta y guarda los mensajes
+    entrantes con UN insert masivo (sesión async, no frena el loop).
+    El índice único sobre 'mid' es la barrera definitiva: los que ya estaban en DB
+    (reentregas después de un reinicio, u otro proceso) no se insertan y no se devuelven.
+    """
+    async with AsyncSessionLocal() as db:
+        clientes = await crud.aget_or_create_clientes(
+            db, crud.cliente_barberia.model, [m["sender_id"] for m in mensajes]
+        )
+        ahora = crud.hora_local()
+        insertados = await crud.mensaje_barberia.acreate_many_new(db, [
+            {
+                "cliente_id": clientes[m["sender_id"]].id,
+                "role": "user",
+                "content": m["text"],
+                "timestamp": _hora_del_evento(m, ahora),
+                "mid": m["mid"]
+            }
+            for m in mensajes
+        ], unique_field="mid")
+
+    nuevos = [m for m in mensajes if m["mid"] is None or m["mid"] in insertados]
+    metrics.inc("webhook.duplicates_suppressed", len(mensajes) - len(nuevos))
+    return nuevos
+
+
+async def _encolar_en_buffer(mensajes: list):
+    """Reparte los mensajes al buffer: en orden dentro de cada usuario, en paralelo entre usuarios."""
+    por_usuario = {}
+    for m in mensajes:
+        por_usuario.setdefault(m["sender_id"], []).append(m["text"])
+
+    async def _agregar(sender_id: str, textos: list):
+        for text in textos:
+            await buffer_manager.add_message(sender_id, text)
+
+    await asyncio.gather(*[_agregar(sender_id, textos) for sender_id, textos in por_usuario.items()])
 
 
 # ==============================================================================
@@ -181,44 +411,43 @@ async def verify_webhook(
 @router.post("/webhook")
 async def receive_instagram_message(request: Request):
     """
-    Recibe el mensaje, devuelve 200 OK RÁPIDO y delega al buffer.
+    Recibe el/los mensaje(s), devuelve 200 OK RÁPIDO y delega al buffer.
+    Procesa todas las entradas y eventos del payload, no solo el primero.
     """
     try:
         payload = await request.json()
-        entry = payload['entry'][0]
-        messaging = entry['messaging'][0]
-        sender_id = messaging['sender']['id']
-        message_data = messaging.get('message', {})
-
-        if message_data.get("is_echo") or 'text' not in message_data:
+        mensajes = _extraer_mensajes(payload)
+        metrics.observe("webhook.events_per_request", len(mensajes), buckets=EVENTS_BUCKETS)
+        if not mensajes:
             return {"status": "ignored"}
 
-        user_text = message_data['text']
+        # 1. Reentregas de Meta: si ya vimos todos los 'mid', respondemos sin tocar DB ni Gemini
+        mensajes = _descartar_duplicados(mensajes)
+        if not mensajes:
+            return {"status": "duplicate"}
 
-        # 1. Guardamos el mensaje en DB INMEDIATAMENTE (Auditoría)
-        # Esto asegura que no se pierda nada aunque el bot se reinicie
-        db = SessionLocal()
+        # 2. Guardamos los mensajes en DB INMEDIATAMENTE (Auditoría)
+        # Esto asegura que no se pierda nada aunque el bot se reinicie.
+        # Un solo insert por request, sin importar cuántos eventos traiga.
         try:
-            client = crud.cliente_barberia.get_one(db, ig_id=sender_id)
-            if not client:
-                client = crud.cliente_barberia.create(db, ig_id=sender_id)
-
-            crud.mensaje_barberia.create(
-                db,
-                cliente_id=client.id,
-                role="user",
-                content=user_text,
-                timestamp=datetime.now(TZ_ARG)
-            )
-        finally:
-            db.close()
-
-        await buffer_manager.add_message(sender_id, user_text)
-
-        return {"status": "received"}
-
-    except (IndexError, KeyError):
-        return {"status": "ignored"}
+            mensajes = await _guardar_mensajes_usuario(mensajes)
+        except Exception as e:
+            # No se guardaron: que la próxima reentrega de Meta sí se procese.
+            # Tiene que ser un 5xx: con un 200 Meta no reentrega y los mensajes se pierden.
+            for m in mensajes:
+                recent_mids.discard(m["mid"])
+            metrics.inc("webhook.persist_errors")
+            print(f"❌ No se pudieron guardar los mensajes entrantes (Meta los reentrega): {e}")
+            raise HTTPException(status_code=500, detail="No se pudieron guardar los mensajes")
+        metrics.inc("webhook.messages_received", len(mensajes))
+
+        # 3. Recién ahora los repartimos al buffer de cada usuario
+        await _encolar_en_buffer(mensajes)
+
+        return {"status": "received", "messages": len(mensajes)}
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error en webhook: {e}")
-        return {"status": "error"}
\ No newline at end of file
+        return {"status": "error"}
@@ -0,0 +1,99 @@
+# app/scripts/bench_message_buffer.py
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+load_dotenv()
+
+from app.routers.webhook import MessageBuffer
+from app.services.debounce import FixedDebounce
+
+SENDERS = 10_000
+MESSAGES_PER_SENDER = 3
+WAIT_TIME = 1.0
+
+
+class LegacyMessageBuffer:
+    """Copia de la implementación anterior: un asyncio.Task dormido por usuario."""
+
+    def __init__(self, handler):
+        self.buffers = {}
+        self.tasks = {}
+        self.WAIT_TIME = WAIT_TIME
+        self.handler = handler
+
+    async def add_message(self, sender_id: str, text: str):
+        if sender_id not in self.buffers:
+            self.buffers[sender_id] = []
+        self.buffers[sender_id].append(text)
+        if sender_id in self.tasks:
+            self.tasks[sender_id].cancel()
+        self.tasks[sender_id] = asyncio.create_task(self.process_later(sender_id))
+
+    async def process_later(self, sender_id: str):
+        try:
+            await asyncio.sleep(self.WAIT_TIME)
+            messages = self.buffers.pop(sender_id, [])
+            if messages:
+                self.handler(sender_id, " ".join(messages))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.tasks.pop(sender_id, None)
+
+
+async def run(nombre: str, build_buffer):
+    done = asyncio.Event()
+    fired = {"blocks": 0, "lag": []}
+    last_message_at = {}
+
+    def handler(sender_id, text):
+        fired["lag"].append(time.monotonic() - last_message_at[sender_id] - WAIT_TIME)
+        fired["blocks"] += 1
+        if fired["blocks"] >= SENDERS:
+            done.set()
+
+    buffer = build_buffer(handler)
+    tracemalloc.start()
+    started = time.perf_counter()
+    peak_tasks = 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Ráfaga: cada usuario manda varios mensajes seguidos (como en una promo)
+        for i in range(MESSAGES_PER_SENDER):
+            for sender in range(SENDERS):
+                sender_id = f"user-{sender}"
+                last_message_at[sender_id] = time.monotonic()
+                await buffer.add_message(sender_id, f"mensaje {i}")
+            await asyncio.sleep(0)
+            peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+        ingest = time.perf_counter() - started
+
+        await asyncio.wait_for(done.wait(), timeout=WAIT_TIME * 10)
+        # Margen para ver si aparecen bloques de más (un mismo usuario procesado dos veces)
+        await asyncio.sleep(WAIT_TIME * 1.5)
+
+    _, peak_mem = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lags = sorted(fired["lag"])
+    print(f"{nombre:<14} ingesta={ingest * 1000:8.1f}ms  tasks_pico={peak_tasks:<6} "
+          f"mem_pico={peak_mem / 1e6:6.1f}MB  atraso_p50={lags[len(lags) // 2] * 1000:6.1f}ms "
+          f"atraso_max={lags[-1] * 1000:6.1f}ms  bloques={fired['blocks']} (esperados {SENDERS})")
+
+
+async def main():
+    print(f"📊 BENCHMARK MessageBuffer: {SENDERS} usuarios x {MESSAGES_PER_SENDER} mensajes (debounce {WAIT_TIME}s)")
+    print("=" * 50)
+    await run("Legacy (tasks)", lambda h: LegacyMessageBuffer(h))
+    await run("TimerWheel", lambda h: MessageBuffer(policy=FixedDebounce(WAIT_TIME), max_wait=WAIT_TIME * 4, tick=0.05, on_block=h))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
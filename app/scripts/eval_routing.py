@@ -0,0 +1,117 @@
+# app/scripts/eval_routing.py
+"""
+Evaluación offline del ruteo por complejidad (gemini.classify_block) sobre conversaciones guardadas.
+
+Rearma los bloques de la tabla barberia_mensajes (mensajes de usuario seguidos), los clasifica con el
+historial que tenían en ese momento y los compara con la respuesta que efectivamente se dio:
+si la respuesta usó tools (confirmaciones, horarios, fechas), el bloque necesitaba el modelo completo.
+
+Uso:
+    python app/scripts/eval_routing.py --tenant barberia --muestras 10
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from itertools import groupby
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+load_dotenv()
+
+from app.core.database import SessionLocal
+from app.models.models import MensajeBarberia
+from app.services import gemini
+from app.services.tools import TOOLS_SCHEMA
+
+HISTORY_LIMIT = 10  # Igual que crud.aget_chat_history
+
+# La respuesta real se apoyó en tools (o habla de turnos concretos)
+_USO_DE_TOOLS_RE = re.compile(r"✅|❌|🗓️|\b\d{1,2}[:.]\d{2}\b|\b\d{1,2}/\d{1,2}\b")
+
+
+def necesitaba_completo(respuesta: str) -> bool:
+    return bool(respuesta and (_USO_DE_TOOLS_RE.search(respuesta) or gemini._RESERVA_RE.search(respuesta.lower())))
+
+
+def bloques(mensajes: list):
+    """[(texto del bloque, historial previo, respuesta del bot)] de una conversación ordenada."""
+    resultado = []
+    i = 0
+    while i < len(mensajes):
+        if mensajes[i].role != "user":
+            i += 1
+            continue
+        inicio = i
+        while i < len(mensajes) and mensajes[i].role == "user":
+            i += 1
+        texto = " ".join(m.content or "" for m in mensajes[inicio:i])
+        respuesta = mensajes[i].content if i < len(mensajes) else None
+        historial = mensajes[max(0, inicio - HISTORY_LIMIT):inicio]
+        resultado.append((texto, historial, respuesta))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evalúa el ruteo de modelos sobre conversaciones guardadas")
+    parser.add_argument("--tenant", default="barberia")
+    parser.add_argument("--muestras", type=int, default=10, help="Ejemplos a mostrar de cada tipo de error")
+    args = parser.parse_args()
+
+    cfg = gemini.tier_config(args.tenant)
+    tokens_tools = gemini.estimate_tokens(json.dumps(TOOLS_SCHEMA, ensure_ascii=False))
+
+    db = SessionLocal()
+    try:
+        filas = (
+            db.query(MensajeBarberia)
+            .order_by(MensajeBarberia.cliente_id, MensajeBarberia.timestamp, MensajeBarberia.id)
+            .all()
+        )
+    finally:
+        db.close()
+
+    conteo = {gemini.TIER_LIGHT: 0, gemini.TIER_FULL: 0}
+    riesgosos = []  # Liviano, pero la respuesta real necesitó tools
+    conservadores = []  # Completo, pero la respuesta real no usó nada
+    total = 0
+    for _, conversacion in groupby(filas, key=lambda m: m.cliente_id):
+        for texto, historial, respuesta in bloques(list(conversacion)):
+            if respuesta is None:
+                continue
+            total += 1
+            tier = gemini.classify_block(texto, historial, args.tenant)
+            conteo[tier] += 1
+            necesita = necesitaba_completo(respuesta)
+            if tier == gemini.TIER_LIGHT and necesita:
+                riesgosos.append((texto, respuesta))
+            elif tier == gemini.TIER_FULL and not necesita:
+                conservadores.append((texto, respuesta))
+
+    if not total:
+        print("⚠️ No hay conversaciones guardadas para evaluar.")
+        return
+
+    print(f"🧭 EVALUACIÓN DE RUTEO ({args.tenant}): liviano={cfg[gemini.TIER_LIGHT]} | completo={cfg[gemini.TIER_FULL]}")
+    print(f"Umbrales: max_light_words={cfg['max_light_words']} min_smalltalk_ratio={cfg['min_smalltalk_ratio']}")
+    print("=" * 50)
+    print(f"Bloques evaluados: {total}")
+    for tier, n in conteo.items():
+        print(f"  {tier:<6} {n:>6} ({n / total * 100:.1f}%)")
+    print(f"❗ Livianos que necesitaban tools: {len(riesgosos)} "
+          f"({len(riesgosos) / max(1, conteo[gemini.TIER_LIGHT]) * 100:.1f}% de los livianos)")
+    print(f"💸 Completos que no usaron nada: {len(conservadores)} "
+          f"({len(conservadores) / max(1, conteo[gemini.TIER_FULL]) * 100:.1f}% de los completos)")
+    print(f"💡 Tokens de schema de tools que no se mandan: ~{conteo[gemini.TIER_LIGHT] * tokens_tools}")
+
+    for titulo, ejemplos in (("Livianos riesgosos", riesgosos), ("Completos evitables", conservadores)):
+        if ejemplos and args.muestras:
+            print(f"\n--- {titulo} ---")
+            for texto, respuesta in ejemplos[:args.muestras]:
+                print(f"👤 {texto}\n🤖 {respuesta[:120]}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# app/scripts/stubs.py
+"""
+Dobles locales (sin red) de Gemini para los scripts de app/scripts:
+un backend de CachedContent y un modelo falso que reporta usage_metadata como Gemini
+(los tokens del prefijo cacheado aparecen en cached_content_token_count).
+Los tokens salen de gemini.estimate_tokens: sirven para comparar, no son los que facturaría Google.
+"""
+import json
+import re
+import types
+
+import google.generativeai as genai
+
+from app.services.gemini import estimate_tokens
+
+
+class StubCachedContentBackend:
+    """
+    Backend de CachedContent local (para PrefixCache en app/scripts/bench_context_cache.py).
+    Simula los handles y devuelve modelos falsos que reportan usage_metadata como Gemini:
+    los tokens del prefijo cacheado aparecen en cached_content_token_count.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.created = 0
+        self.refreshed = 0
+
+    def create(self, model_name: str, system_instruction: str, tools_schema: list, ttl: float) -> dict:
+        if self.fail:
+            raise RuntimeError("CachedContent no disponible (stub)")
+        self.created += 1
+        tokens = estimate_tokens(system_instruction, json.dumps(tools_schema or [], ensure_ascii=False))
+        return {"name": f"cachedContents/stub-{self.created}", "token_count": tokens}
+
+    def refresh(self, handle: dict, ttl: float):
+        self.refreshed += 1
+
+    def model(self, handle: dict):
+        return StubModel(prefix_tokens=handle["token_count"], cached=True)
+
+
+class StubModel:
+    """
+    Modelo falso: contesta siempre lo mismo y cuenta tokens como lo haría Gemini.
+    `failures`: excepciones a lanzar (en orden, una por llamada) antes de empezar a contestar.
+    """
+
+    def __init__(self, prefix_tokens: int, cached: bool, reply: str = "Dale, bro", failures: list = None):
+        self.prefix_tokens = prefix_tokens
+        self.cached = cached
+        self.reply = reply
+        self.failures = list(failures or [])
+        self.calls = 0
+
+    def start_chat(self, history: list = None):
+        return _StubChat(self, history or [])
+
+
+class _StubChat:
+    def __init__(self, model: StubModel, history: list):
+        self.model = model
+        self.history_tokens = estimate_tokens(*[p for msg in history for p in msg["parts"]])
+
+    async def send_message_async(self, content, **kwargs):
+        self.model.calls += 1
+        if self.model.failures:
+            raise self.model.failures.pop(0)
+        nuevos = estimate_tokens(str(content))
+        prompt = self.model.prefix_tokens + self.history_tokens + nuevos
+        self.history_tokens += nuevos
+        usage = genai.protos.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt,
+            cached_content_token_count=self.model.prefix_tokens if self.model.cached else 0,
+            total_token_count=prompt + estimate_tokens(self.model.reply),
+        )
+        return _StubResponse(self.model.reply, usage)
+
+
+class _StubResponse:
+    def __init__(self, text: str, usage):
+        self.text = text
+        self.usage_metadata = usage
+        self.candidates = []
+
+    async def __aiter__(self):
+        """Streaming: la respuesta de a una palabra, como fragmentos de Gemini."""
+        for word in re.findall(r"\S+\s*", self.text):
+            part = types.SimpleNamespace(text=word, function_call=None)
+            yield types.SimpleNamespace(candidates=[types.SimpleNamespace(content=types.SimpleNamespace(parts=[part]))])
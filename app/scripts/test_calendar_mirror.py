@@ -0,0 +1,99 @@
+# app/scripts/test_calendar_mirror.py
+"""
+Prueba offline (sin Google) del espejo de agenda con FakeCalendarBackend:
+sincronización completa, incremental por syncToken, token vencido (410), espejo desactualizado,
+consultar_disponibilidad desde el espejo y el chequeo en vivo de agendar_evento cuando freebusy falla.
+
+Uso:
+    python app/scripts/test_calendar_mirror.py
+"""
+import datetime
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+load_dotenv()
+
+from app.services import calendar
+from app.services.calendar_mirror import CalendarMirror, FakeCalendarBackend
+
+fallas = 0
+
+
+def check(descripcion: str, ok: bool):
+    global fallas
+    print(f"{'✅' if ok else '❌'} {descripcion}")
+    if not ok:
+        fallas += 1
+
+
+def main():
+    print("🧪 TEST DEL ESPEJO DE AGENDA (FakeCalendarBackend)")
+    print("=" * 50)
+
+    manana = datetime.datetime.now(calendar.TZ_ARG).date() + datetime.timedelta(days=1)
+
+    def a_las(hora: int) -> datetime.datetime:
+        return datetime.datetime.combine(manana, datetime.time(hora), tzinfo=calendar.TZ_ARG)
+
+    backend = FakeCalendarBackend()
+    backend.add_event("ev-10", a_las(10), a_las(11))
+    backend.add_event("ev-libre", a_las(12), a_las(13), transparent=True)  # Marcado como 'libre'
+    mirror = CalendarMirror(backend, calendar_id="fake", max_staleness=300, persist=False)
+
+    # 1. Sincronización completa
+    check("Sin sincronizar, el espejo se declara desactualizado", mirror.busy_intervals(a_las(9), a_las(20)) is None)
+    mirror.sync()
+    check("Sync completa: un solo ocupado (el evento 'libre' no cuenta)",
+          mirror.busy_intervals(a_las(9), a_las(20)) == [(a_las(10), a_las(11))])
+
+    # 2. consultar_disponibilidad responde desde el espejo (sin ir a Google)
+    respuesta = calendar.consultar_disponibilidad([{"date": manana.isoformat(), "specific_time": "10:00"}], mirror=mirror)
+    check(f"10:00 ocupado según el espejo -> {respuesta!r}", respuesta.startswith("❌"))
+    respuesta = calendar.consultar_disponibilidad([{"date": manana.isoformat(), "specific_time": "12:00"}], mirror=mirror)
+    check(f"12:00 libre según el espejo -> {respuesta!r}", respuesta.startswith("🗓️"))
+
+    # 3. Incremental por syncToken: solo viajan los cambios
+    backend.add_event("ev-15", a_las(15), a_las(16))
+    backend.remove_event("ev-10")
+    llamadas = backend.list_calls
+    mirror.sync()
+    check("Incremental: una sola llamada a list_events", backend.list_calls == llamadas + 1)
+    check("Incremental: alta de las 15 y baja de las 10 aplicadas",
+          mirror.busy_intervals(a_las(9), a_las(20)) == [(a_las(15), a_las(16))])
+
+    # 4. syncToken vencido (410): resincroniza completo solo
+    backend.expire_sync_tokens()
+    backend.add_event("ev-17", a_las(17), a_las(18))
+    mirror.sync()
+    check("Token vencido: resync completo con el estado correcto",
+          mirror.busy_intervals(a_las(9), a_las(20)) == [(a_las(15), a_las(16)), (a_las(17), a_las(18))])
+
+    # 5. Reserva del bot aplicada al instante (antes de la próxima sync)
+    mirror.apply_booking("ev-bot", a_las(9), a_las(10))
+    check("apply_booking se ve sin sincronizar", (a_las(9), a_las(10)) in mirror.busy_intervals(a_las(9), a_las(20)))
+
+    # 6. Espejo viejo: el llamador tiene que ir a Google
+    mirror.max_staleness = -1
+    check("Espejo desactualizado -> None", mirror.busy_intervals(a_las(9), a_las(20)) is None)
+
+    # 7. agendar_evento no reserva si el chequeo en vivo (freebusy) falla
+    original_busy, original_execute = calendar.get_busy_intervals, calendar.execute_request
+    insertados = []
+    calendar.get_busy_intervals = lambda *args, **kwargs: None
+    calendar.execute_request = lambda *args, **kwargs: insertados.append(args) or {"id": "x"}
+    try:
+        res = calendar.agendar_evento(a_las(11).isoformat(), "Test", "123")
+    finally:
+        calendar.get_busy_intervals, calendar.execute_request = original_busy, original_execute
+    check(f"freebusy caído -> no se crea el evento ({res['message']})", res["status"] == "error" and not insertados)
+
+    print("=" * 50)
+    print("✅ Todo OK" if not fallas else f"❌ {fallas} chequeo(s) fallaron")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# app/scripts/test_job_queue.py
+"""
+Prueba de la cola durable de conversaciones (app/services/jobs.py) intercalando claim() y enqueue():
+un bloque que llega con el trabajo anterior ya tomado no se le suma (se perdería al completarlo),
+va en un trabajo nuevo; y con varios workers y usuarios escribiendo a la vez, todo mensaje
+se procesa una sola vez y en orden.
+La carrera entre la subconsulta y el UPDATE de enqueue() solo se da en Postgres: para ejercitarla
+de verdad, correrlo con DATABASE_URL apuntando a una base Postgres DE PRUEBA (la cola tiene que estar vacía).
+
+Uso:
+    python app/scripts/test_job_queue.py
+"""
+import asyncio
+import os
+import random
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+load_dotenv()
+
+from sqlalchemy import func, select
+
+from app.core.database import AsyncSessionLocal, Base, engine
+from app.models.models import TrabajoConversacion  # También registra las tablas para create_all
+from app.services.jobs import JobQueue
+
+USUARIOS = 8
+MENSAJES = 15
+WORKERS = 3
+fallas = 0
+
+
+def check(descripcion: str, ok: bool):
+    global fallas
+    print(f"{'✅' if ok else '❌'} {descripcion}")
+    if not ok:
+        fallas += 1
+
+
+async def trabajos_vivos() -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(func.count(TrabajoConversacion.id)).where(TrabajoConversacion.estado.in_(("pendiente", "en_proceso")))
+        )
+        return result.scalar()
+
+
+async def main():
+    Base.metadata.create_all(bind=engine)
+    if await trabajos_vivos():
+        print("❌ La cola tiene trabajos vivos: correr contra una base de prueba")
+        return 1
+
+    print("🧪 TEST DE LA COLA DE CONVERSACIONES (claim / enqueue intercalados)")
+    print("=" * 50)
+    queue = JobQueue(visibility_timeout=30, max_attempts=3, backoff=0.1)
+    prefijo = f"test-jobs-{os.getpid()}"
+
+    # 1. Intercalado simple: encolar, tomar, encolar de nuevo
+    sender = f"{prefijo}-a"
+    await queue.enqueue(sender, "hola")
+    await queue.enqueue(sender, "tenés turno?")
+    tomados = await queue.claim("w1", limit=10)
+    check(f"Lo pendiente se junta en un trabajo ({[t['texto'] for t in tomados]})",
+          [t["texto"] for t in tomados] == ["hola tenés turno?"])
+    await queue.enqueue(sender, "el jueves")
+    check("Con el anterior tomado, el bloque nuevo no se le suma", await trabajos_vivos() == 2)
+    check("Mientras el anterior está en proceso, el nuevo no se puede tomar", not await queue.claim("w2", limit=10))
+    await queue.complete(tomados[0]["id"], "w1")
+    siguiente = await queue.claim("w2", limit=10)
+    check(f"Al completar el anterior sale el nuevo ({[t['texto'] for t in siguiente]})",
+          [t["texto"] for t in siguiente] == ["el jueves"])
+    await queue.complete(siguiente[0]["id"], "w2")
+
+    # 2. Varios usuarios escribiendo mientras varios workers toman y completan
+    recibidos = {}
+    escribiendo = [True]
+
+    async def usuario(n: int):
+        for i in range(MENSAJES):
+            await queue.enqueue(f"{prefijo}-u{n}", f"m{i}")
+            await asyncio.sleep(random.uniform(0, 0.01))
+
+    async def worker(nombre: str):
+        while escribiendo[0] or await trabajos_vivos():
+            for trabajo in await queue.claim(nombre, limit=4):
+                await asyncio.sleep(random.uniform(0, 0.005))  # "procesando"
+                recibidos.setdefault(trabajo["sender_id"], []).extend(trabajo["texto"].split())
+                await queue.complete(trabajo["id"], nombre)
+            await asyncio.sleep(0.001)
+
+    workers = [asyncio.create_task(worker(f"w{i}")) for i in range(WORKERS)]
+    await asyncio.gather(*[usuario(n) for n in range(USUARIOS)])
+    escribiendo[0] = False
+    await asyncio.gather(*workers)
+
+    esperado = [f"m{i}" for i in range(MENSAJES)]
+    perdidos = {s: len(esperado) - len(r) for s, r in recibidos.items() if r != esperado}
+    check(f"{USUARIOS} usuarios x {MENSAJES} mensajes: todos procesados una vez y en orden {perdidos or ''}",
+          len(recibidos) == USUARIOS and not perdidos)
+
+    print("=" * 50)
+    print("✅ Todo OK" if not fallas else f"❌ {fallas} chequeo(s) fallaron")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,140 @@
+# app/scripts/test_resilience.py
+"""
+Prueba offline (sin Gemini) de la resiliencia del pipeline: clasificación de errores y backoff,
+el circuit breaker (closed -> open -> half_open -> closed), la cola de reintento por caída
+(OutageQueue) y gemini._send con el modelo stub (reintentos y qué errores cierran el circuito).
+
+Uso:
+    python app/scripts/test_resilience.py
+"""
+import asyncio
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+load_dotenv()
+
+from app.core.config import settings
+from app.scripts.stubs import StubModel
+from app.services import gemini
+from app.services.admission import PRIORIDAD_NORMAL
+from app.services.resilience import CircuitBreaker, CircuitOpen, OutageQueue, backoff_delay, is_retryable
+
+RESET = 0.2
+fallas = 0
+
+
+def check(descripcion: str, ok: bool):
+    global fallas
+    print(f"{'✅' if ok else '❌'} {descripcion}")
+    if not ok:
+        fallas += 1
+
+
+class ErrorHTTP(Exception):
+    """Como las de google.api_core: el código HTTP en `.code`."""
+
+    def __init__(self, code: int):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+async def main():
+    print("🧪 TEST DE RESILIENCIA (reintentos, breaker, cola de caída)")
+    print("=" * 50)
+
+    # 1. Clasificación y backoff
+    check("429 / 503 / ConnectionError / timeout se reintentan",
+          all(is_retryable(e) for e in (ErrorHTTP(429), ErrorHTTP(503), ConnectionError(), asyncio.TimeoutError())))
+    check("400 / 404 / ValueError no se reintentan",
+          not any(is_retryable(e) for e in (ErrorHTTP(400), ErrorHTTP(404), ValueError())))
+    check("Backoff con jitter dentro de [0, min(cap, base*2^n)]",
+          backoff_delay(3, 0.5, 8.0, rng=lambda: 1.0) == 4.0 and backoff_delay(10, 0.5, 8.0, rng=lambda: 1.0) == 8.0
+          and backoff_delay(3, 0.5, 8.0, rng=lambda: 0.0) == 0.0)
+
+    # 2. Breaker: closed -> open -> half_open -> closed
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=RESET)
+    for _ in range(2):
+        breaker.record_failure()
+    check("2 fallas (umbral 3) -> closed", breaker.state == "closed")
+    breaker.record_failure()
+    check("3 fallas -> open", breaker.state == "open")
+    try:
+        breaker.before_call()
+        check("Abierto corta en seco", False)
+    except CircuitOpen:
+        check("Abierto corta en seco (CircuitOpen)", True)
+    await asyncio.sleep(RESET)
+    check("Pasado el enfriamiento -> half_open", breaker.state == "half_open")
+    breaker.before_call()
+    try:
+        breaker.before_call()
+        check("Medio abierto: una sola llamada de prueba", False)
+    except CircuitOpen:
+        check("Medio abierto: una sola llamada de prueba", True)
+    breaker.record_failure()
+    check("La prueba falla -> open otra vez", breaker.state == "open")
+    await asyncio.sleep(RESET)
+    breaker.before_call()
+    breaker.record_success()
+    check("La prueba sale bien -> closed", breaker.state == "closed" and breaker.failures == 0)
+
+    # 3. Cola de caída: con el circuito medio abierto sale uno (la prueba), al cerrar salen todos
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=RESET)
+    queue = OutageQueue("test", breaker, max_parked=2)
+    breaker.record_failure()
+    atendidos = []
+
+    async def handler(sender_id: str, text: str):
+        breaker.before_call()  # Como _send: re-ejecutar es volver a llamar al servicio
+        atendidos.append((sender_id, text))
+        breaker.record_success()
+
+    queue.park("u1", "hola", handler)
+    queue.park("u1", "tenés turno?", handler)
+    queue.park("u2", "precio?", handler)
+    check("Cola llena (max 2 usuarios) -> rechaza el tercero", not queue.park("u3", "hola", handler))
+    check("Un solo aviso por caída", queue.notify_once("u1") and not queue.notify_once("u1"))
+    await asyncio.sleep(RESET / 2)
+    check("Circuito abierto: no re-ejecuta nada", not atendidos)
+    await asyncio.sleep(RESET)
+    check(f"Al volver: bloques re-ejecutados en orden y unidos por usuario {atendidos}",
+          sorted(atendidos) == [("u1", "hola tenés turno?"), ("u2", "precio?")] and len(queue) == 0)
+
+    # 4. gemini._send con el modelo stub
+    settings.GEMINI_RETRY_BASE_SECONDS = 0.01
+    gemini.breaker = CircuitBreaker("gemini", failure_threshold=2, reset_timeout=RESET)
+
+    async def enviar(failures: list):
+        model = StubModel(prefix_tokens=10, cached=False, failures=failures)
+        chat = model.start_chat()
+        try:
+            return model, await gemini._send(chat, "hola", "test", PRIORIDAD_NORMAL, 10)
+        except Exception as e:
+            return model, e
+
+    model, res = await enviar([ErrorHTTP(503)])
+    check(f"503 suelto: reintenta y contesta ({model.calls} llamadas)", getattr(res, "text", None) == "Dale, bro" and model.calls == 2)
+    model, res = await enviar([ErrorHTTP(400)])
+    check("400: no reintenta", isinstance(res, ErrorHTTP) and model.calls == 1)
+
+    gemini.breaker.record_failure()
+    gemini.breaker.record_failure()
+    await asyncio.sleep(RESET)
+    model, res = await enviar([ValueError("respuesta rara")])
+    check("Error sin código en la prueba: el circuito no se cierra",
+          isinstance(res, ValueError) and gemini.breaker.state == "half_open")
+    model, res = await enviar([ErrorHTTP(400)])
+    check("4xx en la prueba: el servicio contestó -> closed", isinstance(res, ErrorHTTP) and gemini.breaker.state == "closed")
+    model, res = await enviar([ErrorHTTP(503)] * settings.GEMINI_RETRY_MAX_ATTEMPTS)
+    check("503 seguidos: abre el circuito y corta los reintentos", isinstance(res, ErrorHTTP) and gemini.breaker.is_open)
+
+    print("=" * 50)
+    print("✅ Todo OK" if not fallas else f"❌ {fallas} chequeo(s) fallaron")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,76 @@
+# app/scripts/test_timer_wheel.py
+"""
+Prueba de la TimerWheel del MessageBuffer: ningún timer dispara antes de su `delay`,
+ni con la rueda recién despertada (quieta un rato) ni programando a mitad de un tick,
+y reprogramar / cancelar funcionan.
+
+Uso:
+    python app/scripts/test_timer_wheel.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.scheduler import TimerWheel
+
+TICK = 0.05
+fallas = 0
+
+
+def check(descripcion: str, ok: bool):
+    global fallas
+    print(f"{'✅' if ok else '❌'} {descripcion}")
+    if not ok:
+        fallas += 1
+
+
+async def main():
+    print("🧪 TEST DE LA TIMER WHEEL")
+    print("=" * 50)
+
+    disparos = {}
+    wheel = TimerWheel(on_expire=lambda key: disparos.__setitem__(key, time.monotonic()), tick=TICK, slots=64)
+
+    async def medir(key, delay: float) -> float:
+        programado = time.monotonic()
+        wheel.schedule(key, delay)
+        while key not in disparos:
+            await asyncio.sleep(TICK / 5)
+        return disparos[key] - programado
+
+    # 1. Rueda quieta un rato (el tick actual quedó atrás del reloj)
+    await asyncio.sleep(TICK * 7.5)
+    espera = await medir("quieta", 0.2)
+    check(f"Rueda quieta: delay 0.2s, disparó a los {espera:.3f}s", 0.2 <= espera <= 0.2 + 2 * TICK)
+
+    # 2. Programando a mitad de tick, varias veces
+    tempranos = []
+    for i in range(10):
+        await asyncio.sleep(TICK * 0.37)
+        espera = await medir(f"medio-{i}", 0.12)
+        if espera < 0.12:
+            tempranos.append(round(espera, 3))
+    check(f"A mitad de tick: ninguno antes de tiempo {tempranos or ''}", not tempranos)
+
+    # 3. Reprogramar corre el vencimiento
+    wheel.schedule("reprogramado", 0.1)
+    await asyncio.sleep(0.05)
+    espera = await medir("reprogramado", 0.2)
+    check(f"Reprogramar: disparó a los {espera:.3f}s del último schedule", espera >= 0.2)
+
+    # 4. Cancelar
+    wheel.schedule("cancelado", 0.05)
+    wheel.cancel("cancelado")
+    await asyncio.sleep(0.2)
+    check("Cancelar: no disparó", "cancelado" not in disparos and len(wheel) == 0)
+
+    print("=" * 50)
+    print("✅ Todo OK" if not fallas else f"❌ {fallas} chequeo(s) fallaron")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,120 @@
+# app/scripts/test_webhook_latency.py
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+load_dotenv()
+
+import httpx
+
+from app.core.database import Base, engine
+from app.main import app
+# Sin usar por nombre: importarlo registra las tablas en Base.metadata para el create_all de main()
+# (`import app.models.models` taparía el `app` de FastAPI)
+from app.models import models  # noqa: F401  (registra tablas)
+from app.routers import webhook
+from app.services import calendar, tools
+
+# Simulamos un Google Calendar lento (bloqueante, como el SDK real)
+SLOW_CALL_SECONDS = 1.5
+SLOW_TOOL_CALLS = 6
+PROBE_EVERY = 0.05
+PROBE_SENDERS = 5
+
+# Meta firma cada POST con el App Secret (header X-Hub-Signature-256); mandamos la misma forma
+APP_SECRET = os.getenv("INSTAGRAM_APP_SECRET", "bench-secret")
+_mids = itertools.count()
+
+
+def slow_consultar_disponibilidad(filtros, mirror=None):
+    time.sleep(SLOW_CALL_SECONDS)
+    return "🗓️ Lunes 01/01: 10:00"
+
+
+def mensaje_firmado() -> tuple:
+    """Un evento de mensaje como los de Meta (mid nuevo cada vez: no lo corta la deduplicación) y su firma."""
+    n = next(_mids)
+    payload = {
+        "object": "instagram",
+        "entry": [{
+            "id": "bench-page",
+            "time": int(time.time() * 1000),
+            "messaging": [{
+                "sender": {"id": f"bench-sender-{n % PROBE_SENDERS}"},
+                "recipient": {"id": "bench-page"},
+                "timestamp": int(time.time() * 1000),
+                "message": {"mid": f"bench-mid-{os.getpid()}-{n}", "text": "Que onda, tenes turno el jueves?"},
+            }],
+        }],
+    }
+    body = json.dumps(payload).encode("utf-8")
+    firma = "sha256=" + hmac.new(APP_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return body, {"Content-Type": "application/json", "X-Hub-Signature-256": firma}
+
+
+async def probe_webhook(client: httpx.AsyncClient, stop: asyncio.Event) -> list:
+    """
+    Postea un mensaje firmado al POST /webhook cada PROBE_EVERY s y mide la latencia
+    (recorrido real: parseo, deduplicación, insert en DB y buffer).
+    """
+    latencies = []
+    while not stop.is_set():
+        body, headers = mensaje_firmado()
+        started = time.perf_counter()
+        response = await client.post("/webhook", content=body, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200 or response.json().get("status") != "received":
+            print(f"⚠️ Respuesta inesperada del webhook: {response.status_code} {response.text}")
+        await asyncio.sleep(PROBE_EVERY)
+    return latencies
+
+
+def resumen(nombre: str, latencies: list):
+    ordenadas = sorted(latencies)
+    p95 = ordenadas[int(len(ordenadas) * 0.95) - 1]
+    print(f"{nombre:<32} n={len(ordenadas):<4} p50={statistics.median(ordenadas) * 1000:7.2f}ms "
+          f"p95={p95 * 1000:7.2f}ms max={ordenadas[-1] * 1000:7.2f}ms")
+
+
+async def medir(con_tools: bool) -> list:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_webhook(client, stop))
+
+        if con_tools:
+            await asyncio.gather(*[
+                tools.handle_tool_call("consultar_disponibilidad", {"fecha": "2030-01-01"}, "bench")
+                for _ in range(SLOW_TOOL_CALLS)
+            ])
+        else:
+            await asyncio.sleep(SLOW_CALL_SECONDS * 2)
+
+        stop.set()
+        return await probe
+
+
+async def main():
+    Base.metadata.create_all(bind=engine)
+    calendar.consultar_disponibilidad = slow_consultar_disponibilidad
+    # Los bloques del buffer no siguen a Gemini: acá solo medimos el webhook
+    webhook.buffer_manager.on_block = lambda sender_id, text: None
+
+    print("⏱️ LATENCIA DEL WEBHOOK MIENTRAS CORREN TOOLS LENTAS")
+    print("=" * 50)
+    resumen("Sin tools (base)", await medir(con_tools=False))
+    resumen(f"{SLOW_TOOL_CALLS} tools de {SLOW_CALL_SECONDS}s en paralelo", await medir(con_tools=True))
+    print("\n💡 Si el p95 con tools queda cerca de la base, el event loop no se está bloqueando.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
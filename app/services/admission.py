@@ -0,0 +1,161 @@
+# app/services/admission.py
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from app.core.metrics import metrics
+
+# Prioridades (menor = antes)
+PRIORIDAD_CONTINUACION = 0  # Respuesta a una tool: la conversación ya está a mitad de camino
+PRIORIDAD_RESERVA = 1  # Reserva en curso (fechas, horarios, confirmaciones)
+PRIORIDAD_NORMAL = 2  # Saludos, consultas sueltas
+PRIORIDAD_FONDO = 3  # Tareas de fondo (resúmenes de historial): nunca antes que un usuario
+
+# Buckets (segundos) para la espera en la cola de admisión
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+
+class AdmissionRejected(Exception):
+    """La llamada no entró: cola llena o esperó demasiado."""
+
+
+class Permit:
+    """Permiso concedido por el scheduler; `report(tokens)` ajusta la estimación con el uso real."""
+
+    def __init__(self, reserved: int):
+        self.reserved = reserved
+        self.used: Optional[int] = None
+
+    def report(self, tokens: Optional[int]):
+        if tokens:
+            self.used = tokens
+
+
+class AdmissionScheduler:
+    """
+    Control de admisión para una API con cuota (Gemini):
+    - A lo sumo `max_in_flight` llamadas simultáneas.
+    - Presupuesto de `tokens_per_minute` (token bucket): cada llamada reserva su estimación
+      y al terminar se corrige con lo que realmente consumió.
+    - Cola con prioridad: primero las continuaciones de tools, después las reservas en curso, después el resto.
+    - Dentro de una prioridad, fair queuing por usuario (start-time fair queuing): un usuario que manda
+      muchas llamadas no le pasa por encima a los demás.
+    - Rechaza si la cola supera `max_queue` o si una llamada espera más de `max_wait` segundos.
+    Métricas: <name>.queue_wait_seconds, <name>.rejected.queue_full / .timeout, gauges de in_flight y cola.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, tokens_per_minute: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self.in_flight = 0
+        self._heap: List[list] = []  # [prioridad, tag, seq, future, tokens]
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._sender_tags: Dict[str, float] = {}
+        self._refill_handle = None
+
+    def __len__(self):
+        return sum(1 for entry in self._heap if not entry[3].done())
+
+    def _update_gauges(self):
+        metrics.set_gauge(f"{self.name}.in_flight", self.in_flight)
+        metrics.set_gauge(f"{self.name}.queue_depth", len(self))
+        metrics.set_gauge(f"{self.name}.tokens_available", round(self.tokens))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _fair_tag(self, sender_id: str) -> float:
+        """Tag de inicio del usuario: avanza uno por llamada, nunca por detrás del reloj virtual."""
+        tag = max(self._virtual_time, self._sender_tags.get(sender_id, 0.0)) + 1
+        self._sender_tags[sender_id] = tag
+        if len(self._sender_tags) > 10_000:
+            # Los que quedaron por detrás del reloj virtual ya no tienen nada que reclamar
+            self._sender_tags = {s: t for s, t in self._sender_tags.items() if t > self._virtual_time}
+        return tag
+
+    def _dispatch(self):
+        """Concede permisos en orden de la cola mientras haya lugar y presupuesto."""
+        while self._heap and self.in_flight < self.max_in_flight:
+            _, tag, _, future, tokens = self._heap[0]
+            if future.done():  # Se cansó de esperar (timeout/cancelación)
+                heapq.heappop(self._heap)
+                continue
+
+            self._refill()
+            if self.tokens < tokens:
+                # Sin presupuesto: no salteamos la prioridad, esperamos a que se recargue
+                if self._refill_handle is None:
+                    delay = (tokens - self.tokens) / self.rate
+                    self._refill_handle = asyncio.get_running_loop().call_later(delay, self._on_refill)
+                break
+
+            heapq.heappop(self._heap)
+            self.tokens -= tokens
+            self.in_flight += 1
+            self._virtual_time = tag
+            future.set_result(Permit(tokens))
+        self._update_gauges()
+
+    def _on_refill(self):
+        self._refill_handle = None
+        self._dispatch()
+
+    async def acquire(self, sender_id: str, priority: int, tokens: int) -> Permit:
+        if len(self) >= self.max_queue:
+            metrics.inc(f"{self.name}.rejected.queue_full")
+            raise AdmissionRejected("Cola llena")
+
+        # Una llamada más grande que todo el presupuesto igual tiene que poder entrar alguna vez
+        tokens = max(1, min(int(tokens), self.capacity))
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, [priority, self._fair_tag(sender_id), next(self._seq), future, tokens])
+        enqueued_at = time.monotonic()
+        self._dispatch()
+
+        try:
+            permit = await asyncio.wait_for(future, timeout=self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Nos concedieron el permiso justo cuando nos íbamos: lo devolvemos
+                self.release(future.result())
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.inc(f"{self.name}.rejected.timeout")
+                self._update_gauges()
+                raise AdmissionRejected(f"Esperó más de {self.max_wait:g}s")
+            raise
+        metrics.observe(f"{self.name}.queue_wait_seconds", time.monotonic() - enqueued_at, buckets=QUEUE_WAIT_BUCKETS)
+        return permit
+
+    def release(self, permit: Permit):
+        self.in_flight -= 1
+        if permit.used is not None:
+            # Corregimos la estimación: si gastó más, queda "deuda" en el bucket
+            self.tokens -= permit.used - permit.reserved
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, sender_id: str, priority: int, tokens: int):
+        """
+        Uso:
+            async with scheduler.slot(sender_id, PRIORIDAD_RESERVA, tokens_estimados) as permit:
+                response = await ...
+                permit.report(tokens_reales)
+        """
+        permit = await self.acquire(sender_id, priority, tokens)
+        try:
+            yield permit
+        finally:
+            self.release(permit)
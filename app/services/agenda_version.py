@@ -0,0 +1,71 @@
+# app/services/agenda_version.py
+import time
+
+from sqlalchemy import func, select, update
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import metrics
+from app.models.models import SyncAgendaBarberia
+
+
+class AgendaVersion:
+    """
+    Versión compartida de la agenda (columna `version` de barberia_agenda_sync): sube con cada
+    reserva / cancelación / movida del bot, la haga el proceso que la haga (web o cualquier worker).
+    Lo que cada proceso arma en memoria a partir de la agenda (tools.tool_memo, availability.snapshot)
+    anota la versión con la que se armó y se descarta si cambió.
+    current() va a la DB como mucho una vez cada `ttl` segundos (una consulta por clave única).
+    Métricas: agenda_version.bumps / errors.
+    """
+
+    def __init__(self, calendar_id: str, ttl: float):
+        self.calendar_id = calendar_id
+        self.ttl = ttl
+        self._value = 0
+        self._read_at = float("-inf")
+
+    async def current(self, fresh: bool = False) -> int:
+        """La versión vigente. Si la DB no responde, la última conocida (el TTL de cada caché sigue valiendo)."""
+        if not fresh and time.monotonic() - self._read_at < self.ttl:
+            return self._value
+        T = SyncAgendaBarberia
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(T.version).where(T.calendar_id == self.calendar_id))
+                self._value = result.scalar() or 0
+            self._read_at = time.monotonic()
+        except Exception as e:
+            metrics.inc("agenda_version.errors")
+            print(f"⚠️ No se pudo leer la versión de la agenda: {e}")
+        return self._value
+
+    async def bump(self):
+        """La agenda cambió: sube la versión para todos los procesos."""
+        T = SyncAgendaBarberia
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(T)
+                    .where(T.calendar_id == self.calendar_id)
+                    .values(version=func.coalesce(T.version, 0) + 1)
+                    .returning(T.version)
+                    .execution_options(synchronize_session=False)
+                )
+                version = result.scalar()
+                if version is None:
+                    # Todavía no hay fila (el espejo nunca sincronizó): la creamos
+                    version = 1
+                    db.add(T(calendar_id=self.calendar_id, version=version))
+                await db.commit()
+            self._value, self._read_at = version, time.monotonic()
+            metrics.inc("agenda_version.bumps")
+        except Exception as e:
+            # Los demás procesos se enteran recién por el TTL de sus cachés
+            self._read_at = float("-inf")
+            metrics.inc("agenda_version.errors")
+            print(f"⚠️ No se pudo subir la versión de la agenda: {e}")
+
+
+# Instancia global (calendario de la Barbería)
+agenda_version = AgendaVersion(settings.BARBER_CALENDAR_ID, ttl=settings.AGENDA_VERSION_TTL_SECONDS)
@@ -0,0 +1,156 @@
+# app/services/availability.py
+import asyncio
+import datetime
+import time
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.executors import run_blocking
+from app.core.metrics import metrics
+from app.services import calendar, calendar_mirror, negocio
+from app.services.agenda_version import agenda_version
+
+# Mismo horario que consultar_disponibilidad sin rango (día entero)
+HORARIO = negocio.HORARIO
+
+DIAS = ["lun", "mar", "mié", "jue", "vie", "sáb", "dom"]
+
+# Días sin atención (weekday())
+CERRADO = negocio.DIAS_CERRADO
+
+
+class AvailabilitySnapshot:
+    """
+    Foto precalculada de los próximos turnos libres (hasta `slots_per_day` por día, `days` días de atención),
+    para que el modelo ofrezca horarios sin gastar una ida y vuelta en consultar_disponibilidad.
+    - Se arma con la misma lógica que la tool: build_slots + free_slots sobre UNA consulta de ocupados
+      para toda la ventana (del espejo local si está fresco; si no, de Google).
+    - Se renueva de fondo (run_forever) cada `interval` segundos y apenas el bot agenda/cancela/mueve (invalidate()).
+      Si el cambio lo hizo otro proceso, se nota por la versión compartida de la agenda (agenda_version):
+      context_text() deja de mostrarla y el rearmado consulta a Google (el espejo de acá todavía no lo vio).
+    - No se muestra si tiene más de `max_age` segundos o si quedó invalidada: el modelo usa la tool como siempre.
+    Métricas: availability.refreshes / errors / invalidations / injected / skipped_stale, gauge availability.age_seconds.
+    """
+
+    def __init__(self, days: int, slots_per_day: int, max_age: float, mirror=None):
+        self.days = days
+        self.slots_per_day = slots_per_day
+        self.max_age = max_age
+        self.mirror = mirror
+        self.built_at: Optional[float] = None  # monotonic
+        self._text: Optional[str] = None
+        self._stale = True
+        self._generation = 0
+        self._version: Optional[int] = None  # Versión de agenda con la que se armó la foto
+        self._wake = asyncio.Event()
+
+    # --- Armado (bloqueante: corre en el pool 'calendar') ---
+
+    def build(self, live: bool = False) -> List[Tuple[datetime.date, List[str]]]:
+        """`live`: ir directo a Google aunque el espejo esté fresco."""
+        now = datetime.datetime.now(calendar.TZ_ARG)
+        plan = []
+        dia = now.date()
+        while len(plan) < self.days:
+            if dia.weekday() not in CERRADO:
+                plan.append((dia, [s for s in calendar.build_slots(dia, time_range=HORARIO) if s > now]))
+            dia += datetime.timedelta(days=1)
+
+        todos = [slot for _, slots in plan for slot in slots]
+        if not todos:
+            return [(dia, []) for dia, _ in plan]
+        time_min = min(todos)
+        time_max = max(todos) + datetime.timedelta(minutes=calendar.SLOT_MINUTES)
+
+        busy = self.mirror.busy_intervals(time_min, time_max) if self.mirror and not live else None
+        if busy is None:
+            service = calendar.get_calendar_service()
+            if not service:
+                raise RuntimeError("Error de conexión con Google Calendar.")
+            busy = calendar.get_busy_intervals(service, settings.BARBER_CALENDAR_ID, time_min, time_max)
+            if busy is None:
+                raise RuntimeError("Google no devolvió los ocupados.")
+
+        return [
+            (dia, [slot.strftime("%H:%M") for slot in calendar.free_slots(slots, busy)][:self.slots_per_day])
+            for dia, slots in plan
+        ]
+
+    @staticmethod
+    def render(dias: List[Tuple[datetime.date, List[str]]]) -> str:
+        """Versión compacta para el prompt: 'mar 21/10: 10, 11, 15, 17' (una línea por día)."""
+        lineas = []
+        for dia, slots in dias:
+            horas = ", ".join(h[:-3] if h.endswith(":00") else h for h in slots) or "sin lugar"
+            lineas.append(f"{DIAS[dia.weekday()]} {dia.strftime('%d/%m')}: {horas}")
+        return "\n".join(lineas)
+
+    # --- Estado ---
+
+    def invalidate(self):
+        """La agenda cambió (reserva/cancelación del bot): no se muestra más y se rearma ya."""
+        self._generation += 1
+        self._stale = True
+        self._wake.set()
+        metrics.inc("availability.invalidations")
+
+    def age(self) -> Optional[float]:
+        return None if self.built_at is None else time.monotonic() - self.built_at
+
+    async def context_text(self) -> Optional[str]:
+        """El bloque para el prompt, o None si no hay foto confiable (vieja, invalidada o de otra versión de agenda)."""
+        if not self._stale and await agenda_version.current() != self._version:
+            self.invalidate()  # Otro proceso agendó/canceló/movió
+        age = self.age()
+        if self._stale or age is None or age > self.max_age:
+            metrics.inc("availability.skipped_stale")
+            return None
+        metrics.inc("availability.injected")
+        metrics.set_gauge("availability.age_seconds", round(age, 1))
+        return self._text
+
+    # --- Tarea de fondo ---
+
+    async def refresh(self):
+        generation = self._generation
+        version = await agenda_version.current(fresh=True)
+        # Si la agenda cambió desde la última foto, el espejo local puede no tenerlo todavía
+        live = self._version is not None and version != self._version
+        dias = await run_blocking("calendar", self.build, live)
+        if generation != self._generation:
+            # Se agendó/canceló mientras armábamos: esta foto puede tener un turno que ya no está
+            return
+        self._text = self.render(dias)
+        self._version = version
+        self.built_at = time.monotonic()
+        self._stale = False
+        metrics.inc("availability.refreshes")
+
+    async def run_forever(self, interval: float):
+        while True:
+            self._wake.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                metrics.inc("availability.errors")
+                print(f"⚠️ Error armando la foto de disponibilidad: {e}")
+            try:
+                # Cada `interval`, o antes si una reserva la invalidó
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def build_snapshot() -> Optional[AvailabilitySnapshot]:
+    if not settings.AVAILABILITY_SNAPSHOT_ENABLED:
+        return None
+    return AvailabilitySnapshot(
+        days=settings.AVAILABILITY_SNAPSHOT_DAYS,
+        slots_per_day=settings.AVAILABILITY_SNAPSHOT_SLOTS_PER_DAY,
+        max_age=settings.AVAILABILITY_SNAPSHOT_MAX_AGE_SECONDS,
+        mirror=calendar_mirror.mirror if settings.CALENDAR_MIRROR_ENABLED else None,
+    )
+
+
+# Instancia global (None si está deshabilitada)
+snapshot = build_snapshot()
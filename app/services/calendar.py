@@ -1,11 +1,16 @@
 import datetime
 import os.path
-from typing import List, Optional
+import threading
+from typing import List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from app.core.config import settings
+from app.core.metrics import metrics
 
 # --- CONFIGURACIÓN ---
 SCOPES = ['https://www.googleapis.com/auth/calendar']
@@ -13,61 +18,194 @@ TZ_ARG = ZoneInfo("America/Argentina/Cordoba")
 WORK_HOURS = {"start": 9, "end": 20}
 
 
-def get_calendar_service():
-    """Autentica y retorna el servicio de Google Calendar."""
-    creds = None
-    service_account_path = settings.GOOGLE_APPLICATION_CREDENTIALS
+class CalendarServiceCache:
+    """
+    Cache de proceso para las credenciales y el cliente de Google Calendar.
+    - Las credenciales se leen del JSON UNA sola vez y se refrescan antes de vencer.
+    - El cliente se construye con el discovery estático (sin ir a internet) y se
+      guarda uno por hilo, porque los objetos de googleapiclient no son thread-safe.
+    - Ante un error de autenticación se invalida todo y se reconstruye.
+    """
+    REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._creds = None
+        # Cada invalidación sube la generación: los clientes por hilo viejos se descartan
+        self._generation = 0
+        self._local = threading.local()
 
-    if os.path.exists(service_account_path):
-        creds = service_account.Credentials.from_service_account_file(
+    def _load_credentials(self):
+        service_account_path = settings.GOOGLE_APPLICATION_CREDENTIALS
+
+        if not os.path.exists(service_account_path):
+            print(f"❌ Error CRÍTICO: No se encuentra el JSON en {service_account_path}")
+            return None
+
+        metrics.inc("calendar.credential_loads")
+        return service_account.Credentials.from_service_account_file(
             service_account_path, scopes=SCOPES
         )
-    else:
-        print(f"❌ Error CRÍTICO: No se encuentra el JSON en {service_account_path}")
+
+    def _refresh_if_needed(self, creds):
+        """Refresca el token si no hay uno o si vence dentro del margen."""
+        now_utc = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)  # google-auth usa UTC naive
+        if creds.valid and creds.expiry and creds.expiry - now_utc > self.REFRESH_MARGIN:
+            return
+        creds.refresh(GoogleAuthRequest())
+        metrics.inc("calendar.token_refreshes")
+
+    def get_service(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_credentials()
+                if self._creds is None:
+                    return None
+            self._refresh_if_needed(self._creds)
+            creds = self._creds
+            generation = self._generation
+
+        local = self._local
+        if getattr(local, "generation", None) == generation and local.service is not None:
+            metrics.inc("calendar.service_cache_hits")
+            return local.service
+
+        local.service = build(
+            'calendar', 'v3',
+            credentials=creds,
+            static_discovery=True,
+            cache_discovery=False
+        )
+        local.generation = generation
+        metrics.inc("calendar.service_rebuilds")
+        return local.service
+
+    def invalidate(self):
+        """Descarta credenciales y clientes (se reconstruyen en el próximo uso)."""
+        with self._lock:
+            self._creds = None
+            self._generation += 1
+        metrics.inc("calendar.auth_invalidations")
+
+
+# Instancia global del cache
+_service_cache = CalendarServiceCache()
+
+
+def get_calendar_service():
+    """Retorna el servicio de Google Calendar (cacheado por proceso)."""
+    try:
+        return _service_cache.get_service()
+    except Exception as e:
+        print(f"❌ Error autenticando con Google Calendar: {e}")
+        _service_cache.invalidate()
         return None
 
-    return build('calendar', 'v3', credentials=creds)
+
+def _is_auth_error(error: Exception) -> bool:
+    if isinstance(error, RefreshError):
+        return True
+    return isinstance(error, HttpError) and error.resp.status == 401
+
+
+def execute_request(request_factory, service=None):
+    """
+    Ejecuta una request de la API (`request_factory(service)`).
+    Si falla por autenticación, reconstruye el cliente y reintenta UNA vez.
+    """
+    service = service or get_calendar_service()
+    if not service:
+        raise RuntimeError("Error de conexión con Google Calendar.")
+
+    try:
+        return request_factory(service).execute()
+    except Exception as e:
+        if not _is_auth_error(e):
+            raise
+        print(f"🔑 Error de autenticación con Google ({e}). Reconstruyendo cliente...")
+        _service_cache.invalidate()
+        service = get_calendar_service()
+        if not service:
+            raise
+        return request_factory(service).execute()
 
 
 # --- LÓGICA DE DISPONIBILIDAD (BARBERÍA) ---
 
-def check_slot_availability(service, calendar_id, slot_start):
+SLOT_MINUTES = 60
+
+
+def _parse_rfc3339(value: str) -> datetime.datetime:
+    """Convierte los timestamps de Google ('2024-12-20T13:00:00Z') a datetime aware."""
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def merge_intervals(intervalos: List[Tuple[datetime.datetime, datetime.datetime]]):
     """
-    Verifica si el calendario específico está libre en ese horario.
-    Retorna True si está libre.
+    Ordena y fusiona intervalos superpuestos o contiguos.
+    [(9-10), (9:30-11), (14-15)] -> [(9-11), (14-15)]
     """
-    slot_end = slot_start + datetime.timedelta(minutes=60)
+    merged = []
+    for inicio, fin in sorted(intervalos):
+        if merged and inicio <= merged[-1][1]:
+            if fin > merged[-1][1]:
+                merged[-1] = (merged[-1][0], fin)
+        else:
+            merged.append((inicio, fin))
+    return merged
 
-    time_min = slot_start.isoformat()
-    time_end = slot_end.isoformat()
 
-    try:
-        events_result = service.events().list(
-            calendarId=calendar_id,
-            timeMin=time_min,
-            timeMax=time_end,
-            singleEvents=True
-        ).execute()
-        events = events_result.get('items', [])
-
-        # Si no hay eventos superpuestos, está libre
-        if not events:
-            return True
+def get_busy_intervals(service, calendar_id, time_min, time_max):
+    """
+    Trae en UNA sola consulta (freebusy) los intervalos ocupados de toda la ventana.
+    Retorna la lista ordenada y fusionada de (inicio, fin), o None si Google falló.
+    """
+    body = {
+        "timeMin": time_min.isoformat(),
+        "timeMax": time_max.isoformat(),
+        "timeZone": "America/Argentina/Cordoba",
+        "items": [{"id": calendar_id}],
+    }
 
+    try:
+        result = execute_request(lambda s: s.freebusy().query(body=body), service)
     except Exception as e:
-        print(f"Error consultando slot: {e}")
-        return False
+        print(f"Error consultando freebusy: {e}")
+        return None
+
+    calendario = result.get("calendars", {}).get(calendar_id, {})
+    if calendario.get("errors"):
+        print(f"Error consultando freebusy: {calendario['errors']}")
+        return None
 
-    return False
+    intervalos = [
+        (_parse_rfc3339(b["start"]), _parse_rfc3339(b["end"]))
+        for b in calendario.get("busy", [])
+    ]
+    return merge_intervals(intervalos)
 
 
-def search_availability(service, calendar_id, date_obj, specific_time=None, time_range=None):
+def free_slots(slots, busy, duration=datetime.timedelta(minutes=SLOT_MINUTES)):
     """
-    Busca disponibilidad basándose en hora exacta o rango.
+    Barrido de intervalos: recorre los slots (ordenados) y los ocupados (fusionados)
+    en una sola pasada. Un slot está libre si ningún ocupado se superpone con él.
+    """
+    libres = []
+    i = 0
+    for slot_start in slots:
+        slot_end = slot_start + duration
+        # Descartamos los ocupados que terminan antes de que arranque el slot
+        while i < len(busy) and busy[i][1] <= slot_start:
+            i += 1
+        if i == len(busy) or busy[i][0] >= slot_end:
+            libres.append(slot_start)
+    return libres
+
+
+def build_slots(date_obj, specific_time=None, time_range=None):
+    """
+    Genera los slots a revisar para un día, por hora exacta o por rango.
     """
-    resultados = []
-
-    # Generamos los slots a revisar
     slots_to_check = []
 
     if specific_time:
@@ -85,35 +223,56 @@ def search_availability(service, calendar_id, date_obj, specific_time=None, time
         current_dt = datetime.datetime.combine(date_obj, datetime.time(start_hour, 0), tzinfo=TZ_ARG)
         limit_dt = datetime.datetime.combine(date_obj, datetime.time(end_hour, 0), tzinfo=TZ_ARG)
 
-        while current_dt + datetime.timedelta(minutes=60) <= limit_dt:
+        while current_dt + datetime.timedelta(minutes=SLOT_MINUTES) <= limit_dt:
             slots_to_check.append(current_dt)
-            current_dt += datetime.timedelta(minutes=60)  # Saltos de 60 min
+            current_dt += datetime.timedelta(minutes=SLOT_MINUTES)  # Saltos de 60 min
+
+    return slots_to_check
+
+
+def search_availability(service, calendar_id, date_obj, specific_time=None, time_range=None, busy=None):
+    """
+    Busca disponibilidad basándose en hora exacta o rango.
+    Si no se pasan los ocupados (`busy`), los trae con una única consulta para ese día.
+    """
+    slots_to_check = build_slots(date_obj, specific_time, time_range)
+    if not slots_to_check:
+        return []
+
+    if busy is None:
+        busy = get_busy_intervals(
+            service, calendar_id,
+            slots_to_check[0],
+            slots_to_check[-1] + datetime.timedelta(minutes=SLOT_MINUTES)
+        )
+    # Si Google falló, ningún slot se da por libre (igual que antes)
+    if busy is None:
+        return []
 
-    # Verificamos disponibilidad
     disponibles = []
-    for slot in slots_to_check:
-        if check_slot_availability(service, calendar_id, slot):
-            disponibles.append(slot.strftime('%H:%M'))
-            # Si es rango, limitamos para no saturar
-            if time_range and len(disponibles) >= 4:
-                break
+    for slot in free_slots(slots_to_check, busy):
+        disponibles.append(slot.strftime('%H:%M'))
+        # Si es rango, limitamos para no saturar
+        if time_range and len(disponibles) >= 4:
+            break
 
     return disponibles
 
 def consultar_disponibilidad(
-        filtros: List[dict]
+        filtros: List[dict],
+        mirror=None
 ) -> str:
     """
     Consulta disponibilidad en el calendario de la Barbería.
     Ya no requiere db ni tipo_profesional.
+    Si se pasa un `mirror` actualizado, responde desde el espejo local sin ir a Google.
+    Si no, hace UNA sola consulta a Google por toda la ventana pedida y calcula los libres localmente.
     """
     calendar_id = settings.BARBER_CALENDAR_ID
+    service = None
 
-    service = get_calendar_service()
-    if not service: return "Error de conexión con Google Calendar."
-
-    mensajes_respuesta = []
-
+    # 1. Armamos el plan de búsqueda: (fecha, hora, rango, slots) por cada filtro
+    plan = []
     for filtro in filtros:
         date_str = filtro.get("date")
         specific_time = filtro.get("specific_time")
@@ -129,13 +288,33 @@ def consultar_disponibilidad(
             dates_to_check = [today + datetime.timedelta(days=i) for i in range(3)]
 
         for check_date in dates_to_check:
-            slots = search_availability(service, calendar_id, check_date, specific_time, time_range)
+            plan.append((check_date, specific_time, time_range, build_slots(check_date, specific_time, time_range)))
+
+    # 2. Una sola consulta de ocupados para toda la ventana
+    todos_los_slots = [slot for *_, slots in plan for slot in slots]
+    busy = []
+    if todos_los_slots:
+        time_min = min(todos_los_slots)
+        time_max = max(todos_los_slots) + datetime.timedelta(minutes=SLOT_MINUTES)
+
+        busy = mirror.busy_intervals(time_min, time_max) if mirror else None
+        if busy is None:
+            service = get_calendar_service()
+            if not service: return "Error de conexión con Google Calendar."
+            busy = get_busy_intervals(service, calendar_id, time_min, time_max)
+            # Sin ocupados no se puede calcular nada (y search_availability volvería a consultar por fecha)
+            if busy is None: return "Error de conexión con Google Calendar."
+
+    # 3. Cálculo local de libres
+    mensajes_respuesta = []
+    for check_date, specific_time, time_range, _ in plan:
+        slots = search_availability(service, calendar_id, check_date, specific_time, time_range, busy=busy)
 
-            if slots:
-                slots_str = ", ".join(slots)
-                mensajes_respuesta.append(f"🗓️ {check_date.strftime('%A %d/%m')}: {slots_str}")
-            elif specific_time:
-                mensajes_respuesta.append(f"❌ El {check_date.strftime('%d/%m')} a las {specific_time} está ocupado.")
+        if slots:
+            slots_str = ", ".join(slots)
+            mensajes_respuesta.append(f"🗓️ {check_date.strftime('%A %d/%m')}: {slots_str}")
+        elif specific_time:
+            mensajes_respuesta.append(f"❌ El {check_date.strftime('%d/%m')} a las {specific_time} está ocupado.")
 
     if not mensajes_respuesta:
         return "No encontré horarios disponibles con esos criterios. ¿Podrías probar otro día u horario?"
@@ -148,7 +327,6 @@ def agendar_evento(start_time: str, client_name: str, client_phone: str, client_
     Reserva el turno cumpliendo RF-1.4 (Título con nombre y teléfono).
     """
     calendar_id = settings.BARBER_CALENDAR_ID
-    service = get_calendar_service()
 
     dt_start = datetime.datetime.fromisoformat(start_time)
     dt_end = dt_start + datetime.timedelta(minutes=60)
@@ -174,7 +352,16 @@ def agendar_evento(start_time: str, client_name: str, client_phone: str, client_
     }
 
     try:
-        event = service.events().insert(calendarId=calendar_id, body=event_body).execute()
+        # Chequeo en vivo contra Google justo antes de reservar (el espejo puede tener segundos de atraso)
+        aware_start = dt_start if dt_start.tzinfo else dt_start.replace(tzinfo=TZ_ARG)
+        ocupados = get_busy_intervals(None, calendar_id, aware_start, aware_start + datetime.timedelta(minutes=60))
+        if ocupados is None:
+            # Sin poder verificar no reservamos: un "libre" por error es un turno pisado
+            return {"status": "error", "message": "No pude verificar la disponibilidad en el calendario."}
+        if ocupados:
+            return {"status": "error", "message": "El horario ya está ocupado."}
+
+        event = execute_request(lambda s: s.events().insert(calendarId=calendar_id, body=event_body))
         return {
             "status": "success",
             "message": "Turno agendado correctamente",
@@ -191,10 +378,9 @@ def cancelar_evento(event_id: str) -> dict:
     Elimina el evento del calendario de la Barbería.
     """
     calendar_id = settings.BARBER_CALENDAR_ID
-    service = get_calendar_service()
 
     try:
-        service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
+        execute_request(lambda s: s.events().delete(calendarId=calendar_id, eventId=event_id))
         return {"status": "success", "message": "Turno cancelado correctamente."}
     except Exception as e:
         if "404" in str(e) or "410" in str(e):
@@ -0,0 +1,396 @@
+# app/services/calendar_mirror.py
+import asyncio
+import datetime
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.executors import run_blocking
+from app.core.metrics import metrics
+from app.models.models import OcupadoAgendaBarberia, SyncAgendaBarberia
+from app.services import calendar
+
+# Cuánto hacia atrás traemos en la sincronización completa
+SYNC_LOOKBACK = datetime.timedelta(days=1)
+
+
+class SyncTokenExpired(Exception):
+    """Google invalidó el syncToken (HTTP 410): hay que hacer una sincronización completa."""
+
+
+def _utc_naive(dt: datetime.datetime) -> datetime.datetime:
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _from_utc_naive(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(tzinfo=datetime.timezone.utc)
+
+
+def event_interval(event: dict) -> Optional[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Convierte un evento de Google en un intervalo ocupado (inicio, fin) aware.
+    Retorna None si el evento no ocupa la agenda (cancelado o marcado como 'libre').
+    """
+    if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+        return None
+
+    start, end = event.get("start", {}), event.get("end", {})
+    if "dateTime" in start:
+        return (
+            datetime.datetime.fromisoformat(start["dateTime"].replace("Z", "+00:00")),
+            datetime.datetime.fromisoformat(end["dateTime"].replace("Z", "+00:00")),
+        )
+    if "date" in start:
+        # Evento de día completo: ocupa desde las 00:00 (hora local) del inicio hasta el fin (exclusivo)
+        return (
+            datetime.datetime.combine(datetime.date.fromisoformat(start["date"]), datetime.time(0), tzinfo=calendar.TZ_ARG),
+            datetime.datetime.combine(datetime.date.fromisoformat(end["date"]), datetime.time(0), tzinfo=calendar.TZ_ARG),
+        )
+    return None
+
+
+# ==============================================================================
+# BACKENDS (Google real / Fake en memoria)
+# ==============================================================================
+
+class GoogleCalendarBackend:
+    """Lee los eventos del calendario real con events.list (paginado, con syncToken)."""
+
+    def list_events(self, calendar_id: str, sync_token: str = None, time_min: datetime.datetime = None):
+        """
+        Retorna (eventos, next_sync_token).
+        Con sync_token trae solo los cambios desde la última sincronización.
+        """
+        events = []
+        page_token = None
+        while True:
+            params = {
+                "calendarId": calendar_id,
+                "singleEvents": True,
+                "showDeleted": True,
+                "maxResults": 2500,
+            }
+            if sync_token:
+                params["syncToken"] = sync_token
+            elif time_min:
+                params["timeMin"] = time_min.isoformat()
+            if page_token:
+                params["pageToken"] = page_token
+
+            try:
+                result = calendar.execute_request(lambda s: s.events().list(**params))
+            except HttpError as e:
+                if e.resp.status == 410:
+                    raise SyncTokenExpired() from e
+                raise
+
+            events.extend(result.get("items", []))
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                return events, result.get("nextSyncToken")
+
+
+class FakeCalendarBackend:
+    """
+    Calendario en memoria con la misma interfaz que GoogleCalendarBackend.
+    Sirve para probar el espejo sin conexión: cada cambio sube la versión,
+    y el sync_token es la versión desde la que se piden los cambios.
+    """
+
+    def __init__(self):
+        self.events: Dict[str, dict] = {}
+        self._changes: List[Tuple[int, str]] = []  # (versión, event_id)
+        self.version = 0
+        self.list_calls = 0
+        self._expired_before = 0
+
+    def _touch(self, event_id: str):
+        self.version += 1
+        self._changes.append((self.version, event_id))
+
+    def add_event(self, event_id: str, start: datetime.datetime, end: datetime.datetime, transparent: bool = False):
+        self.events[event_id] = {
+            "id": event_id,
+            "status": "confirmed",
+            "transparency": "transparent" if transparent else "opaque",
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": end.isoformat()},
+        }
+        self._touch(event_id)
+
+    def remove_event(self, event_id: str):
+        if event_id in self.events:
+            self.events[event_id]["status"] = "cancelled"
+            self._touch(event_id)
+
+    def expire_sync_tokens(self):
+        """Simula el 410 de Google: los tokens anteriores dejan de servir."""
+        self._changes = []
+        self._expired_before = self.version
+
+    def list_events(self, calendar_id: str, sync_token: str = None, time_min: datetime.datetime = None):
+        self.list_calls += 1
+        if sync_token is None:
+            items = [e for e in self.events.values() if e["status"] != "cancelled"]
+            return [dict(e) for e in items], str(self.version)
+
+        desde = int(sync_token)
+        if desde < self._expired_before:
+            raise SyncTokenExpired()
+        cambiados = {event_id for version, event_id in self._changes if version > desde}
+        return [dict(self.events[event_id]) for event_id in cambiados], str(self.version)
+
+
+# ==============================================================================
+# ESPEJO
+# ==============================================================================
+
+class CalendarMirror:
+    """
+    Copia local de los intervalos ocupados de un calendario.
+    - Las consultas de disponibilidad se responden desde memoria (sin ir a Google).
+    - Una tarea de fondo la mantiene al día con sincronización incremental (syncToken).
+    - Las reservas/cancelaciones del bot se aplican al instante (apply_booking/apply_cancellation).
+    - Si la última sincronización es más vieja que `max_staleness`, el espejo se declara
+      desactualizado y el llamador tiene que ir a Google en vivo.
+    - Se persiste en DB (barberia_agenda_espejo / barberia_agenda_sync) para arrancar en caliente.
+    """
+
+    def __init__(self, backend, calendar_id: str, max_staleness: float, persist: bool = True):
+        self.backend = backend
+        self.calendar_id = calendar_id
+        self.max_staleness = max_staleness
+        self.persist = persist
+
+        self._lock = threading.Lock()
+        self._busy: Dict[str, Tuple[datetime.datetime, datetime.datetime]] = {}
+        self._sync_token: Optional[str] = None
+        self.last_synced_at: Optional[datetime.datetime] = None  # UTC aware
+
+    # --- Estado ---
+
+    def __len__(self):
+        return len(self._busy)
+
+    def staleness(self) -> Optional[float]:
+        """Segundos desde la última sincronización exitosa (None si nunca sincronizó)."""
+        if self.last_synced_at is None:
+            return None
+        return (datetime.datetime.now(datetime.timezone.utc) - self.last_synced_at).total_seconds()
+
+    def is_fresh(self) -> bool:
+        staleness = self.staleness()
+        return staleness is not None and staleness <= self.max_staleness
+
+    # --- Lecturas ---
+
+    def busy_intervals(self, time_min: datetime.datetime, time_max: datetime.datetime):
+        """
+        Intervalos ocupados (fusionados) que tocan la ventana pedida.
+        Retorna None si el espejo está desactualizado.
+        """
+        if not self.is_fresh():
+            metrics.inc("calendar_mirror.stale_reads")
+            return None
+
+        with self._lock:
+            intervalos = [
+                (inicio, fin) for inicio, fin in self._busy.values()
+                if fin > time_min and inicio < time_max
+            ]
+        metrics.inc("calendar_mirror.reads")
+        return calendar.merge_intervals(intervalos)
+
+    # --- Escrituras locales (reservas del bot) ---
+
+    def apply_booking(self, event_id: str, start: datetime.datetime, end: datetime.datetime):
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=calendar.TZ_ARG)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=calendar.TZ_ARG)
+        with self._lock:
+            self._busy[event_id] = (start, end)
+        self._persist_event(event_id, (start, end))
+
+    def apply_cancellation(self, event_id: str):
+        with self._lock:
+            self._busy.pop(event_id, None)
+        self._persist_event(event_id, None)
+
+    # --- Sincronización ---
+
+    def full_sync(self):
+        time_min = datetime.datetime.now(calendar.TZ_ARG) - SYNC_LOOKBACK
+        events, next_token = self.backend.list_events(self.calendar_id, time_min=time_min)
+
+        busy = {}
+        for event in events:
+            intervalo = event_interval(event)
+            if intervalo:
+                busy[event["id"]] = intervalo
+
+        with self._lock:
+            self._busy = busy
+            self._sync_token = next_token
+            self.last_synced_at = datetime.datetime.now(datetime.timezone.utc)
+        metrics.inc("calendar_mirror.full_syncs")
+        self._persist_all()
+
+    def incremental_sync(self):
+        events, next_token = self.backend.list_events(self.calendar_id, sync_token=self._sync_token)
+
+        limite = datetime.datetime.now(calendar.TZ_ARG) - SYNC_LOOKBACK
+        with self._lock:
+            for event in events:
+                intervalo = event_interval(event)
+                if intervalo:
+                    self._busy[event["id"]] = intervalo
+                else:
+                    self._busy.pop(event["id"], None)
+            # Podamos lo que ya quedó en el pasado
+            for event_id in [k for k, (_, fin) in self._busy.items() if fin < limite]:
+                del self._busy[event_id]
+            self._sync_token = next_token
+            self.last_synced_at = datetime.datetime.now(datetime.timezone.utc)
+        metrics.inc("calendar_mirror.incremental_syncs")
+        metrics.inc("calendar_mirror.events_changed", len(events))
+        if events:
+            self._persist_all()
+        else:
+            self._persist_state()
+
+    def sync(self):
+        """Sincroniza: incremental si hay token, completa si no (o si Google lo invalidó)."""
+        started = time.perf_counter()
+        try:
+            if self._sync_token:
+                try:
+                    self.incremental_sync()
+                except SyncTokenExpired:
+                    print("🔄 Espejo de agenda: syncToken vencido, resincronizando completo...")
+                    self.full_sync()
+            else:
+                self.full_sync()
+        finally:
+            metrics.observe("calendar_mirror.sync_seconds", time.perf_counter() - started)
+            metrics.set_gauge("calendar_mirror.busy_intervals", len(self))
+
+    def force_resync(self):
+        """Descarta el token y el estado local y vuelve a bajar todo el calendario."""
+        with self._lock:
+            self._sync_token = None
+        self.full_sync()
+
+    async def run_forever(self, interval: float):
+        """Tarea de fondo: mantiene el espejo actualizado cada `interval` segundos."""
+        await run_blocking("db", self.load)
+        while True:
+            try:
+                await run_blocking("calendar", self.sync)
+            except Exception as e:
+                metrics.inc("calendar_mirror.sync_errors")
+                print(f"⚠️ Error sincronizando espejo de agenda: {e}")
+            await asyncio.sleep(interval)
+
+    async def follow(self, interval: float):
+        """
+        Tarea de fondo para procesos que NO sincronizan con Google (ej: app/worker.py):
+        relee cada `interval` segundos el estado que persiste el proceso que sí lo hace.
+        """
+        while True:
+            try:
+                await run_blocking("db", self.load)
+            except Exception as e:
+                print(f"⚠️ Error releyendo espejo de agenda: {e}")
+            await asyncio.sleep(interval)
+
+    # --- Persistencia ---
+
+    def load(self):
+        """Arranque en caliente: levanta de la DB el último estado sincronizado."""
+        if not self.persist:
+            return
+        db = SessionLocal()
+        try:
+            state = db.query(SyncAgendaBarberia).filter_by(calendar_id=self.calendar_id).first()
+            rows = db.query(OcupadoAgendaBarberia).filter_by(calendar_id=self.calendar_id).all()
+            with self._lock:
+                self._busy = {
+                    r.google_event_id: (_from_utc_naive(r.inicio), _from_utc_naive(r.fin)) for r in rows
+                }
+                if state:
+                    self._sync_token = state.sync_token
+                    self.last_synced_at = _from_utc_naive(state.ultima_sync) if state.ultima_sync else None
+        finally:
+            db.close()
+
+    def _persist_state(self, db=None):
+        if not self.persist:
+            return
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            state = db.query(SyncAgendaBarberia).filter_by(calendar_id=self.calendar_id).first()
+            if not state:
+                state = SyncAgendaBarberia(calendar_id=self.calendar_id)
+                db.add(state)
+            state.sync_token = self._sync_token
+            state.ultima_sync = _utc_naive(self.last_synced_at) if self.last_synced_at else None
+            db.commit()
+        finally:
+            if own_session:
+                db.close()
+
+    def _persist_all(self):
+        if not self.persist:
+            return
+        with self._lock:
+            busy = dict(self._busy)
+        db = SessionLocal()
+        try:
+            db.query(OcupadoAgendaBarberia).filter_by(calendar_id=self.calendar_id).delete()
+            db.add_all([
+                OcupadoAgendaBarberia(
+                    calendar_id=self.calendar_id,
+                    google_event_id=event_id,
+                    inicio=_utc_naive(inicio),
+                    fin=_utc_naive(fin)
+                )
+                for event_id, (inicio, fin) in busy.items()
+            ])
+            self._persist_state(db)
+        finally:
+            db.close()
+
+    def _persist_event(self, event_id: str, intervalo):
+        if not self.persist:
+            return
+        db = SessionLocal()
+        try:
+            db.query(OcupadoAgendaBarberia).filter_by(
+                calendar_id=self.calendar_id, google_event_id=event_id
+            ).delete()
+            if intervalo:
+                db.add(OcupadoAgendaBarberia(
+                    calendar_id=self.calendar_id,
+                    google_event_id=event_id,
+                    inicio=_utc_naive(intervalo[0]),
+                    fin=_utc_naive(intervalo[1])
+                ))
+            db.commit()
+        except Exception as e:
+            print(f"⚠️ Error persistiendo espejo de agenda: {e}")
+        finally:
+            db.close()
+
+
+# Instancia global del espejo (calendario de la Barbería)
+mirror = CalendarMirror(
+    backend=GoogleCalendarBackend(),
+    calendar_id=settings.BARBER_CALENDAR_ID,
+    max_staleness=settings.CALENDAR_MIRROR_MAX_STALENESS_SECONDS
+)
@@ -1,8 +1,13 @@
+from datetime import datetime
 from typing import Any, List, Optional, Type
+from zoneinfo import ZoneInfo
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from app.models.models import (
-    ClienteBarberia, TurnoBarberia, MensajeBarberia,
+    ClienteBarberia, TurnoBarberia, MensajeBarberia, ResumenBarberia,
     ClienteLomiteria, MenuLomiteria, PedidoLomiteria, ItemPedidoLomiteria, MensajeLomiteria)
 
 class CRUDBase:
@@ -64,6 +69,88 @@ class CRUDBase:
             db.commit()
         return obj
 
+    # --------------------------------------------------------------------------
+    # Versiones ASYNC (mismo comportamiento, para AsyncSession)
+    # --------------------------------------------------------------------------
+
+    async def aget(self, db: AsyncSession, id: Any) -> Optional[Any]:
+        """Obtiene un registro por su ID primario."""
+        return await db.get(self.model, id)
+
+    async def aget_one(self, db: AsyncSession, **kwargs) -> Optional[Any]:
+        """
+        Busca UN registro que cumpla con los filtros exactos pasados como kwargs.
+        Uso: await crud_cliente.aget_one(db, ig_id="12345")
+        """
+        result = await db.execute(select(self.model).filter_by(**kwargs).limit(1))
+        return result.scalars().first()
+
+    async def aget_multi(self, db: AsyncSession, skip: int = 0, limit: int = 100, **kwargs) -> List[Any]:
+        """Retorna una LISTA de registros que cumplan los filtros."""
+        result = await db.execute(select(self.model).filter_by(**kwargs).offset(skip).limit(limit))
+        return list(result.scalars().all())
+
+    async def acreate(self, db: AsyncSession, **kwargs) -> Any:
+        """Crea un registro directo con los argumentos pasados."""
+        db_obj = self.model(**kwargs)
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def acreate_many(self, db: AsyncSession, rows: List[dict]) -> int:
+        """
+        Inserta VARIOS registros en un solo INSERT (executemany) y un solo commit.
+        Uso: await crud_mensaje.acreate_many(db, [{"cliente_id": 1, "content": "Hola"}, ...])
+        """
+        if not rows:
+            return 0
+        await db.execute(insert(self.model), rows)
+        await db.commit()
+        return len(rows)
+
+    async def acreate_many_new(self, db: AsyncSession, rows: List[dict], unique_field: str) -> set:
+        """
+        Como acreate_many, pero salteando los registros cuyo `unique_field` ya existe
+        (INSERT ... ON CONFLICT DO NOTHING). Retorna los valores de `unique_field` que SÍ se insertaron.
+        Uso: nuevos = await crud_mensaje.acreate_many_new(db, rows, unique_field="mid")
+        """
+        if not rows:
+            return set()
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            stmt = postgresql.insert(self.model)
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(self.model)
+        else:
+            raise NotImplementedError(f"ON CONFLICT no soportado para {dialect}")
+
+        column = getattr(self.model, unique_field)
+        stmt = stmt.values(rows).on_conflict_do_nothing(index_elements=[unique_field]).returning(column)
+        result = await db.execute(stmt)
+        insertados = set(result.scalars().all())
+        await db.commit()
+        return insertados
+
+    async def aupdate(self, db: AsyncSession, db_obj: Any, **kwargs) -> Any:
+        """Actualiza los campos de un objeto existente."""
+        for field, value in kwargs.items():
+            if hasattr(db_obj, field):
+                setattr(db_obj, field, value)
+
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def aremove(self, db: AsyncSession, id: int) -> Any:
+        """Elimina un registro por ID."""
+        obj = await db.get(self.model, id)
+        if obj:
+            await db.delete(obj)
+            await db.commit()
+        return obj
+
 
 # ==============================================================================
 # 2. INSTANCIAS (SIN EXTENDER CLASES)
@@ -73,6 +160,7 @@ class CRUDBase:
 # Barbería
 cliente_barberia = CRUDBase(ClienteBarberia)
 turno_barberia = CRUDBase(TurnoBarberia)
+resumen_barberia = CRUDBase(ResumenBarberia)
 mensaje_barberia = CRUDBase(MensajeBarberia)
 
 # Lomitería
@@ -88,6 +176,22 @@ mensaje_lomiteria = CRUDBase(MensajeLomiteria)
 # ==============================================================================
 # Lógica que no entra en el CRUD genérico porque es muy específica.
 
+# Zona horaria Argentina: las columnas DateTime (sin zona) guardan la hora local de acá
+TZ_ARG = ZoneInfo("America/Argentina/Cordoba")
+
+
+def hora_local(dt: Optional[datetime] = None) -> datetime:
+    """
+    Hora de Argentina SIN tzinfo, lista para una columna DateTime sin zona.
+    asyncpg rechaza datetimes con offset en esas columnas (psycopg2 los convertía solo).
+    Sin argumento: ahora. Un datetime sin zona se asume que ya está en hora local.
+    """
+    dt = dt or datetime.now(TZ_ARG)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(TZ_ARG).replace(tzinfo=None)
+    return dt
+
+
 def get_chat_history(db: Session, model_mensaje: Type, cliente_id: int, limit: int = 10) -> List[dict]:
     """
     Obtiene los últimos N mensajes formateados para Gemini.
@@ -96,7 +200,7 @@ def get_chat_history(db: Session, model_mensaje: Type, cliente_id: int, limit: i
     # 1. Traemos los últimos 10 (orden descendente por fecha)
     mensajes_desc = db.query(model_mensaje) \
         .filter_by(cliente_id=cliente_id) \
-        .order_by(desc(model_mensaje.timestamp)) \
+        .order_by(desc(model_mensaje.timestamp), desc(model_mensaje.id)) \
         .limit(limit) \
         .all()
 
@@ -104,6 +208,82 @@ def get_chat_history(db: Session, model_mensaje: Type, cliente_id: int, limit: i
     return history
 
 
+async def aget_chat_history(db: AsyncSession, model_mensaje: Type, cliente_id: int, limit: int = 10) -> List[dict]:
+    """Versión async de get_chat_history."""
+    result = await db.execute(
+        select(model_mensaje)
+        .filter_by(cliente_id=cliente_id)
+        .order_by(desc(model_mensaje.timestamp), desc(model_mensaje.id))  # id: desempate dentro de un lote
+        .limit(limit)
+    )
+    mensajes_desc = result.scalars().all()
+
+    history = mensajes_desc[::-1]
+    return history
+
+
+async def aget_messages_between(
+        db: AsyncSession, model_mensaje: Type, cliente_id: int, after_id: int, before_id: int, limit: int
+) -> List[Any]:
+    """
+    Los `limit` mensajes MÁS VIEJOS con after_id < id < before_id, en orden cronológico
+    (quien los consume avanza de a tandas: la próxima arranca después del último de esta).
+    """
+    result = await db.execute(
+        select(model_mensaje)
+        .filter(
+            model_mensaje.cliente_id == cliente_id,
+            model_mensaje.id > after_id,
+            model_mensaje.id < before_id
+        )
+        .order_by(model_mensaje.id)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def aget_user_message_timestamps(db: AsyncSession, ig_id: str, limit: int = 10) -> list:
+    """
+    Timestamps (ascendentes) de los últimos mensajes que mandó el usuario en la Barbería.
+    Se usan para aprender su ritmo de tipeo (ver app/services/debounce.py).
+    """
+    result = await db.execute(
+        select(MensajeBarberia.timestamp)
+        .join(ClienteBarberia, MensajeBarberia.cliente_id == ClienteBarberia.id)
+        .where(ClienteBarberia.ig_id == ig_id, MensajeBarberia.role == "user")
+        .order_by(desc(MensajeBarberia.timestamp), desc(MensajeBarberia.id))
+        .limit(limit)
+    )
+    return [ts for ts in result.scalars().all() if ts is not None][::-1]
+
+
+async def aget_or_create_clientes(db: AsyncSession, model_cliente: Type, ig_ids: List[str]) -> dict:
+    """
+    Resuelve varios clientes por ig_id con UNA consulta (IN) y crea de una vez los que falten.
+    Retorna {ig_id: cliente}. Funciona tanto para ClienteBarberia como ClienteLomiteria.
+    """
+    ig_ids = list(dict.fromkeys(ig_ids))  # Sin repetidos, respetando el orden
+    if not ig_ids:
+        return {}
+
+    async def _buscar():
+        result = await db.execute(select(model_cliente).where(model_cliente.ig_id.in_(ig_ids)))
+        return {cliente.ig_id: cliente for cliente in result.scalars().all()}
+
+    clientes = await _buscar()
+    nuevos = [model_cliente(ig_id=ig_id) for ig_id in ig_ids if ig_id not in clientes]
+    if nuevos:
+        db.add_all(nuevos)
+        try:
+            await db.commit()
+            clientes.update({cliente.ig_id: cliente for cliente in nuevos})
+        except IntegrityError:
+            # Otro request creó alguno en el medio (ig_id es único): releemos
+            await db.rollback()
+            clientes = await _buscar()
+    return clientes
+
+
 def search_menu_fuzzy(db: Session, query: str) -> List[MenuLomiteria]:
     """
     Búsqueda 'fuzzy' (parcial) para el menú.
@@ -0,0 +1,149 @@
+# app/services/debounce.py
+import re
+import statistics
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Deque, Optional
+
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import metrics
+from app.services import crud
+
+# Buckets (segundos) para el histograma de espera agregada por conversación
+WAIT_BUCKETS = (1, 2, 3, 5, 8, 10, 15, 20, 30, 45, 60)
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas y sin tildes: 'Cuánto SALE?' -> 'cuanto sale?'"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class DebouncePolicy:
+    """
+    Interfaz de las políticas de espera del MessageBuffer.
+    `wait_for` decide cuántos segundos esperar después de CADA mensaje antes de procesar el bloque.
+    """
+
+    async def wait_for(self, sender_id: str, text: str, now: float) -> float:
+        raise NotImplementedError
+
+    def on_block(self, sender_id: str, waited: float, span: float):
+        """Se llama al procesar un bloque: `waited` es la espera desde el último mensaje, `span` desde el primero."""
+        metrics.observe("buffer.wait_added_seconds", waited, buckets=WAIT_BUCKETS)
+        metrics.observe("buffer.block_span_seconds", span, buckets=WAIT_BUCKETS)
+
+
+class FixedDebounce(DebouncePolicy):
+    """La política de siempre: espera fija después de cada mensaje."""
+
+    def __init__(self, wait_time: float):
+        self.wait_time = wait_time
+
+    async def wait_for(self, sender_id: str, text: str, now: float) -> float:
+        return self.wait_time
+
+
+class AdaptiveDebounce(DebouncePolicy):
+    """
+    Aprende el ritmo de tipeo de cada usuario (gaps entre sus mensajes) y ajusta la espera:
+    - Sin datos: espera `base_wait`. Con datos: ~2x su gap típico (mediana), entre `min_wait` y `base_wait`.
+    - Si el mensaje parece completo (termina en '?' o tiene una intención conocida), acorta la espera.
+    - Si viene en ráfaga (escribe más rápido que su ritmo), la estira hasta `burst_cap`.
+    Los gaps se siembran desde MensajeBarberia.timestamp la primera vez que vemos al usuario.
+    """
+
+    # Gaps más largos que esto no son "tipeo", son otra conversación
+    TYPING_GAP_LIMIT = 60.0
+    COMPLETE_FACTOR = 0.35
+    BURST_FACTOR = 1.5
+
+    INTENT_PATTERNS = [
+        r"\bturno\b", r"\breserv", r"\bcancel", r"\bprecio\b", r"\bcuanto (sale|cuesta|esta)\b",
+        r"\bdireccion\b", r"\bdonde (queda|estan)\b", r"\bhorario", r"\ba que hora\b",
+        r"\b\d{1,2}(:\d{2})?\s*(hs|h)\b",
+    ]
+
+    def __init__(self, base_wait: float, min_wait: float, burst_cap: float,
+                 history_size: int = 10, max_senders: int = 10_000):
+        self.base_wait = base_wait
+        self.min_wait = min_wait
+        self.burst_cap = burst_cap
+        self.history_size = history_size
+        self.max_senders = max_senders
+        self._intent_re = re.compile("|".join(self.INTENT_PATTERNS))
+        # LRU acotado: {sender_id: {"gaps": deque, "last": monotonic | None, "burst": int}}
+        self._senders: "OrderedDict[str, dict]" = OrderedDict()
+
+    def looks_complete(self, text: str) -> bool:
+        normalized = _normalize(text).strip()
+        return normalized.endswith("?") or bool(self._intent_re.search(normalized))
+
+    def cadence(self, sender_id: str) -> Optional[float]:
+        """Gap típico (mediana) entre mensajes del usuario, o None si no hay datos."""
+        state = self._senders.get(sender_id)
+        if not state or not state["gaps"]:
+            return None
+        return statistics.median(state["gaps"])
+
+    async def _seed(self, sender_id: str) -> Deque[float]:
+        """Primeros gaps del usuario a partir de sus últimos mensajes guardados."""
+        gaps: Deque[float] = deque(maxlen=self.history_size)
+        try:
+            async with AsyncSessionLocal() as db:
+                timestamps = await crud.aget_user_message_timestamps(db, sender_id, limit=self.history_size + 1)
+        except Exception as e:
+            print(f"⚠️ No se pudo sembrar el ritmo de {sender_id}: {e}")
+            return gaps
+
+        for anterior, siguiente in zip(timestamps, timestamps[1:]):
+            gap = (siguiente - anterior).total_seconds()
+            if 0 < gap <= self.TYPING_GAP_LIMIT:
+                gaps.append(gap)
+        return gaps
+
+    async def _state(self, sender_id: str) -> dict:
+        state = self._senders.get(sender_id)
+        if state is None:
+            state = {"gaps": await self._seed(sender_id), "last": None, "burst": 0}
+            self._senders[sender_id] = state
+            if len(self._senders) > self.max_senders:
+                self._senders.popitem(last=False)
+        self._senders.move_to_end(sender_id)
+        return state
+
+    async def wait_for(self, sender_id: str, text: str, now: float) -> float:
+        state = await self._state(sender_id)
+
+        # 1. Aprender del gap con el mensaje anterior
+        gap = None
+        if state["last"] is not None:
+            gap = now - state["last"]
+            if gap <= self.TYPING_GAP_LIMIT:
+                state["gaps"].append(gap)
+        state["last"] = now
+
+        # 2. Espera base según su ritmo
+        cadence = self.cadence(sender_id)
+        wait = self.base_wait if cadence is None else min(self.base_wait, 2 * cadence)
+
+        # 3. Ráfaga en curso: estirar mientras siga escribiendo rápido
+        if gap is not None and cadence is not None and gap <= cadence * 1.2:
+            state["burst"] += 1
+            wait = min(self.burst_cap, wait * self.BURST_FACTOR ** state["burst"])
+        else:
+            state["burst"] = 0
+
+        # 4. Mensaje que "cierra" la idea: acortar
+        if self.looks_complete(text):
+            wait *= self.COMPLETE_FACTOR
+            metrics.inc("buffer.complete_messages")
+
+        return max(self.min_wait, wait)
+
+
+def build_policy(name: str, base_wait: float, min_wait: float, burst_cap: float) -> DebouncePolicy:
+    """Fábrica según settings.BUFFER_POLICY ('adaptive' o 'fixed')."""
+    if name == "adaptive":
+        return AdaptiveDebounce(base_wait=base_wait, min_wait=min_wait, burst_cap=burst_cap)
+    return FixedDebounce(base_wait)
@@ -0,0 +1,33 @@
+# app/services/dedup.py
+from collections import OrderedDict
+from typing import Hashable
+
+
+class RecentIds:
+    """
+    Conjunto acotado (LRU) de IDs vistos hace poco, para descartar reentregas de Meta
+    sin ir a la base. Es solo la primera barrera: la definitiva es el índice único en DB.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._ids: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key: Hashable):
+        return key in self._ids
+
+    def add(self, key: Hashable) -> bool:
+        """Registra `key`. Retorna False si ya estaba (es un duplicado)."""
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            return False
+        self._ids[key] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, key: Hashable):
+        self._ids.pop(key, None)
@@ -0,0 +1,150 @@
+# app/services/faq.py
+import json
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services import negocio
+
+# ==============================================================================
+# 1. TABLA DE PREGUNTAS FRECUENTES
+# ==============================================================================
+# Se puede reemplazar con un JSON (settings.FAQ_TABLE_PATH) con la misma forma.
+# - anchors: palabras que por sí solas identifican la intención (al menos una tiene que aparecer).
+#   Nada de verbos que también son confirmaciones ("me queda", "sale"): esos van en vocab.
+# - vocab: palabras que suelen acompañar la pregunta (cuentan como "explicadas" pero no alcanzan solas).
+# - excludes: si aparece alguna, la respuesta fija no sirve (ej: precio de otro servicio) y va al modelo.
+# Los datos salen de negocio.py (los mismos que lee el modelo en el prompt).
+
+FAQ_BARBERIA = [
+    {
+        "intent": "direccion",
+        "anchors": ["direccion", "donde", "ubicacion", "ubicados", "mapa"],
+        "vocab": ["estan", "esta", "local", "barberia", "como", "pasas", "pasame", "cual", "es", "la", "barrio",
+                  "queda", "quedan", "llego"],
+        "answer": f"Estamos en {negocio.UBICACION}",
+    },
+    {
+        "intent": "precio",
+        "anchors": ["precio", "precios", "cuanto", "valor", "cobran", "cobras", "$"],
+        "vocab": ["corte", "el", "un", "esta", "de", "pelo", "vale", "sale", "cuesta", "tiene"],
+        # La respuesta fija es solo el corte: otros servicios (o combos) los contesta el modelo
+        "excludes": ["barba", "afeitado", "perfilado", "cejas", "color", "tintura", "mechas", "decoloracion",
+                     "alisado", "lavado", "combo", "promo", "nene", "nino"],
+        "answer": f"El corte sale {negocio.PRECIO}",
+    },
+    {
+        "intent": "horario",
+        "anchors": ["horario", "horarios", "abren", "abris", "cierran", "cerras", "atienden", "atencion", "abierto"],
+        "vocab": ["que", "hora", "hasta", "desde", "dias", "de", "a", "los", "hoy", "son", "cual", "es", "el", "domingo",
+                  "domingos", "lunes"],
+        "answer": f"Atendemos {negocio.HORARIO_TEXTO}",
+    },
+]
+
+# No aportan ni restan: saludos, muletillas y palabras vacías
+SALUDOS = {"hola", "buenas", "buen", "hey", "ey"}
+RELLENO = {"y", "o", "que", "el", "la", "los", "las", "de", "del", "a", "al", "me", "te", "se", "por", "favor",
+           "porfa", "una", "un", "consulta", "pregunta", "queria", "quiero", "saber", "preguntar", "decis", "decime",
+           "podes", "podrias", "pasar", "info", "gracias", "ustedes", "uds", "che", "ahi", "onda", "bro", "amigo",
+           "dia", "tardes", "noches"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9$]+")
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """'¿Dónde QUEDAN?' -> ['donde', 'quedan']"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(text)
+
+
+# ==============================================================================
+# 2. MATCHER
+# ==============================================================================
+
+class FaqMatcher:
+    """
+    Responde preguntas frecuentes SIN llamar a Gemini, con un índice de tokens normalizados armado una vez.
+    Confianza = proporción de las palabras "con contenido" del mensaje que explican las intenciones
+    encontradas. Si el mensaje trae algo más (ej: "cuánto sale y tenés turno el jueves?"), la confianza
+    baja del umbral y va a Gemini como siempre.
+    Métricas: faq.hits / faq.misses y el gauge faq.hit_ratio.
+    """
+
+    def __init__(self, table: List[dict], min_confidence: float):
+        self.table = table
+        self.min_confidence = min_confidence
+        # Índice: token -> intenciones donde es ancla / donde es vocabulario
+        self._anchors: Dict[str, List[int]] = {}
+        self._vocab: Dict[str, List[int]] = {}
+        self._excludes: Dict[str, List[int]] = {}
+        for i, entry in enumerate(table):
+            for token in {t for w in entry["anchors"] for t in normalize_tokens(w) or [w]}:
+                self._anchors.setdefault(token, []).append(i)
+            for token in {t for w in entry.get("vocab", []) for t in normalize_tokens(w)}:
+                self._vocab.setdefault(token, []).append(i)
+            for token in {t for w in entry.get("excludes", []) for t in normalize_tokens(w)}:
+                self._excludes.setdefault(token, []).append(i)
+        self.hits = 0
+        self.misses = 0
+
+    def match(self, text: str) -> Optional[dict]:
+        """Retorna {"intents": [...], "confidence": float, "answer": str} o None."""
+        tokens = normalize_tokens(text)
+        saludo = any(t in SALUDOS for t in tokens) or "que onda" in " ".join(tokens)
+        contenido = [t for t in tokens if t not in SALUDOS and t not in RELLENO]
+        if not contenido:
+            return None
+
+        # Intenciones con al menos un ancla, en el orden en que aparecen en el mensaje
+        intents: List[int] = []
+        for token in contenido:
+            for i in self._anchors.get(token, []):
+                if i not in intents:
+                    intents.append(i)
+        if not intents:
+            return None
+        if any(i in intents for t in contenido for i in self._excludes.get(t, [])):
+            return None
+
+        explicados = sum(
+            1 for t in contenido
+            if any(i in intents for i in self._anchors.get(t, []) + self._vocab.get(t, []))
+        )
+        confidence = explicados / len(contenido)
+        respuestas = [self.table[i]["answer"] for i in intents]
+        answer = ". ".join(respuestas) + ", bro"
+        if saludo:
+            answer = "Que onda! " + answer
+        return {"intents": [self.table[i]["intent"] for i in intents], "confidence": confidence, "answer": answer}
+
+    def answer(self, text: str) -> Optional[str]:
+        """La respuesta si la confianza supera el umbral; si no, None (y se sigue con Gemini)."""
+        result = self.match(text)
+        if result and result["confidence"] >= self.min_confidence:
+            self.hits += 1
+            metrics.inc("faq.hits")
+            for intent in result["intents"]:
+                metrics.inc(f"faq.intent.{intent}")
+            answer = result["answer"]
+        else:
+            self.misses += 1
+            metrics.inc("faq.misses")
+            answer = None
+        metrics.set_gauge("faq.hit_ratio", round(self.hits / (self.hits + self.misses), 4))
+        return answer
+
+
+def load_table() -> List[dict]:
+    """La tabla por defecto, o la del JSON configurado en FAQ_TABLE_PATH."""
+    if settings.FAQ_TABLE_PATH:
+        with open(settings.FAQ_TABLE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    return FAQ_BARBERIA
+
+
+# Instancia global (None si está deshabilitado)
+matcher = FaqMatcher(load_table(), settings.FAQ_MIN_CONFIDENCE) if settings.FAQ_ENABLED else None
@@ -1,12 +1,248 @@
 # app/services/gemini.py
+import asyncio
+import datetime
+import hashlib
+import json
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
 import google.generativeai as genai
 from google.generativeai import GenerationConfig
 
 from app.core.config import settings
-from app.services.tools import handle_tool_call
+from app.core.events import events
+from app.core.executors import run_blocking
+from app.core.metrics import metrics
+from app.services.admission import (
+    PRIORIDAD_CONTINUACION, PRIORIDAD_FONDO, PRIORIDAD_NORMAL, PRIORIDAD_RESERVA, AdmissionRejected,
+    AdmissionScheduler
+)
+from app.services import prompts
+from app.services.faq import normalize_tokens
+from app.services.resilience import CircuitBreaker, CircuitOpen, OutageQueue, backoff_delay, is_retryable
+from app.services.tools import READ_ONLY_TOOLS, handle_tool_calls, tool_memo
 
 genai.configure(api_key=settings.GEMINI_API_KEY)
 
+# ==============================================================================
+# CONTROL DE ADMISIÓN
+# ==============================================================================
+# Todas las llamadas a Gemini del proceso pasan por acá: tope de concurrencia y de tokens/minuto,
+# con prioridad para las conversaciones que están cerrando una reserva (ver app/services/admission.py).
+
+scheduler = AdmissionScheduler(
+    "gemini",
+    max_in_flight=settings.GEMINI_MAX_IN_FLIGHT,
+    tokens_per_minute=settings.GEMINI_TOKENS_PER_MINUTE,
+    max_queue=settings.GEMINI_MAX_QUEUE,
+    max_wait=settings.GEMINI_MAX_QUEUE_WAIT_SECONDS,
+)
+
+# Señales de que la conversación está en medio de una reserva
+_RESERVA_RE = re.compile(
+    r"turno|reserv|agend|confirm|cancel|mover|cambiar|horario|disponib|mañana|tarde|"
+    r"lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo|\b\d{1,2}(:\d{2})?\s*(hs|h)\b"
+)
+
+# El mensaje nombra un día o una hora concretos (ej: "atienden el lunes?", "abren a las 9?")
+_DIA_U_HORA_RE = re.compile(
+    r"\b(hoy|mañana|pasado|lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo|feriado)\b|\d"
+)
+
+# Aproximación de tokens a partir de caracteres (suficiente para repartir el presupuesto)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(*textos: str) -> int:
+    return sum(len(t) for t in textos if t) // CHARS_PER_TOKEN + 1
+
+
+def booking_priority(user_message: str, db_history: list) -> int:
+    """Reserva en curso (el usuario o las últimas respuestas hablan de turnos/fechas) o consulta suelta."""
+    recientes = [user_message] + [msg.content or "" for msg in db_history[-4:]]
+    if any(_RESERVA_RE.search(texto.lower()) for texto in recientes):
+        return PRIORIDAD_RESERVA
+    return PRIORIDAD_NORMAL
+
+
+# ==============================================================================
+# RESILIENCIA: REINTENTOS, CIRCUIT BREAKER Y COLA DE REINTENTO
+# ==============================================================================
+# Un 429/503 suelto se reintenta con backoff; si Gemini viene fallando seguido, el breaker corta
+# en seco (no gastamos cuota ni hacemos esperar a nadie) y los bloques nuevos quedan en
+# `outage_queue` hasta que vuelva (ver process_conversation_block).
+
+breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=settings.GEMINI_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.GEMINI_BREAKER_RESET_SECONDS,
+)
+outage_queue = OutageQueue("gemini", breaker, max_parked=settings.GEMINI_MAX_PARKED_BLOCKS)
+
+
+class GeminiUnavailable(Exception):
+    """Gemini no está disponible (circuito abierto o reintentos agotados) y el bloque se puede re-ejecutar entero."""
+
+
+async def _send(chat_session, content, sender_id: str, priority: int, tokens: int,
+                stream: "SentenceStream" = None, **kwargs):
+    """
+    Una llamada al modelo con reintentos clasificados:
+    - 429/5xx: reintenta con backoff exponencial + jitter (hasta GEMINI_RETRY_MAX_ATTEMPTS intentos).
+    - Otros 4xx: no reintenta (tampoco cuentan como falla del servicio).
+    - Otros errores (sin código HTTP): no reintenta y no le dicen nada al breaker.
+    - Circuito abierto: CircuitOpen sin llamar.
+    La espera del backoff es FUERA del scheduler (no ocupa lugar de los que sí pueden llamar).
+    El historial del chat solo se actualiza con respuestas exitosas, así que reintentar es seguro
+    (salvo que ya se le haya mostrado texto al usuario por `stream`: ahí no se reintenta).
+    """
+    attempt = 0
+    while True:
+        breaker.before_call()
+        fed_before = stream.fed if stream else 0
+        try:
+            response = await _send_once(chat_session, content, sender_id, priority, tokens, stream, **kwargs)
+        except AdmissionRejected:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                code = getattr(e, "code", None)
+                if isinstance(code, int) and 400 <= code < 500:
+                    breaker.record_success()  # Contestó (mal, pero contestó): el servicio está
+                else:
+                    breaker.release_probe()  # Error nuestro (o desconocido): no dice nada del servicio
+                raise
+            breaker.record_failure()
+            attempt += 1
+            if stream and stream.fed > fed_before:
+                raise  # Cortó a mitad de una respuesta que ya se está mostrando
+            if attempt >= settings.GEMINI_RETRY_MAX_ATTEMPTS or breaker.is_open:
+                metrics.inc("gemini.retries_exhausted")
+                raise
+            delay = backoff_delay(attempt - 1, settings.GEMINI_RETRY_BASE_SECONDS, settings.GEMINI_RETRY_MAX_BACKOFF_SECONDS)
+            metrics.inc("gemini.retries")
+            print(f"🔁 Gemini falló para {sender_id} ({e}), reintento {attempt} en {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelada (deadline del bloque): no sabemos cómo está el servicio
+            breaker.release_probe()
+            raise
+        breaker.record_success()
+        return response
+
+
+async def _send_once(chat_session, content, sender_id: str, priority: int, tokens: int,
+                     stream: "SentenceStream" = None, **kwargs):
+    """
+    send_message_async pasando por el scheduler; informa el uso real de tokens.
+    Con `stream`, la respuesta se pide en streaming y el texto se le va pasando a medida que llega.
+    """
+    async with scheduler.slot(sender_id, priority, tokens) as permit:
+        if stream is None:
+            response = await chat_session.send_message_async(content, **kwargs)
+        else:
+            response = await chat_session.send_message_async(content, stream=True, **kwargs)
+            async for chunk in response:
+                stream.feed(_chunk_text(chunk))  # No espera el envío: el lugar del scheduler se libera ya
+        usage = getattr(response, "usage_metadata", None)
+        permit.report(getattr(usage, "total_token_count", None))
+        metrics.inc("gemini.prompt_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+        # Gemini 2.5 cachea implícitamente prefijos repetidos: con el prompt estático se nota acá
+        metrics.inc("gemini.cached_tokens", getattr(usage, "cached_content_token_count", 0) or 0)
+        return response
+
+
+# ==============================================================================
+# RESPUESTA EN STREAMING (por oraciones)
+# ==============================================================================
+# El usuario no tiene que esperar a que termine todo el turno: a medida que llegan los fragmentos
+# se manda cada oración completa (la primera apenas está, el resto en tandas de STREAM_FLUSH_MIN_CHARS).
+
+# Fin de oración: puntuación seguida de espacio, o salto de línea (listas de horarios, etc.)
+_FIN_DE_ORACION_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def _chunk_text(chunk) -> str:
+    """Texto de un fragmento del stream (los fragmentos de function calling no tienen)."""
+    try:
+        parts = chunk.candidates[0].content.parts
+    except (AttributeError, IndexError):
+        return ""
+    return "".join(part.text for part in parts if getattr(part, "text", None))
+
+
+class SentenceStream:
+    """
+    Recibe el texto del modelo en fragmentos y lo entrega (`send(texto)`) cortado en oraciones.
+    `full_text` es todo lo que dijo el modelo, tal cual, para guardarlo UNA vez en la DB.
+    feed() se llama con el lugar del scheduler de admisión tomado: no espera a `send` (que escribe en la DB),
+    los envíos corren en tasks encadenados (en orden) y close() espera a que salgan todos.
+    """
+
+    def __init__(self, send, min_chars: int = 120):
+        self.send = send
+        self.min_chars = min_chars
+        self.full_text = ""
+        self.fed = 0  # Caracteres recibidos
+        self.flushes = 0
+        self.error: Optional[Exception] = None  # Primer envío que falló (close() lo relanza)
+        self._buffer = ""
+        self._sending: Optional[asyncio.Task] = None  # Último envío encolado
+
+    def feed(self, text: str):
+        if not text:
+            return
+        self.full_text += text
+        self.fed += len(text)
+        self._buffer += text
+
+        cortes = list(_FIN_DE_ORACION_RE.finditer(self._buffer))
+        if not cortes:
+            return
+        listo = self._buffer[:cortes[-1].start()]
+        # La primera oración sale ya (es la que baja la latencia percibida); después, de a tandas
+        if self.flushes and len(listo) < self.min_chars:
+            return
+        self._buffer = self._buffer[cortes[-1].end():]
+        self._flush(listo)
+
+    def _flush(self, text: str):
+        text = text.strip()
+        if text:
+            self.flushes += 1
+            self._sending = asyncio.create_task(self._send_after(self._sending, text))
+
+    async def _send_after(self, previous: Optional[asyncio.Task], text: str):
+        if previous:
+            await previous  # Nunca lanza: los errores quedan en self.error
+        try:
+            await self.send(text)
+        except Exception as e:
+            self.error = self.error or e
+            print(f"❌ Error mandando una parte de la respuesta: {e}")
+
+    async def close(self, final_text: Optional[str]) -> Optional[str]:
+        """
+        Manda lo que quedó en el buffer. Si la respuesta final no salió por el stream
+        (mensajes de error, respuesta parcial por deadline...), la manda entera.
+        Retorna el texto completo que vio el usuario (para persistir).
+        """
+        self._flush(self._buffer)
+        self._buffer = ""
+        if final_text and final_text not in self.full_text:
+            self._flush(final_text)
+            self.full_text = f"{self.full_text.strip()}\n{final_text}" if self.full_text.strip() else final_text
+        if self._sending:
+            await self._sending
+        if self.error:
+            raise self.error
+        return self.full_text.strip() or final_text
+
 
 def _format_history(db_messages: list) -> list:
     """
@@ -20,22 +256,370 @@ def _format_history(db_messages: list) -> list:
     return history
 
 
-def get_model(tools_schema: list, system_instruction: str):
-    """
-    Crea una instancia del modelo Gemini configurada dinámicamente.
-    Permite cambiar de personalidad (Barbería vs Lomitería) al vuelo.
-    """
-    config = GenerationConfig(
+# Modelos ya construidos: {(modelo, hash del prompt estático, hash del schema de tools): GenerativeModel}
+MODEL_NAME = 'gemini-2.5-flash'
+MODEL_CACHE_SIZE = 32
+_models: "OrderedDict[tuple, genai.GenerativeModel]" = OrderedDict()
+
+# Buckets para histogramas de conteos (tools por turno, idas y vueltas al modelo por bloque)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10)
+
+# Buckets (bytes) para el histograma del bloque de contexto por request
+BYTES_BUCKETS = (0, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _digest(value) -> str:
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def _generation_config() -> GenerationConfig:
+    return GenerationConfig(
         temperature=0.2,  # Baja creatividad: Se apega a los hechos y fechas.
         top_p=0.8,  # Núcleo de muestreo: elige las palabras más probables.
         top_k=40,
     )
 
-    return genai.GenerativeModel(
-        model_name='gemini-2.5-flash',
+
+def get_model(tools_schema: list, system_instruction: str, model_name: str = MODEL_NAME):
+    """
+    Retorna el modelo Gemini para esta personalidad (Barbería vs Lomitería) y este set de tools.
+    Se construye UNA vez por (modelo, prompt estático, tools) y se reutiliza: lo que cambia por cliente
+    o por minuto va en el bloque de contexto del mensaje (ver app/services/prompts.py).
+    """
+    key = (model_name, _digest(system_instruction), _digest(tools_schema or []))
+    model = _models.get(key)
+    if model is not None:
+        _models.move_to_end(key)
+        # Solo se ahorra construir el objeto: el prefijo viaja (y se factura) igual en cada llamada
+        metrics.inc("gemini.model_cache_hits")
+        return model
+
+    model = genai.GenerativeModel(
+        model_name=model_name,
         tools=[tools_schema] if tools_schema else None,
         system_instruction=system_instruction,
-        generation_config=config
+        generation_config=_generation_config()
+    )
+    metrics.inc("gemini.model_cache_misses")
+    _models[key] = model
+    if len(_models) > MODEL_CACHE_SIZE:
+        _models.popitem(last=False)
+    return model
+
+
+# ==============================================================================
+# RUTEO POR COMPLEJIDAD (modelo liviano sin tools vs. modelo completo)
+# ==============================================================================
+# "gracias", "dale", "hola" no necesitan tools ni el modelo grande. Todo lo que toque fechas,
+# turnos o cancelaciones (o conteste a una pregunta de reserva del bot) va al modelo completo.
+# Modelos y umbrales por negocio en settings.GEMINI_MODEL_TIERS.
+
+TIER_LIGHT = "light"
+TIER_FULL = "full"
+
+TIER_DEFAULTS = {
+    TIER_LIGHT: "gemini-2.5-flash-lite",
+    TIER_FULL: MODEL_NAME,
+    "max_light_words": 6,  # Más palabras que esto nunca es charla liviana
+    "min_smalltalk_ratio": 0.75,  # Proporción de palabras de saludo/agradecimiento/acuse
+}
+
+# Saludos, agradecimientos y acuses de recibo (normalizados, sin tildes)
+SMALL_TALK = {
+    "hola", "holaa", "buenas", "buen", "dia", "tardes", "noches", "que", "onda", "hey", "ey",
+    "gracias", "graciass", "muchas", "mil", "genial", "genio", "crack", "capo", "idolo", "joya", "barbaro",
+    "buenisimo", "perfecto", "listo", "dale", "ok", "okey", "oka", "bueno", "si", "sisi", "claro",
+    "chau", "nos", "vemos", "abrazo", "saludos", "jaja", "jajaja", "jajajaja", "bro", "amigo", "hermano",
+    "tranqui", "todo", "bien", "vos", "y", "de", "nada", "un", "besos", "x", "igualmente",
+}
+
+
+def tier_config(tenant: str) -> dict:
+    """Modelos y umbrales del negocio (lo que no esté configurado, por defecto)."""
+    return {**TIER_DEFAULTS, **settings.GEMINI_MODEL_TIERS.get(tenant, {})}
+
+
+def classify_block(user_message: str, db_history: list, tenant: str = "barberia") -> str:
+    """
+    TIER_LIGHT si el bloque es charla (saludo, agradecimiento, acuse) y no está respondiendo
+    a una pregunta de reserva del bot; TIER_FULL en cualquier otro caso (ante la duda, el completo).
+    """
+    if not settings.GEMINI_ROUTING_ENABLED:
+        return TIER_FULL
+    cfg = tier_config(tenant)
+    texto = user_message.lower()
+    if _RESERVA_RE.search(texto) or any(c.isdigit() for c in texto):
+        return TIER_FULL
+
+    palabras = normalize_tokens(user_message)
+    if len(palabras) > cfg["max_light_words"]:
+        return TIER_FULL
+    if palabras and sum(p in SMALL_TALK for p in palabras) / len(palabras) < cfg["min_smalltalk_ratio"]:
+        return TIER_FULL
+
+    # "dale" después de "¿Te agendo el jueves a las 17?" es una confirmación: necesita tools
+    if awaiting_booking_reply(db_history):
+        return TIER_FULL
+    return TIER_LIGHT
+
+
+def awaiting_booking_reply(db_history: list) -> bool:
+    """La última respuesta del bot es una pregunta de reserva (ofreció horarios, pidió confirmar...)."""
+    ultimo_del_bot = next((msg.content or "" for msg in reversed(db_history) if msg.role != "user"), "")
+    return "?" in ultimo_del_bot and bool(_RESERVA_RE.search(ultimo_del_bot.lower()))
+
+
+def faq_applies(user_message: str, db_history: list) -> bool:
+    """
+    Si una respuesta fija (faq.py) puede contestar este bloque: no si nombra un día u hora concretos
+    ("atienden el lunes?") ni si contesta una pregunta de reserva del bot. Ahí decide el modelo.
+    """
+    if _DIA_U_HORA_RE.search(user_message.lower()):
+        return False
+    return not awaiting_booking_reply(db_history)
+
+
+# ==============================================================================
+# CACHÉ DE PREFIJO DEL LADO DE GOOGLE (CachedContent)
+# ==============================================================================
+# El prompt estático + el schema de tools son la mayor parte de los tokens de entrada de cada llamada.
+# Con CachedContent se suben UNA vez y las llamadas los referencian por nombre: se facturan como
+# tokens cacheados y bajan el time-to-first-token. Si el caché no está (todavía no se creó, venció,
+# el prefijo es más chico que el mínimo de Google...), se usa el prompt completo como siempre.
+
+class GoogleCachedContentBackend:
+    """Backend real: genai.caching.CachedContent (llamadas bloqueantes, se corren en el pool 'gemini')."""
+
+    def create(self, model_name: str, system_instruction: str, tools_schema: list, ttl: float) -> dict:
+        cache = genai.caching.CachedContent.create(
+            model=f"models/{model_name}",
+            display_name=f"prefijo-{_digest(system_instruction)[:12]}",
+            system_instruction=system_instruction,
+            tools=[tools_schema] if tools_schema else None,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+        return {"name": cache.name, "obj": cache, "token_count": cache.usage_metadata.total_token_count}
+
+    def refresh(self, handle: dict, ttl: float):
+        handle["obj"].update(ttl=datetime.timedelta(seconds=ttl))
+
+    def model(self, handle: dict):
+        return genai.GenerativeModel.from_cached_content(
+            cached_content=handle["obj"], generation_config=_generation_config()
+        )
+
+
+class PrefixCache:
+    """
+    Maneja los CachedContent por (modelo, prompt estático, tools):
+    - model_for() nunca bloquea al usuario: si el caché no existe o venció, dispara su creación
+      de fondo y retorna None (el llamador usa el prompt completo).
+    - Renueva el TTL de fondo cuando le quedan menos de `refresh_margin` segundos.
+    - Si crear falla, no reintenta hasta pasado `retry_after` segundos.
+    Métricas: gemini.context_cache.hits / misses / created / refreshed / errors.
+    """
+
+    def __init__(self, backend, ttl: float, refresh_margin: float, retry_after: float = 300.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        # {key: {"handle": ..., "model": ..., "expires_at": monotonic}}
+        self._entries: Dict[tuple, dict] = {}
+        self._failed_at: Dict[tuple, float] = {}
+        self._pending: Dict[tuple, asyncio.Task] = {}
+
+    @staticmethod
+    def key(model_name: str, system_instruction: str, tools_schema: list) -> tuple:
+        return (model_name, _digest(system_instruction), _digest(tools_schema or []))
+
+    def model_for(self, model_name: str, system_instruction: str, tools_schema: list):
+        key = self.key(model_name, system_instruction, tools_schema)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+
+        if entry and entry["expires_at"] > now:
+            if entry["expires_at"] - now < self.refresh_margin:
+                self._background(key, self._refresh(key))
+            metrics.inc("gemini.context_cache.hits")
+            return entry["model"]
+
+        # No hay caché (o venció): lo creamos de fondo y esta llamada va con el prompt completo
+        self._entries.pop(key, None)
+        metrics.inc("gemini.context_cache.misses")
+        if now - self._failed_at.get(key, float("-inf")) >= self.retry_after:
+            self._background(key, self._create(key, model_name, system_instruction, tools_schema))
+        return None
+
+    def invalidate(self, model_name: str, system_instruction: str, tools_schema: list):
+        """El caché dejó de servir (ej: lo borraron del lado de Google): se recrea en la próxima llamada."""
+        self._entries.pop(self.key(model_name, system_instruction, tools_schema), None)
+
+    def _background(self, key: tuple, coro):
+        if key in self._pending:
+            coro.close()
+            return
+        task = asyncio.create_task(coro)
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _create(self, key: tuple, model_name: str, system_instruction: str, tools_schema: list):
+        try:
+            handle = await run_blocking("gemini", self.backend.create, model_name, system_instruction, tools_schema, self.ttl)
+            model = self.backend.model(handle)
+        except Exception as e:
+            self._failed_at[key] = time.monotonic()
+            metrics.inc("gemini.context_cache.errors")
+            print(f"⚠️ No se pudo crear el caché de prefijo ({model_name}), se usa el prompt completo: {e}")
+            return
+        self._entries[key] = {"handle": handle, "model": model, "expires_at": time.monotonic() + self.ttl}
+        self._failed_at.pop(key, None)
+        metrics.inc("gemini.context_cache.created")
+        print(f"🧊 Caché de prefijo creado: {handle['name']} ({handle.get('token_count')} tokens)")
+
+    async def _refresh(self, key: tuple):
+        entry = self._entries.get(key)
+        if not entry:
+            return
+        try:
+            await run_blocking("gemini", self.backend.refresh, entry["handle"], self.ttl)
+        except Exception as e:
+            # Que venza solo: la próxima llamada después de eso lo recrea
+            metrics.inc("gemini.context_cache.errors")
+            print(f"⚠️ No se pudo renovar el caché de prefijo {entry['handle']['name']}: {e}")
+            return
+        entry["expires_at"] = time.monotonic() + self.ttl
+        metrics.inc("gemini.context_cache.refreshed")
+
+
+def build_prefix_cache() -> Optional[PrefixCache]:
+    """Según settings: None (deshabilitado) o caché sobre el backend de Google."""
+    if not settings.GEMINI_CONTEXT_CACHE_ENABLED:
+        return None
+    return PrefixCache(
+        GoogleCachedContentBackend(),
+        ttl=settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+        refresh_margin=settings.GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS,
+    )
+
+
+# Instancia global (None si está deshabilitado)
+prefix_cache = build_prefix_cache()
+
+
+# ==============================================================================
+# PIPELINE: PASOS ACOTADOS Y MEDIDOS
+# ==============================================================================
+
+class DeadlineExceeded(Exception):
+    """Se terminó el tiempo del bloque."""
+
+
+class BlockTrace:
+    """
+    Acompaña UN bloque de conversación por el pipeline:
+    - Lleva el deadline del bloque (cada llamada al modelo / tool recibe solo el tiempo que queda).
+    - Mide cada paso y lo publica como evento estructurado 'pipeline.step' (+ histograma por tipo),
+      y al final un 'pipeline.block' con el resultado. Así se ven los pasos lentos en producción.
+    """
+
+    def __init__(self, recipient_id: str, deadline_seconds: float):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.recipient_id = recipient_id
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline_seconds
+        self.model_calls = 0
+        self.tool_calls = 0
+        self.write_calls = 0  # Tools que pueden haber cambiado algo (agenda, datos del cliente)
+        self.tier = TIER_FULL
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        # Contadores de la memoria de tools al empezar: el evento reporta solo lo de este bloque
+        self.memo_start = tool_memo.stats(recipient_id)
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def _record(self, kind: str, seconds: float, outcome: str, **fields):
+        metrics.observe(f"pipeline.step_seconds.{kind}", seconds)
+        events.emit(
+            "pipeline.step", trace=self.trace_id, sender=self.recipient_id, kind=kind,
+            seconds=round(seconds, 3), outcome=outcome, **fields
+        )
+
+    async def model_step(self, awaitable):
+        """Una ida y vuelta al modelo, cortada por el deadline del bloque."""
+        self.model_calls += 1
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            response = await asyncio.wait_for(awaitable, timeout=max(0.0, self.remaining()))
+            usage = getattr(response, "usage_metadata", None)
+            prompt = getattr(usage, "prompt_token_count", 0) or 0
+            self.prompt_tokens += prompt
+            self.output_tokens += max(0, (getattr(usage, "total_token_count", 0) or 0) - prompt)
+            return response
+        except asyncio.TimeoutError:
+            outcome = "deadline"
+            raise DeadlineExceeded()
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self._record("model", time.perf_counter() - started, outcome, step=self.model_calls)
+
+    def tool_step(self, tool_name: str, seconds: float, outcome: str):
+        """Callback para tools.handle_tool_calls."""
+        self.tool_calls += 1
+        if tool_name not in READ_ONLY_TOOLS:
+            self.write_calls += 1
+        self._record("tool", seconds, outcome, tool=tool_name)
+
+    def finish(self, outcome: str):
+        seconds = time.monotonic() - self.started
+        metrics.observe("pipeline.block_seconds", seconds)
+        metrics.inc(f"pipeline.outcome.{outcome}")
+        # Latencia y tokens por nivel de modelo (para comparar el costo del liviano vs. el completo)
+        metrics.inc(f"gemini.tier.{self.tier}.blocks")
+        metrics.observe(f"gemini.tier.{self.tier}.seconds", seconds)
+        metrics.inc(f"gemini.tier.{self.tier}.prompt_tokens", self.prompt_tokens)
+        metrics.inc(f"gemini.tier.{self.tier}.output_tokens", self.output_tokens)
+        events.emit(
+            "pipeline.block", trace=self.trace_id, sender=self.recipient_id, outcome=outcome,
+            seconds=round(seconds, 3), model_calls=self.model_calls, tool_calls=self.tool_calls,
+            tier=self.tier, prompt_tokens=self.prompt_tokens, output_tokens=self.output_tokens,
+            tool_memo=tool_memo.stats(self.recipient_id, since=self.memo_start)
+        )
+
+
+# Al llegar al tope de pasos se le contesta esto a las tools pendientes (no se ejecutan)
+LIMITE_DE_PASOS = "No se ejecutó: se alcanzó el límite de pasos. Respondé al usuario ahora con lo que ya sabés."
+# Sin tools: el modelo tiene que contestar con texto sí o sí
+SIN_TOOLS = {"function_calling_config": {"mode": "NONE"}}
+
+
+def _respuesta_parcial(confirmaciones: list) -> str:
+    """Respuesta digna cuando se acabó el tiempo: no inventa nada, pero no oculta lo que sí se hizo."""
+    aviso = "Se me está complicando el sistema, bro. Bancame un toque que lo reviso y te escribo"
+    if confirmaciones:
+        return "\n".join(dict.fromkeys(confirmaciones)) + "\n" + aviso
+    return aviso
+
+
+def _function_responses(calls: list, results: list):
+    """Un solo Content con una FunctionResponse por cada tool pedida."""
+    return genai.protos.Content(
+        parts=[
+            genai.protos.Part(
+                function_response=genai.protos.FunctionResponse(
+                    name=tool_name,
+                    response={'result': result}
+                )
+            )
+            for (tool_name, _), result in zip(calls, results)
+        ]
     )
 
 
@@ -44,66 +628,193 @@ async def chat_with_gemini(
         recipient_id: str,
         db_history: list = [],
         tools_schema: list = [],
-        system_instruction: str = ""
+        system_instruction: str = "",
+        context: str = "",
+        tenant: str = "barberia",
+        stream: Optional[SentenceStream] = None,
+        trace: Optional[BlockTrace] = None
 ) -> str:
     """
     Función principal dinámica:
     Requiere pasarle los TOOLS y las INSTRUCCIONES específicas del negocio.
+    `context` (fecha actual, datos del cliente) se antepone al mensaje del usuario,
+    así el system_instruction queda idéntico entre clientes y el modelo se reutiliza.
+    El bucle de tools tiene tope de pasos (GEMINI_MAX_TOOL_STEPS) y de tiempo (CONVERSATION_DEADLINE_SECONDS).
+    La charla liviana va a un modelo más barato, sin tools y con prompts.LIGHT_PROMPTS (ver classify_block).
+    Con `stream`, el texto de cada turno se entrega a medida que llega (cerrarlo con stream.close()).
+    `trace` permite al llamador ver después qué se ejecutó (ej: trace.write_calls); si no, se crea uno.
     """
+    trace = trace or BlockTrace(recipient_id, settings.CONVERSATION_DEADLINE_SECONDS)
+
+    # 0. Nivel de modelo según la complejidad del bloque
+    trace.tier = classify_block(user_message, db_history, tenant)
+    model_name = tier_config(tenant)[trace.tier]
+    if trace.tier == TIER_LIGHT:
+        # Sin tools, y con su propia instrucción corta (la completa le pide usarlas)
+        tools_schema = []
+        system_instruction = prompts.LIGHT_PROMPTS[tenant]
 
-    # 1. Instanciamos el modelo con la personalidad correcta
-    model = get_model(tools_schema, system_instruction)
+    # 1. Modelo con la personalidad correcta: con el prefijo en el caché de Google si está listo,
+    #    si no el de siempre (prompt completo, instancia cacheada en el proceso)
+    model = prefix_cache.model_for(model_name, system_instruction, tools_schema) if prefix_cache else None
+    usa_cache_de_prefijo = model is not None
+    if model is None:
+        model = get_model(tools_schema, system_instruction, model_name=model_name)
+    if context:
+        metrics.observe("prompts.context_bytes", len(context.encode("utf-8")), buckets=BYTES_BUCKETS)
 
     # 2. Iniciamos el chat con historial
     formatted_history = _format_history(db_history)
     chat_session = model.start_chat(history=formatted_history)
 
+    # Cada llamada re-envía todo el contexto: estimamos su tamaño para el presupuesto de tokens
+    first_message = f"{context}\n\n### MENSAJE DEL USUARIO:\n{user_message}" if context else user_message
+    prompt_tokens = estimate_tokens(
+        system_instruction, json.dumps(tools_schema, ensure_ascii=False), first_message,
+        *[msg.content for msg in db_history]
+    )
+    priority = booking_priority(user_message, db_history)
+
     # 3. Enviamos el mensaje del usuario
     try:
-        response = await chat_session.send_message_async(user_message)
+        try:
+            response = await trace.model_step(
+                _send(chat_session, first_message, recipient_id, priority, prompt_tokens, stream)
+            )
+        except (AdmissionRejected, DeadlineExceeded, CircuitOpen):
+            raise
+        except Exception as e:
+            if not usa_cache_de_prefijo or is_retryable(e):
+                raise
+            # El caché de prefijo falló (vencido/borrado): reintentamos una vez con el prompt completo
+            print(f"⚠️ Falló el caché de prefijo, reintento con el prompt completo: {e}")
+            prefix_cache.invalidate(model_name, system_instruction, tools_schema)
+            usa_cache_de_prefijo = False
+            chat_session = get_model(tools_schema, system_instruction, model_name=model_name).start_chat(
+                history=formatted_history
+            )
+            response = await trace.model_step(
+                _send(chat_session, first_message, recipient_id, priority, prompt_tokens, stream)
+            )
+    except AdmissionRejected as e:
+        print(f"🚦 Gemini saturado, no se atendió a {recipient_id}: {e}")
+        trace.finish("rejected")
+        return "Uh, estamos a full ahora mismo. Bancame un toque y escribime de nuevo"
+    except DeadlineExceeded:
+        trace.finish("deadline")
+        return _respuesta_parcial([])
     except Exception as e:
         print(f"⚠️ Error inicial Gemini: {e}")
+        nada_visible = not (stream and stream.fed)
+        if settings.GEMINI_QUEUED_RETRY and nada_visible and (isinstance(e, CircuitOpen) or is_retryable(e)):
+            # Todavía no se hizo nada: el bloque entero se puede re-ejecutar cuando Gemini vuelva
+            trace.finish("unavailable")
+            raise GeminiUnavailable(str(e)) from e
+        trace.finish("error")
         return "Disculpa, estoy teniendo problemas de conexión. ¿Me repetís?"
 
     # --- BUCLE DE HERRAMIENTAS (Function Calling Loop) ---
+    pasos = 0
+    confirmaciones = []  # Escrituras que salieron bien (por si hay que cortar antes de la respuesta final)
+    outcome = "ok"
     try:
         while True:
-            function_call = None
-            # Buscamos si Gemini quiere llamar a una función
+            # Juntamos TODAS las llamadas a funciones de la respuesta (puede pedir varias a la vez)
+            function_calls = []
             if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if part.function_call:
-                        function_call = part.function_call
-                        break
+                function_calls = [part.function_call for part in response.candidates[0].content.parts
+                                  if part.function_call]
 
             # Si NO hay llamada a función, es respuesta final de texto. Salimos.
-            if not function_call:
+            if not function_calls:
                 break
 
-            tool_name = function_call.name
-            tool_args = dict(function_call.args)
+            calls = [(fc.name, dict(fc.args)) for fc in function_calls]
+            metrics.observe("gemini.tool_calls_per_turn", len(calls), buckets=COUNT_BUCKETS)
+
+            if pasos >= settings.GEMINI_MAX_TOOL_STEPS:
+                if outcome == "max_steps":
+                    # Ya le pedimos que contestara sin tools y volvió a pedir tools
+                    return _respuesta_parcial(confirmaciones)
+                # Tope de pasos: no ejecutamos más tools y le pedimos la respuesta final ya
+                print(f"🛑 Tope de {settings.GEMINI_MAX_TOOL_STEPS} pasos para {recipient_id}, se fuerza la respuesta")
+                outcome = "max_steps"
+                extra = {} if usa_cache_de_prefijo else {"tool_config": SIN_TOOLS}
+                response = await trace.model_step(_send(
+                    chat_session, _function_responses(calls, [LIMITE_DE_PASOS] * len(calls)),
+                    recipient_id, PRIORIDAD_CONTINUACION, prompt_tokens, stream, **extra
+                ))
+                continue
 
-            print(f"🤖 Gemini pide usar tool: {tool_name} con args: {tool_args}")
+            pasos += 1
+            print(f"🤖 Gemini pide usar {len(calls)} tool(s): {calls}")
 
-            # 4. Ejecutar la herramienta real
+            # 4. Ejecutar las herramientas reales (lecturas en paralelo, escrituras en orden, con timeout)
             # (El handle_tool_call ya contiene la lógica de negocio)
-            tool_result = await handle_tool_call(tool_name, tool_args, recipient_id)
-            print(f"🔧 Resultado Tool: {tool_result}")
-
-            # 5. Devolver el resultado a Gemini para que continue generando la respuesta natural
-            response = await chat_session.send_message_async(
-                genai.protos.Content(
-                    parts=[genai.protos.Part(
-                        function_response=genai.protos.FunctionResponse(
-                            name=tool_name,
-                            response={'result': tool_result}
-                        )
-                    )]
-                )
+            if trace.remaining() <= 0:
+                raise DeadlineExceeded()
+            tool_results = await handle_tool_calls(
+                calls, recipient_id,
+                timeout=settings.TOOL_TIMEOUT_SECONDS,
+                on_step=trace.tool_step,
+                deadline=trace.deadline
             )
+            for (tool_name, _), tool_result in zip(calls, tool_results):
+                print(f"🔧 Resultado Tool {tool_name}: {tool_result}")
+                if tool_name not in READ_ONLY_TOOLS and str(tool_result).startswith("✅"):
+                    confirmaciones.append(str(tool_result))
+
+            # 5. Devolver TODOS los resultados juntos, en un solo mensaje, para que continúe
+            # (prioridad máxima: la conversación ya está a mitad de camino)
+            prompt_tokens += estimate_tokens(*[str(r) for r in tool_results])
+            response = await trace.model_step(_send(
+                chat_session, _function_responses(calls, tool_results),
+                recipient_id, PRIORIDAD_CONTINUACION, prompt_tokens, stream
+            ))
 
+        return response.text
+
+    except DeadlineExceeded:
+        outcome = "deadline"
+        print(f"⏱️ Se acabó el tiempo del bloque de {recipient_id}, respuesta parcial")
+        return _respuesta_parcial(confirmaciones)
     except Exception as e:
+        outcome = "error"
         print(f"⚠️ Error en el bucle de tools: {e}")
         return "Disculpa, tuve un error procesando tu solicitud. ¿Podrías intentar de nuevo?"
+    finally:
+        metrics.observe("gemini.round_trips_per_block", trace.model_calls, buckets=COUNT_BUCKETS)
+        trace.finish(outcome)
+
+
+# ==============================================================================
+# RESUMEN ACUMULADO DEL HISTORIAL
+# ==============================================================================
+# Lo que queda fuera de la ventana de historial (ver app/services/history.py) se pliega en un resumen
+# por cliente. Va con el modelo liviano y con la prioridad más baja del scheduler.
+
+RESUMEN_INSTRUCTION = """Resumís conversaciones de Instagram entre una barbería y un cliente para que el asistente
+pueda retomar la charla. Escribí en español, en tercera persona, en pocas líneas.
+Conservá SIEMPRE: nombre y teléfono si aparecen, turnos agendados / cancelados / movidos (día y hora exactos),
+horarios ofrecidos que el cliente no contestó, pedidos pendientes y preferencias.
+Omití saludos, agradecimientos y charla sin información. Devolvé SOLO el resumen actualizado."""
 
-    return response.text
\ No newline at end of file
+
+async def summarize_conversation(previous: Optional[str], mensajes: list, sender_id: str,
+                                 tenant: str = "barberia", max_tokens: int = 250) -> str:
+    """Resumen anterior + mensajes nuevos -> resumen actualizado (acotado a ~max_tokens)."""
+    transcript = "\n".join(
+        f"{'Cliente' if msg.role == 'user' else 'Barbería'}: {msg.content}" for msg in mensajes if msg.content
+    )
+    contenido = (
+        f"### RESUMEN ANTERIOR:\n{previous or '(vacío)'}\n\n"
+        f"### MENSAJES NUEVOS:\n{transcript}\n\n"
+        f"Máximo {max_tokens * CHARS_PER_TOKEN // 6} palabras."
+    )
+    model = get_model([], RESUMEN_INSTRUCTION, model_name=tier_config(tenant)[TIER_LIGHT])
+    response = await _send(
+        model.start_chat(), contenido, sender_id, PRIORIDAD_FONDO, estimate_tokens(RESUMEN_INSTRUCTION, contenido)
+    )
+    metrics.inc("history.summaries")
+    # Tope duro por si el modelo se estira
+    return response.text.strip()[:max_tokens * CHARS_PER_TOKEN]
@@ -0,0 +1,151 @@
+# app/services/history.py
+import asyncio
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import metrics
+from app.models.models import MensajeBarberia
+from app.services import crud, gemini
+
+# ==============================================================================
+# HISTORIAL DEL PROMPT CON PRESUPUESTO DE TOKENS
+# ==============================================================================
+# Antes: siempre los últimos 10 mensajes, midieran lo que midieran (un texto pegado inflaba el prompt
+# y en charlas de mensajes cortos se perdía el horario acordado hace tres turnos).
+# Ahora: los mensajes más recientes entran textuales hasta HISTORY_TOKEN_BUDGET, y lo anterior
+# vive en un resumen por cliente (tabla barberia_resumenes) que se actualiza después de cada bloque.
+
+# Buckets (tokens) para los histogramas de tamaño del historial
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 5000, 8000, 12000)
+
+# Cuántos mensajes usaba el historial fijo (para comparar el antes y el después)
+LEGACY_HISTORY_LIMIT = 10
+
+
+class Turno(NamedTuple):
+    """Copia liviana de un mensaje (nunca se modifica el objeto ORM: se guardaría recortado)."""
+    id: int
+    role: str
+    content: str
+
+
+class HistoryWindow(NamedTuple):
+    history: List[Turno]  # Mensajes textuales, en orden cronológico
+    summary: Optional[str]  # Resumen de lo anterior (o None)
+
+
+def _recortar(texto: str, max_tokens: int) -> str:
+    if gemini.estimate_tokens(texto) <= max_tokens:
+        return texto
+    return texto[:max_tokens * gemini.CHARS_PER_TOKEN].rstrip() + " […]"
+
+
+def budget_window(mensajes: list, budget: int, max_message_tokens: int) -> List[Turno]:
+    """
+    Desde el más nuevo hacia atrás, mientras entren en el presupuesto. El último mensaje entra siempre.
+    `mensajes` en orden cronológico.
+    """
+    ventana: List[Turno] = []
+    usados = 0
+    for msg in reversed(mensajes):
+        if not msg.content:
+            continue
+        content = _recortar(msg.content, max_message_tokens)
+        if content != msg.content:
+            metrics.inc("history.messages_truncated")
+        costo = gemini.estimate_tokens(content)
+        if ventana and usados + costo > budget:
+            break
+        ventana.append(Turno(msg.id, msg.role, content))
+        usados += costo
+    return ventana[::-1]
+
+
+async def aload(db: AsyncSession, cliente_id: int) -> HistoryWindow:
+    """Ventana de historial + resumen para el prompt. Publica el tamaño antes (10 fijos) y después."""
+    mensajes = await crud.aget_chat_history(db, MensajeBarberia, cliente_id, limit=settings.HISTORY_FETCH_LIMIT)
+    ventana = budget_window(mensajes, settings.HISTORY_TOKEN_BUDGET, settings.HISTORY_MESSAGE_MAX_TOKENS)
+
+    summary = None
+    # Hay algo fuera de la ventana: o no entró en el presupuesto, o ni se leyó (conversación larga)
+    fuera_de_ventana = len(ventana) < len(mensajes) or len(mensajes) >= settings.HISTORY_FETCH_LIMIT
+    if settings.HISTORY_SUMMARY_ENABLED and fuera_de_ventana:
+        resumen = await crud.resumen_barberia.aget_one(db, cliente_id=cliente_id)
+        summary = resumen.resumen if resumen else None
+
+    legacy = gemini.estimate_tokens(*[msg.content for msg in mensajes[-LEGACY_HISTORY_LIMIT:]])
+    budgeted = gemini.estimate_tokens(*[t.content for t in ventana], summary or "")
+    metrics.observe("history.prompt_tokens.legacy", legacy, buckets=TOKEN_BUCKETS)
+    metrics.observe("history.prompt_tokens.budgeted", budgeted, buckets=TOKEN_BUCKETS)
+    metrics.observe("history.messages_kept", len(ventana), buckets=(2, 4, 6, 10, 15, 20, 30, 40))
+    return HistoryWindow(ventana, summary)
+
+
+# Resúmenes corriendo de fondo: {cliente_id: Task} (uno por cliente a la vez)
+_resumiendo: Dict[int, asyncio.Task] = {}
+
+
+def schedule_summary(cliente_id: int, sender_id: str):
+    """
+    Dispara refresh_summary de fondo con su propia sesión: la llamada extra al modelo no demora
+    el próximo bloque del usuario (ni retiene el trabajo del worker). Si ya hay uno corriendo
+    para el cliente, no se lanza otro: lo nuevo se pliega en la próxima pasada.
+    """
+    if not settings.HISTORY_SUMMARY_ENABLED or cliente_id in _resumiendo:
+        return
+    task = asyncio.create_task(_refresh_in_background(cliente_id, sender_id))
+    _resumiendo[cliente_id] = task
+    task.add_done_callback(lambda _: _resumiendo.pop(cliente_id, None))
+
+
+async def _refresh_in_background(cliente_id: int, sender_id: str):
+    async with AsyncSessionLocal() as db:
+        await refresh_summary(db, cliente_id, sender_id)
+
+
+async def refresh_summary(db: AsyncSession, cliente_id: int, sender_id: str):
+    """
+    Después de responder: pliega en el resumen los mensajes que quedaron fuera de la ventana
+    y todavía no están resumidos (incremental: solo lo nuevo desde `hasta_mensaje_id`).
+    Avanza de a tandas de HISTORY_FETCH_LIMIT, de lo más viejo a lo más nuevo, así no se saltea nada.
+    Nunca propaga errores: si falla, se reintenta en el próximo bloque (lo ya plegado queda).
+    """
+    if not settings.HISTORY_SUMMARY_ENABLED:
+        return
+    try:
+        mensajes = await crud.aget_chat_history(db, MensajeBarberia, cliente_id, limit=settings.HISTORY_FETCH_LIMIT)
+        ventana = budget_window(mensajes, settings.HISTORY_TOKEN_BUDGET, settings.HISTORY_MESSAGE_MAX_TOKENS)
+        if not ventana or (len(ventana) == len(mensajes) and len(mensajes) < settings.HISTORY_FETCH_LIMIT):
+            return  # Toda la conversación entra textual: nada para resumir
+
+        resumen = await crud.resumen_barberia.aget_one(db, cliente_id=cliente_id)
+        desde = resumen.hasta_mensaje_id if resumen else 0
+        while True:
+            pendientes = await crud.aget_messages_between(
+                db, MensajeBarberia, cliente_id, after_id=desde, before_id=ventana[0].id,
+                limit=settings.HISTORY_FETCH_LIMIT
+            )
+            if not pendientes:
+                return
+
+            nuevo = await gemini.summarize_conversation(
+                resumen.resumen if resumen else None, pendientes, sender_id,
+                max_tokens=settings.HISTORY_SUMMARY_MAX_TOKENS
+            )
+            desde = pendientes[-1].id
+            if resumen:
+                resumen = await crud.resumen_barberia.aupdate(db, resumen, resumen=nuevo, hasta_mensaje_id=desde)
+            else:
+                resumen = await crud.resumen_barberia.acreate(
+                    db, cliente_id=cliente_id, resumen=nuevo, hasta_mensaje_id=desde
+                )
+            metrics.inc("history.summarized_messages", len(pendientes))
+            if len(pendientes) < settings.HISTORY_FETCH_LIMIT:
+                return
+    except Exception as e:
+        await db.rollback()
+        metrics.inc("history.summary_errors")
+        print(f"⚠️ No se pudo actualizar el resumen de {sender_id}: {e}")
@@ -1,73 +1,463 @@
 # app/services/instagram.py
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Deque, Dict, Optional
+
 import httpx
+from sqlalchemy import delete, or_, select, update
+
 from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import metrics
+from app.models.models import EnvioPendienteInstagram
 
 # Versión de la API
 GRAPH_URL = "https://graph.instagram.com/v21.0"
 
-async def send_text(recipient_id: str, text: str):
+# ==============================================================================
+# CLIENTE HTTP COMPARTIDO
+# ==============================================================================
+# Un solo cliente para toda la vida de la app: mantiene las conexiones abiertas
+# (keep-alive + HTTP/2), así no pagamos TCP+TLS contra graph.instagram.com en cada respuesta.
+# Se abre y se cierra desde el lifespan de FastAPI (ver app/main.py).
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=settings.INSTAGRAM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.INSTAGRAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.INSTAGRAM_MAX_CONNECTIONS,
+            keepalive_expiry=settings.INSTAGRAM_KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            settings.INSTAGRAM_TIMEOUT_SECONDS,
+            connect=settings.INSTAGRAM_CONNECT_TIMEOUT_SECONDS,
+        ),
+        headers={
+            "Authorization": f"Bearer {settings.INSTAGRAM_TOKEN}",
+            "Content-Type": "application/json"
+        },
+    )
+
+
+# Recuperación periódica de envíos que dejó colgados otro proceso (ver OutboundQueue.restore)
+_recovery_task: Optional[asyncio.Task] = None
+
+
+async def startup():
+    """Abre el cliente compartido y retoma los envíos pendientes (lifespan de FastAPI y workers)."""
+    global _client, _recovery_task
+    if _client is None:
+        _client = _build_client()
+    await outbound_queue.restore()
+    if _recovery_task is None:
+        _recovery_task = asyncio.create_task(outbound_queue.recover_forever())
+
+
+async def shutdown():
+    """Vacía la cola de envíos y cierra el cliente compartido (lifespan de FastAPI y workers)."""
+    global _client, _recovery_task
+    if _recovery_task is not None:
+        _recovery_task.cancel()
+        _recovery_task = None
+    await outbound_queue.close()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Retorna el cliente compartido (lo crea si se usa fuera de la app, ej: scripts)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+# ==============================================================================
+# ENVÍO
+# ==============================================================================
+
+async def _post_message(recipient_id: str, message: dict, tipo: str):
+    """Envía un mensaje (texto, imagen...) a un destinatario."""
+    return await _post(recipient_id, {"message": message}, tipo)
+
+
+async def _post(recipient_id: str, payload: dict, tipo: str):
     """
-    Envía texto a Instagram Direct.
-    URL Correcta: /{INSTAGRAM_ID}/messages
+    POST a /{INSTAGRAM_ID}/messages con el cliente compartido.
+    `payload`: {"message": ...} o {"sender_action": ...}.
+    Registra latencia y si la conexión fue nueva o reutilizada.
     """
     # --- CAMBIO CLAVE: Usamos el ID de Instagram, no "me" ---
     url = f"{GRAPH_URL}/{settings.INSTAGRAM_ID}/messages"
 
-    headers = {
-        "Authorization": f"Bearer {settings.INSTAGRAM_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
     data = {
         "recipient": {"id": recipient_id},
-        "message": {"text": text}
+        **payload
         # Nota: messaging_type a veces sobra en IG, lo quitamos por seguridad
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=data, headers=headers)
-            if response.status_code != 200:
-                print(f"⚠️ Error Meta (Texto): {response.text}")
-            response.raise_for_status()
-            return {"status": "success", "data": response.json()}
-        except Exception as e:
-            print(f"❌ Error enviando texto: {e}")
-            return {"status": "error", "message": str(e)}
+    # httpcore avisa por 'trace' cuando abre un socket nuevo: si no lo hace, se reusó la conexión
+    conexion = {"nueva": False}
 
+    async def trace(event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.started":
+            conexion["nueva"] = True
 
-async def send_image(recipient_id: str, image_url: str):
+    started = time.perf_counter()
+    try:
+        response = await get_client().post(url, json=data, extensions={"trace": trace})
+        metrics.observe("instagram.send_seconds", time.perf_counter() - started)
+        metrics.inc("instagram.connections_new" if conexion["nueva"] else "instagram.connections_reused")
+        if response.http_version == "HTTP/2":
+            metrics.inc("instagram.http2_requests")
+
+        if response.status_code != 200:
+            print(f"⚠️ Error Meta ({tipo}): {response.text}")
+        response.raise_for_status()
+        return {"status": "success", "data": response.json()}
+    except Exception as e:
+        metrics.inc("instagram.send_errors")
+        print(f"❌ Error enviando {tipo.lower()}: {e}")
+        return {"status": "error", "message": str(e), "retryable": _is_retryable(e)}
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Se reintenta ante throttling (429), errores de Meta (5xx) o fallas de red; nunca ante otros 4xx."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def send_text(recipient_id: str, text: str):
     """
-    Envía imagen a Instagram Direct.
+    Envía texto a Instagram Direct.
+    URL Correcta: /{INSTAGRAM_ID}/messages
     """
-    # --- CAMBIO CLAVE: Usamos el ID de Instagram, no "me" ---
-    url = f"{GRAPH_URL}/{settings.INSTAGRAM_ID}/messages"
+    return await _post_message(recipient_id, {"text": text}, "Texto")
 
-    headers = {
-        "Authorization": f"Bearer {settings.INSTAGRAM_TOKEN}",
-        "Content-Type": "application/json"
-    }
 
-    data = {
-        "recipient": {"id": recipient_id},
-        "message": {
-            "attachment": {
-                "type": "image",
-                "payload": {
-                    "url": image_url,
-                    "is_reusable": True
-                }
+async def send_image(recipient_id: str, image_url: str):
+    """
+    Envía imagen a Instagram Direct.
+    """
+    message = {
+        "attachment": {
+            "type": "image",
+            "payload": {
+                "url": image_url,
+                "is_reusable": True
             }
         }
     }
+    return await _post_message(recipient_id, message, "Imagen")
+
+
+# Indicadores de "escribiendo..." en vuelo (referencia fuerte para que no los junte el GC)
+_typing_tasks = set()
+
 
-    async with httpx.AsyncClient() as client:
+async def send_typing_on(recipient_id: str):
+    """Muestra "escribiendo..." en el chat (sin reintentos ni persistencia: si no sale, no pasa nada)."""
+    await outbound_queue.bucket.acquire()
+    return await _post(recipient_id, {"sender_action": "typing_on"}, "Escribiendo")
+
+
+def start_typing(recipient_id: str):
+    """Dispara el indicador de escritura de fondo, sin demorar el pipeline."""
+    if not settings.INSTAGRAM_TYPING_INDICATOR:
+        return
+    task = asyncio.create_task(send_typing_on(recipient_id))
+    _typing_tasks.add(task)
+    task.add_done_callback(_typing_tasks.discard)
+
+
+# ==============================================================================
+# COLA DE ENVÍOS SALIENTES
+# ==============================================================================
+
+class TokenBucket:
+    """Limitador global de tasa: `rate` envíos por segundo, con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Dueño de los envíos que encola este proceso (hay varios: workers de uvicorn, app/worker.py)
+PROCESO = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _utc_now() -> datetime:
+    """UTC naive (así se guardan los leases, igual en SQLite y Postgres)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class OutboundQueue:
+    """
+    Cola de respuestas hacia Instagram.
+    - Orden garantizado por destinatario: cada uno tiene su fila y un único worker que la drena.
+    - Destinatarios distintos se drenan en paralelo, todos bajo el mismo token bucket global.
+    - Reintentos con backoff exponencial + jitter ante 429/5xx/red; otros 4xx se descartan.
+    - Cada envío se persiste en DB antes de intentar, así sobrevive a un reinicio (ver restore()).
+    - Cada fila es del proceso que la encoló (lease de `lease` segundos, renovado mientras la tenga):
+      restore() solo retoma leases vencidos, así dos procesos vivos nunca mandan el mismo mensaje.
+    """
+
+    def __init__(self, rate: float, burst: int, max_attempts: int, backoff: float, backoff_max: float,
+                 lease: float = 120.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self._pending: Dict[str, Deque[dict]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._propios = set()  # ids en DB de los envíos que tenemos en memoria (lease a renovar)
+        self._lease_task: Optional[asyncio.Task] = None
+        self.depth = 0
+
+    def _update_depth(self, delta: int):
+        self.depth += delta
+        metrics.set_gauge("instagram.outbound_queue_depth", self.depth)
+
+    async def enqueue(self, recipient_id: str, message: dict, tipo: str, on_delivered: Optional[Callable] = None):
+        """
+        Encola un mensaje (persistido) y despierta al worker del destinatario.
+        `on_delivered`: se llama cuando Meta lo acepta (no sobrevive a un reinicio).
+        """
+        envio = {
+            "id": None,
+            "recipient_id": recipient_id,
+            "message": message,
+            "tipo": tipo,
+            "intentos": 0,
+            "creado": datetime.now(),
+            "on_delivered": on_delivered,
+        }
         try:
-            response = await client.post(url, json=data, headers=headers)
-            if response.status_code != 200:
-                print(f"⚠️ Error Meta (Imagen): {response.text}")
-            response.raise_for_status()
-            return {"status": "success", "data": response.json()}
+            async with AsyncSessionLocal() as db:
+                row = EnvioPendienteInstagram(
+                    recipient_id=recipient_id, tipo=tipo, payload=json.dumps(message), creado=envio["creado"],
+                    proceso=PROCESO, visible_desde=_utc_now() + timedelta(seconds=self.lease)
+                )
+                db.add(row)
+                await db.commit()
+                envio["id"] = row.id
         except Exception as e:
-            print(f"❌ Error enviando imagen: {e}")
-            return {"status": "error", "message": str(e)}
\ No newline at end of file
+            # Si la DB falla igual lo mandamos, solo perdemos la durabilidad
+            print(f"⚠️ No se pudo persistir el envío a {recipient_id}: {e}")
+
+        self._push(envio)
+
+    def _push(self, envio: dict):
+        recipient_id = envio["recipient_id"]
+        self._pending.setdefault(recipient_id, deque()).append(envio)
+        self._update_depth(1)
+        if envio["id"] is not None:
+            self._propios.add(envio["id"])
+            if self._lease_task is None or self._lease_task.done():
+                self._lease_task = asyncio.create_task(self._renew_leases())
+        if recipient_id not in self._workers:
+            self._workers[recipient_id] = asyncio.create_task(self._drain(recipient_id))
+
+    async def _renew_leases(self):
+        """Mientras tengamos envíos en memoria, corremos su lease (un UPDATE para todos)."""
+        while self._propios:
+            await asyncio.sleep(self.lease / 3)
+            ids = list(self._propios)
+            if not ids:
+                break
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(EnvioPendienteInstagram)
+                        .where(EnvioPendienteInstagram.id.in_(ids), EnvioPendienteInstagram.proceso == PROCESO)
+                        .values(visible_desde=_utc_now() + timedelta(seconds=self.lease))
+                    )
+                    await db.commit()
+            except Exception as e:
+                print(f"⚠️ Error renovando los envíos pendientes de {PROCESO}: {e}")
+
+    async def _drain(self, recipient_id: str):
+        fila = self._pending[recipient_id]
+        try:
+            while fila:
+                envio = fila[0]
+                await self.bucket.acquire()
+                res = await _post_message(recipient_id, envio["message"], envio["tipo"])
+                envio["intentos"] += 1
+
+                if res["status"] == "success":
+                    metrics.observe(
+                        "instagram.delivery_seconds", (datetime.now() - envio["creado"]).total_seconds()
+                    )
+                    if envio.get("on_delivered"):
+                        envio["on_delivered"]()
+                elif res.get("retryable") and envio["intentos"] < self.max_attempts:
+                    metrics.inc("instagram.send_retries")
+                    await self._save_attempts(envio)
+                    delay = min(self.backoff_max, self.backoff * 2 ** (envio["intentos"] - 1))
+                    await asyncio.sleep(random.uniform(0, delay))  # Full jitter
+                    continue  # Reintentamos el MISMO mensaje: no se rompe el orden
+                else:
+                    metrics.inc("instagram.send_dropped")
+                    print(f"❌ Envío a {recipient_id} descartado tras {envio['intentos']} intento(s): {res['message']}")
+
+                fila.popleft()
+                self._update_depth(-1)
+                await self._forget(envio)
+        finally:
+            self._workers.pop(recipient_id, None)
+            if not fila:
+                self._pending.pop(recipient_id, None)
+
+    async def _save_attempts(self, envio: dict):
+        if envio["id"] is None:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(EnvioPendienteInstagram)
+                    .where(EnvioPendienteInstagram.id == envio["id"])
+                    .values(intentos=envio["intentos"])
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"⚠️ Error actualizando envío pendiente: {e}")
+
+    async def _forget(self, envio: dict):
+        if envio["id"] is None:
+            return
+        self._propios.discard(envio["id"])
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(EnvioPendienteInstagram).where(EnvioPendienteInstagram.id == envio["id"]))
+                await db.commit()
+        except Exception as e:
+            print(f"⚠️ Error borrando envío entregado: {e}")
+
+    async def restore(self):
+        """
+        Vuelve a encolar (en orden) lo que quedó sin entregar: SOLO filas con el lease vencido
+        (proceso caído o apagado), tomadas atómicamente como en jobs.claim (SKIP LOCKED en Postgres).
+        Lo que está mandando otro proceso vivo no se toca.
+        """
+        E = EnvioPendienteInstagram
+        ahora = _utc_now()
+        try:
+            async with AsyncSessionLocal() as db:
+                candidatos = (
+                    select(E.id)
+                    .where(or_(E.visible_desde.is_(None), E.visible_desde <= ahora))
+                    .order_by(E.id)
+                )
+                if db.get_bind().dialect.name == "postgresql":
+                    candidatos = candidatos.with_for_update(skip_locked=True)
+                result = await db.execute(
+                    update(E)
+                    .where(E.id.in_(candidatos.scalar_subquery()))
+                    .values(proceso=PROCESO, visible_desde=ahora + timedelta(seconds=self.lease))
+                    .returning(E.id, E.recipient_id, E.payload, E.tipo, E.intentos, E.creado)
+                    .execution_options(synchronize_session=False)
+                )
+                rows = sorted(result.all(), key=lambda row: row.id)
+                await db.commit()
+        except Exception as e:
+            print(f"⚠️ No se pudieron recuperar envíos pendientes: {e}")
+            return
+
+        rows = [row for row in rows if row.id not in self._propios]
+        for row in rows:
+            self._push({
+                "id": row.id,
+                "recipient_id": row.recipient_id,
+                "message": json.loads(row.payload),
+                "tipo": row.tipo,
+                "intentos": row.intentos or 0,
+                "creado": row.creado or datetime.now(),
+            })
+        if rows:
+            metrics.inc("instagram.sends_restored", len(rows))
+            print(f"📬 Recuperados {len(rows)} envíos pendientes a Instagram.")
+
+    async def recover_forever(self):
+        """Cada `lease` segundos retoma lo que dejó colgado un proceso que se cayó sin apagarse prolijo."""
+        while True:
+            await asyncio.sleep(self.lease)
+            await self.restore()
+
+    async def close(self, timeout: float = 5.0):
+        """Espera a que se vacíe la cola; lo que no salga queda en DB para el próximo arranque."""
+        workers = list(self._workers.values())
+        if workers:
+            _, pendientes = await asyncio.wait(workers, timeout=timeout)
+            for task in pendientes:
+                task.cancel()
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+        await self._release()
+
+    async def _release(self):
+        """Suelta el lease de lo que no salió: el próximo proceso que arranque (o ya vivo) lo retoma enseguida."""
+        ids = list(self._propios)
+        if not ids:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(EnvioPendienteInstagram)
+                    .where(EnvioPendienteInstagram.id.in_(ids), EnvioPendienteInstagram.proceso == PROCESO)
+                    .values(proceso=None, visible_desde=None)
+                )
+                await db.commit()
+            self._propios.clear()
+        except Exception as e:
+            print(f"⚠️ No se pudieron liberar los envíos pendientes (se retoman al vencer el lease): {e}")
+
+
+# Instancia global de la cola
+outbound_queue = OutboundQueue(
+    rate=settings.INSTAGRAM_SEND_RATE_PER_SECOND,
+    burst=settings.INSTAGRAM_SEND_BURST,
+    max_attempts=settings.INSTAGRAM_SEND_MAX_ATTEMPTS,
+    backoff=settings.INSTAGRAM_SEND_BACKOFF_SECONDS,
+    backoff_max=settings.INSTAGRAM_SEND_BACKOFF_MAX_SECONDS,
+    lease=settings.INSTAGRAM_SEND_LEASE_SECONDS,
+)
+
+
+async def enqueue_text(recipient_id: str, text: str, on_delivered: Optional[Callable] = None):
+    """Encola un texto para Instagram Direct (con orden, reintentos y límite de tasa)."""
+    await outbound_queue.enqueue(recipient_id, {"text": text}, "Texto", on_delivered=on_delivered)
+
+
+async def enqueue_image(recipient_id: str, image_url: str):
+    """Encola una imagen para Instagram Direct (con orden, reintentos y límite de tasa)."""
+    message = {"attachment": {"type": "image", "payload": {"url": image_url, "is_reusable": True}}}
+    await outbound_queue.enqueue(recipient_id, message, "Imagen")
@@ -0,0 +1,184 @@
+# app/services/jobs.py
+import datetime
+from typing import List
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import aliased
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import metrics
+from app.models.models import TrabajoConversacion
+
+# Estados "vivos": los que todavía cuentan para el orden del usuario
+ESTADOS_ACTIVOS = ("pendiente", "en_proceso")
+
+
+def _utc_now() -> datetime.datetime:
+    """UTC naive (así se guardan las fechas de la cola, igual en SQLite y Postgres)."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class JobQueue:
+    """
+    Cola durable (tabla conversacion_trabajos) de bloques de conversación para los workers de IA.
+    - El web solo encola (enqueue); los workers toman con claim(), procesan y confirman con complete().
+    - Orden por usuario: solo se puede tomar el trabajo vivo MÁS VIEJO de cada sender_id,
+      así nunca hay dos pipelines del mismo usuario en paralelo (ni entre procesos).
+    - Si llega otro bloque mientras el anterior sigue pendiente, se concatena (no se crea otro trabajo).
+    - Visibility timeout: si un worker muere con un trabajo tomado, vuelve a estar disponible al vencer.
+    - Reintentos con backoff exponencial; al agotarlos el trabajo queda 'muerto' (dead-letter) para revisar.
+    Claim: SELECT ... FOR UPDATE SKIP LOCKED en Postgres; en SQLite el UPDATE ... RETURNING ya es atómico.
+    """
+
+    def __init__(self, visibility_timeout: float, max_attempts: int, backoff: float):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    async def enqueue(self, sender_id: str, text: str):
+        """Encola un bloque; si el usuario ya tiene uno pendiente (sin tomar), se lo suma."""
+        T = TrabajoConversacion
+        pendiente = aliased(T)
+        async with AsyncSessionLocal() as db:
+            ultimo_pendiente = (
+                select(func.max(pendiente.id))
+                .where(pendiente.sender_id == sender_id, pendiente.estado == "pendiente")
+                .scalar_subquery()
+            )
+            # El estado se vuelve a chequear en el UPDATE: en Postgres (READ COMMITTED) un claim() puede
+            # confirmar entre la subconsulta y el UPDATE, y sumarle texto a un trabajo ya leído lo perdería.
+            # Si no quedó ninguno sin tomar, va como trabajo nuevo.
+            result = await db.execute(
+                update(T)
+                .where(T.id == ultimo_pendiente, T.estado == "pendiente", T.worker.is_(None))
+                .values(texto=T.texto + " " + text)
+                .returning(T.id)
+                .execution_options(synchronize_session=False)
+            )
+            if result.first():
+                metrics.inc("jobs.folded")
+            else:
+                ahora = _utc_now()
+                await db.execute(insert(T).values(
+                    sender_id=sender_id, texto=text, estado="pendiente",
+                    intentos=0, visible_desde=ahora, creado=ahora
+                ))
+                metrics.inc("jobs.enqueued")
+            await db.commit()
+
+    async def claim(self, worker: str, limit: int) -> List[dict]:
+        """Toma hasta `limit` trabajos disponibles (uno por usuario) y los marca 'en_proceso'."""
+        T = TrabajoConversacion
+        ahora = _utc_now()
+        async with AsyncSessionLocal() as db:
+            # 1. Los que vencieron sin intentos restantes van a dead-letter
+            muertos = await db.execute(
+                update(T)
+                .where(T.estado == "en_proceso", T.visible_desde <= ahora, T.intentos >= self.max_attempts)
+                .values(estado="muerto", worker=None, ultimo_error="Visibility timeout vencido sin intentos restantes")
+                .execution_options(synchronize_session=False)
+            )
+            if muertos.rowcount:
+                metrics.inc("jobs.dead", muertos.rowcount)
+
+            # 2. Candidatos: visibles y sin un trabajo vivo más viejo del mismo usuario
+            j = aliased(T)
+            otro = aliased(T)
+            hay_mas_viejo = (
+                select(otro.id)
+                .where(otro.sender_id == j.sender_id, otro.estado.in_(ESTADOS_ACTIVOS), otro.id < j.id)
+                .exists()
+            )
+            candidatos = (
+                select(j.id)
+                .where(j.estado.in_(ESTADOS_ACTIVOS), j.visible_desde <= ahora, ~hay_mas_viejo)
+                .order_by(j.id)
+                .limit(limit)
+            )
+            if db.get_bind().dialect.name == "postgresql":
+                candidatos = candidatos.with_for_update(skip_locked=True, of=j)
+
+            # 3. Tomarlos: quedan invisibles para los demás hasta que venza el timeout
+            result = await db.execute(
+                update(T)
+                .where(T.id.in_(candidatos.scalar_subquery()))
+                .values(
+                    estado="en_proceso",
+                    worker=worker,
+                    intentos=T.intentos + 1,
+                    visible_desde=ahora + datetime.timedelta(seconds=self.visibility_timeout)
+                )
+                .returning(T.id, T.sender_id, T.texto, T.intentos, T.creado)
+                .execution_options(synchronize_session=False)
+            )
+            trabajos = [dict(row._mapping) for row in result.all()]
+            await db.commit()
+
+        for trabajo in trabajos:
+            metrics.inc("jobs.claimed")
+            if trabajo["creado"] and trabajo["intentos"] == 1:
+                metrics.observe("jobs.queue_wait_seconds", (ahora - trabajo["creado"]).total_seconds())
+        return trabajos
+
+    async def extend(self, job_id: int, worker: str):
+        """Heartbeat: corre el visibility timeout de un trabajo que seguimos procesando."""
+        T = TrabajoConversacion
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(T)
+                .where(T.id == job_id, T.worker == worker, T.estado == "en_proceso")
+                .values(visible_desde=_utc_now() + datetime.timedelta(seconds=self.visibility_timeout))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def complete(self, job_id: int, worker: str):
+        """Trabajo terminado: se borra (solo si todavía es nuestro)."""
+        T = TrabajoConversacion
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(T)
+                .where(T.id == job_id, T.worker == worker, T.estado == "en_proceso")
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        if result.rowcount:
+            metrics.inc("jobs.completed")
+        else:
+            metrics.inc("jobs.lost_ownership")
+            print(f"⚠️ El trabajo {job_id} venció antes de terminar (lo tomó otro worker).")
+
+    async def fail(self, job: dict, worker: str, error: str, retry: bool = True):
+        """
+        Reintento con backoff exponencial, o dead-letter si ya no quedan intentos.
+        `retry=False`: directo a dead-letter (el trabajo ya tuvo efectos y no se puede repetir).
+        """
+        T = TrabajoConversacion
+        muerto = not retry or job["intentos"] >= self.max_attempts
+        if muerto:
+            valores = {"estado": "muerto"}
+            metrics.inc("jobs.dead")
+        else:
+            delay = min(self.visibility_timeout, self.backoff * 2 ** (job["intentos"] - 1))
+            valores = {"estado": "pendiente", "visible_desde": _utc_now() + datetime.timedelta(seconds=delay)}
+            metrics.inc("jobs.retried")
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(T)
+                .where(T.id == job["id"], T.worker == worker, T.estado == "en_proceso")
+                .values(worker=None, ultimo_error=error[:2000], **valores)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        estado = "dead-letter" if muerto else "reintento"
+        print(f"❌ Trabajo {job['id']} ({job['sender_id']}) falló [{job['intentos']}/{self.max_attempts}] -> {estado}: {error}")
+
+
+# Instancia global de la cola
+job_queue = JobQueue(
+    visibility_timeout=settings.JOB_VISIBILITY_TIMEOUT_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    backoff=settings.JOB_RETRY_BACKOFF_SECONDS,
+)
@@ -0,0 +1,20 @@
+# app/services/negocio.py
+# ==============================================================================
+# DATOS DEL NEGOCIO
+# ==============================================================================
+# Fuente única para todo lo que se le dice al cliente: el prompt del modelo (prompts.py),
+# las respuestas sin Gemini (faq.py) y los horarios que se ofrecen (availability.py, tools.py).
+
+NOMBRE = "Barbería Demo"
+DIRECCION = "Castro Barros 1234"
+BARRIO = "San Martín"
+CIUDAD = "Córdoba"
+PRECIO_CORTE = 12000
+
+HORARIO = (9, 20)  # Apertura y cierre (horas)
+DIAS_DE_ATENCION = "martes a domingo"
+DIAS_CERRADO = {0}  # weekday(): lunes
+
+UBICACION = f"{DIRECCION}, barrio {BARRIO}, {CIUDAD}"
+PRECIO = f"${PRECIO_CORTE}"
+HORARIO_TEXTO = f"de {DIAS_DE_ATENCION} de {HORARIO[0]} a {HORARIO[1]}hs"
@@ -1,6 +1,7 @@
 # app/services/payment.py
 import mercadopago
 from app.core.config import settings
+from app.core.executors import run_blocking
 
 
 def generar_link_pago(items: list, external_reference: str, client_email: str = None) -> dict:
@@ -56,4 +57,12 @@ def generar_link_pago(items: list, external_reference: str, client_email: str =
 
     except Exception as e:
         print(f"❌ Error al generar link MP: {e}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+
+async def generar_link_pago_async(items: list, external_reference: str, client_email: str = None) -> dict:
+    """
+    Versión para código async: el SDK de Mercado Pago es bloqueante,
+    así que la llamada corre en el pool 'payments' y no frena el event loop.
+    """
+    return await run_blocking("payments", generar_link_pago, items, external_reference, client_email)
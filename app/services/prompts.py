@@ -0,0 +1,125 @@
+# app/services/prompts.py
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from app.services import negocio
+
+# Zona horaria Argentina
+TZ_ARG = ZoneInfo("America/Argentina/Cordoba")
+
+# ==============================================================================
+# 1. PREFIJOS ESTÁTICOS (PERSONA + REGLAS)
+# ==============================================================================
+# Son idénticos para todos los clientes: van como system_instruction del modelo cacheado
+# (ver gemini.get_model). Nada que cambie por usuario o por minuto puede vivir acá.
+
+SYSTEM_PROMPT_BARBERIA = f"""
+Sos el asistente virtual de "{negocio.NOMBRE}". Tu objetivo principal es lograr usar agendar_turno, para eso antes deberas usar registrar_cliente (si hace falta) y consultar_disponibilidad.
+
+### CONTEXTO TEMPORAL (MUY IMPORTANTE):
+- **HOY ES:** la fecha y hora que vienen en el bloque "### CONTEXTO" de cada mensaje.
+- Usa esa fecha como referencia absoluta para calcular "mañana", "el miércoles", "la semana que viene".
+- Si el usuario dice "miercoles" se refiere al proximo miercoles (de esta semana o la que sigue)
+_ Nunca agendes turnos para fechas anteriores, o horas ya pasadas del mismo dia.
+- No agendes dos turnos para la misma fecha y hora para el mismo cliente, por lo general el cliente quiere un solo turno.
+
+###PREGUNTAS FRECUENTES:
+Queda en la ciudad de {negocio.CIUDAD}, argentina, barrio {negocio.BARRIO}. La direccion es {negocio.DIRECCION}. El corte sale {negocio.PRECIO}. El horario de atencion es {negocio.HORARIO_TEXTO}.
+
+### PERSONALIDAD:
+- Hablá en español argentino, tono urbano, moderno ("Que onda", "Dale", "Quedamos asi", "Bro", "Pana", "Hermano", "Hermanito").
+- Sos un empleado del lugar
+- No uses la apertura de los signos de exclamacion/interrogacion. Solo el cierre
+-No des informacion que no te pidan.
+-No trates a los clientes por su nombre, usa bro, pana, hermanito, brody, genio, etc.
+
+### REGLAS DE NEGOCIO (MEMORIA):
+1. **Datos del Cliente**: 
+   - Si el usuario te da su nombre y teléfono, PRIMERO usá `registrar_cliente`.
+   - INMEDIATAMENTE después, si ya tenés fecha y hora pactada, pedile confirmacion y usá `agendar_turno`.
+
+2. **Turnos**:
+   - Primero usá `consultar_disponibilidad`.
+   - Para confirmar, ejecutá `agendar_turno`.
+
+### REGLA DE ORO (ANTI-MENTIRAS) :
+- **PROHIBIDO** decir "Turno agendado", "Te espero", "Listo" o similares SI NO has ejecutado exitosamente la tool `agendar_turno` en este mismo turno.
+- Si la tool `agendar_turno` no se ejecutó, NO le mientas al usuario. Decile: "Tengo tus datos, confirmame si querés que cierre la reserva para el [fecha/hora]".
+- Si usas la tool `registrar_cliente`, NO asumas que el turno se agendó solo. Tenés que llamar a `agendar_turno` después.
+"""
+
+# Para la charla liviana (saludos, agradecimientos): modelo chico y SIN tools (ver gemini.classify_block).
+# Corto a propósito: no puede prometer reservas que no puede hacer.
+LIGHT_PROMPT_BARBERIA = f"""
+Sos el asistente virtual de "{negocio.NOMBRE}" y ahora solo estás charlando (saludos, agradecimientos, acuses).
+- Hablá en español argentino, tono urbano, moderno ("Que onda", "Dale", "Bro", "Pana", "Hermanito"). Respuestas de una línea.
+- No uses la apertura de los signos de exclamacion/interrogacion. Solo el cierre.
+- No tenés herramientas: no podés ver la agenda, agendar, cancelar ni mover turnos.
+  Si te piden algo de eso, decí que lo consultás y preguntá para qué día y hora.
+- **PROHIBIDO** decir que un turno quedó agendado, cancelado o movido.
+"""
+
+STATIC_PROMPTS = {
+    "barberia": SYSTEM_PROMPT_BARBERIA,
+}
+
+LIGHT_PROMPTS = {
+    "barberia": LIGHT_PROMPT_BARBERIA,
+}
+
+
+# ==============================================================================
+# 2. BLOQUE DE CONTEXTO POR REQUEST
+# ==============================================================================
+
+def fecha_actual(now: Optional[datetime] = None) -> str:
+    """La fecha de AHORA (no la del arranque del proceso)."""
+    now = now or datetime.now(TZ_ARG)
+    return now.strftime("%A %d de %B de %Y, %H:%Mhs")
+
+
+def datos_cliente(client) -> str:
+    if client is None or not (client.nombre or client.telefono):
+        return "No registrados aún."
+    return f"Nombre: {client.nombre or 'Falta'}\nTeléfono: {client.telefono or 'Falta'}"
+
+
+def build_context_block(
+    sender_id: str, client, now: Optional[datetime] = None, summary: Optional[str] = None,
+    availability: Optional[str] = None
+) -> str:
+    """
+    Bloque chico que viaja delante del mensaje del usuario: fecha actual, datos del cliente,
+    si hay, el resumen de la parte de la conversación que ya no entra en el historial
+    y la foto de turnos libres (availability.snapshot) para no tener que consultar la agenda.
+    """
+    block = (
+        f"### CONTEXTO (no lo repitas):\n"
+        f"- HOY ES: {fecha_actual(now)}\n"
+        f"### DATOS DEL CLIENTE ACTUAL (ID: {sender_id}):\n{datos_cliente(client)}"
+    )
+    if summary:
+        block += f"\n### RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{summary}"
+    if availability:
+        block += (
+            "\n### PRÓXIMOS TURNOS LIBRES (los primeros de cada día; podés ofrecerlos sin usar "
+            "`consultar_disponibilidad`. Para otro día u horario, o antes de agendar uno que no esté acá, consultá):\n"
+            f"{availability}"
+        )
+    return block
+
+
+def assemble(
+    tenant: str, sender_id: str, client, now: Optional[datetime] = None, summary: Optional[str] = None,
+    availability: Optional[str] = None
+) -> dict:
+    """
+    Arma el prompt de una corrida del pipeline:
+    - system_instruction: prefijo estático del negocio (mismo texto siempre -> mismo modelo cacheado).
+    - context: bloque por request que chat_with_gemini antepone al mensaje del usuario.
+    """
+    return {
+        "system_instruction": STATIC_PROMPTS[tenant],
+        "context": build_context_block(sender_id, client, now, summary, availability),
+    }
@@ -0,0 +1,192 @@
+# app/services/resilience.py
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.core.metrics import metrics
+
+# ==============================================================================
+# 1. CLASIFICACIÓN DE ERRORES Y BACKOFF
+# ==============================================================================
+
+# Códigos HTTP que indican un problema pasajero del servicio (cuota, sobrecarga, caída)
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    429/5xx (y errores de red) se reintentan; el resto de los 4xx no (el pedido está mal, repetirlo no sirve).
+    Las excepciones de google.api_core traen el código HTTP en `.code`.
+    """
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES
+    return isinstance(exc, (ConnectionError, asyncio.TimeoutError))
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: Callable[[], float] = random.random) -> float:
+    """Backoff exponencial con jitter completo: al azar entre 0 y min(cap, base * 2^attempt)."""
+    return rng() * min(cap, base * (2 ** attempt))
+
+
+# ==============================================================================
+# 2. CIRCUIT BREAKER
+# ==============================================================================
+
+class CircuitOpen(Exception):
+    """El servicio viene fallando: no se lo llama hasta que pase el tiempo de enfriamiento."""
+
+
+class CircuitBreaker:
+    """
+    - closed: todo pasa. `failure_threshold` fallas seguidas (ya clasificadas como del servicio) lo abren.
+    - open: se corta en seco (CircuitOpen) durante `reset_timeout` segundos, sin gastar llamadas.
+    - half_open: pasado ese tiempo deja pasar UNA llamada de prueba; si sale bien cierra, si falla vuelve a abrir.
+    Métricas: <name>.circuit.opened / closed / short_circuited y el gauge <name>.circuit.open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._changed = asyncio.Event()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def before_call(self):
+        """Llamar antes de cada intento: lanza CircuitOpen si no corresponde llamar."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        metrics.inc(f"{self.name}.circuit.short_circuited")
+        raise CircuitOpen(f"{self.name} no disponible (circuito abierto)")
+
+    def record_success(self):
+        """El servicio contestó (aunque sea con un 4xx): cierra el circuito."""
+        self.failures = 0
+        self._probing = False
+        if self.opened_at is not None:
+            self.opened_at = None
+            metrics.inc(f"{self.name}.circuit.closed")
+            metrics.set_gauge(f"{self.name}.circuit.open", 0)
+            print(f"✅ Circuito de {self.name} cerrado: el servicio volvió")
+            self._notify()
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self._probing = False
+            self.opened_at = time.monotonic()
+            metrics.inc(f"{self.name}.circuit.opened")
+            metrics.set_gauge(f"{self.name}.circuit.open", 1)
+            print(f"🔌 Circuito de {self.name} abierto por {self.reset_timeout:g}s ({self.failures} fallas seguidas)")
+            self._notify()
+
+    def release_probe(self):
+        """La llamada de prueba se canceló sin resultado: otra puede probar."""
+        if self._probing:
+            self._probing = False
+            self._notify()
+
+    async def wait_ready(self):
+        """Espera hasta que se pueda llamar: circuito cerrado, o medio abierto sin prueba en curso."""
+        while True:
+            state = self.state
+            if state == "closed" or (state == "half_open" and not self._probing):
+                return
+            changed = self._changed
+            timeout = None
+            if state == "open":
+                timeout = max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+# ==============================================================================
+# 3. COLA DE REINTENTO POR CAÍDA
+# ==============================================================================
+
+class OutageQueue:
+    """
+    Bloques que no se pudieron atender porque el servicio está caído: se guardan (por usuario, en orden)
+    y se re-ejecutan cuando el breaker deja pasar llamadas. Con el circuito medio abierto sale uno solo
+    (es la llamada de prueba); cuando cierra, salen todos juntos (el scheduler de admisión los dosifica).
+    Métricas: <name>.outage.parked / replayed / dropped y el gauge <name>.outage.depth.
+    """
+
+    def __init__(self, name: str, breaker: CircuitBreaker, max_parked: int):
+        self.name = name
+        self.breaker = breaker
+        self.max_parked = max_parked
+        self._parked: Dict[str, List[str]] = {}
+        self._notified = set()
+        self._handler: Optional[Callable[[str, str], Awaitable]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._parked)
+
+    def park(self, sender_id: str, text: str, handler: Callable[[str, str], Awaitable]) -> bool:
+        """Guarda el bloque para después. False si la cola está llena (el llamador avisa del error)."""
+        if sender_id not in self._parked and len(self._parked) >= self.max_parked:
+            metrics.inc(f"{self.name}.outage.dropped")
+            return False
+        self._parked.setdefault(sender_id, []).append(text)
+        self._handler = handler
+        metrics.inc(f"{self.name}.outage.parked")
+        metrics.set_gauge(f"{self.name}.outage.depth", len(self._parked))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+        return True
+
+    def notify_once(self, sender_id: str) -> bool:
+        """True la primera vez por caída: para avisarle al usuario una sola vez que ya le contestamos."""
+        if sender_id in self._notified:
+            return False
+        self._notified.add(sender_id)
+        return True
+
+    async def _replay(self, sender_id: str, textos: List[str]):
+        metrics.inc(f"{self.name}.outage.replayed")
+        try:
+            await self._handler(sender_id, " ".join(textos))
+        except Exception as e:
+            print(f"❌ Error re-ejecutando el bloque de {sender_id}: {e}")
+        if sender_id not in self._parked:
+            self._notified.discard(sender_id)
+
+    async def _drain(self):
+        while self._parked:
+            await self.breaker.wait_ready()
+            if self.breaker.state == "closed":
+                lote = list(self._parked.items())
+            else:
+                lote = [next(iter(self._parked.items()))]
+            for sender_id, _ in lote:
+                self._parked.pop(sender_id, None)
+            metrics.set_gauge(f"{self.name}.outage.depth", len(self._parked))
+            print(f"🔁 Re-ejecutando {len(lote)} bloque(s) pendientes de {self.name}")
+            await asyncio.gather(*(self._replay(sender_id, textos) for sender_id, textos in lote))
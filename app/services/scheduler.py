@@ -0,0 +1,93 @@
+# app/services/scheduler.py
+import asyncio
+import math
+import time
+from typing import Callable, Dict, Hashable, List, Set, Tuple
+
+
+class TimerWheel:
+    """
+    Rueda de timers con hash (hashed timing wheel).
+    Un ÚNICO task de asyncio avanza la rueda cada `tick` segundos y dispara las claves vencidas,
+    en vez de tener un asyncio.Task dormido por clave.
+    - schedule() (programar o reiniciar un timer) y cancel() son O(1).
+    - La precisión es de un tick (los timers vencen como mucho `tick` segundos tarde).
+    - `on_expire(key)` es síncrono: si tiene trabajo pesado, que cree su propio task.
+    """
+
+    def __init__(self, on_expire: Callable[[Hashable], None], tick: float = 0.25, slots: int = 512):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[Hashable, Tuple[int, int]] = {}  # key -> (tick absoluto, slot)
+        self._started_at = time.monotonic()
+        self._current_tick = 0
+        self._task = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def _now_tick(self) -> int:
+        return int((time.monotonic() - self._started_at) / self.tick)
+
+    def schedule(self, key: Hashable, delay: float):
+        """Programa (o reprograma) `key` para dentro de `delay` segundos."""
+        self.cancel(key)
+        if not self._deadlines:
+            # La rueda estaba quieta: la alineamos con el reloj antes de programar
+            self._current_tick = self._now_tick()
+        # Redondeamos hacia arriba: nunca disparar antes de tiempo
+        deadline = max(
+            self._current_tick + 1,
+            math.ceil((time.monotonic() - self._started_at + delay) / self.tick)
+        )
+        slot = deadline % len(self.slots)
+        self.slots[slot].add(key)
+        self._deadlines[key] = (deadline, slot)
+        self._ensure_running()
+
+    def cancel(self, key: Hashable):
+        entry = self._deadlines.pop(key, None)
+        if entry:
+            self.slots[entry[1]].discard(key)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._deadlines:
+                # Sin timers no hay nada que avanzar: dormimos hasta el próximo schedule()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            next_tick_at = self._started_at + (self._current_tick + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick_at - time.monotonic()))
+
+            # Nos ponemos al día con todos los ticks transcurridos (por si el loop se atrasó)
+            target = self._now_tick()
+            while self._current_tick < target:
+                self._current_tick += 1
+                self._fire_slot(self._current_tick % len(self.slots))
+
+    def _fire_slot(self, slot: int):
+        bucket = self.slots[slot]
+        if not bucket:
+            return
+        vencidos = [key for key in bucket if self._deadlines[key][0] <= self._current_tick]
+        for key in vencidos:
+            bucket.discard(key)
+            del self._deadlines[key]
+            try:
+                self.on_expire(key)
+            except Exception as e:
+                print(f"⚠️ Error disparando timer {key}: {e}")
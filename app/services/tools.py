@@ -1,9 +1,17 @@
 # app/services/tools.py
-from datetime import datetime
-from typing import List, Dict, Any
-
-from app.core.database import SessionLocal
-from app.services import crud, calendar, instagram
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.executors import run_blocking
+from app.core.metrics import metrics
+from app.services import availability, crud, calendar, calendar_mirror, instagram, negocio
+from app.services.agenda_version import agenda_version
 from app.models.models import TurnoBarberia
 
 # ==============================================================================
@@ -81,15 +89,187 @@ TOOLS_SCHEMA = [
 ]
 
 
+# Tools que solo leen: se pueden correr en paralelo entre sí (el resto escribe y va en orden)
+READ_ONLY_TOOLS = {"consultar_disponibilidad"}
+# Escrituras que cambian la agenda: invalidan lo memorizado de las lecturas
+AGENDA_WRITE_TOOLS = {"agendar_turno", "cancelar_turno", "mover_turno"}
+
+
+# ==============================================================================
+# 2. HELPERS
+# ==============================================================================
+
+async def _espejo_reserva(event_id: str, inicio: datetime):
+    """Refleja al instante en el espejo local una reserva hecha por el bot."""
+    if settings.CALENDAR_MIRROR_ENABLED:
+        await run_blocking(
+            "db", calendar_mirror.mirror.apply_booking,
+            event_id, inicio, inicio + timedelta(minutes=calendar.SLOT_MINUTES)
+        )
+
+
+async def _espejo_cancelacion(event_id: str):
+    """Refleja al instante en el espejo local una cancelación hecha por el bot."""
+    if settings.CALENDAR_MIRROR_ENABLED:
+        await run_blocking("db", calendar_mirror.mirror.apply_cancellation, event_id)
+
+
+def _es_error(result: str) -> bool:
+    texto = str(result)
+    return texto.startswith(("Error", "Ocurrió un error", "❌", "Hubo un error"))
+
+
+def _normalizar_hora(hora: str) -> str:
+    """'9', '9:00', '09:00hs' -> '09:00' (si no se entiende, queda como vino)."""
+    digitos = hora.replace("hs", "").replace("h", "").strip().split(":")
+    try:
+        return f"{int(digitos[0]):02d}:{int(digitos[1]) if len(digitos) > 1 else 0:02d}"
+    except ValueError:
+        return hora
+
+
+# ==============================================================================
+# 3. MEMOIZACIÓN DE LECTURAS POR CONVERSACIÓN
+# ==============================================================================
+# En una misma charla el modelo suele pedir consultar_disponibilidad varias veces con lo mismo
+# ("¿y el jueves?" ... "dale, el jueves a la tarde"): cada una iba a Google Calendar.
+
+class ToolMemo:
+    """
+    Resultados de tools de solo lectura, por conversación (recipient_id) y argumentos normalizados.
+    - Cada resultado vive `ttl` segundos (la agenda también cambia por afuera del bot).
+    - Una escritura de agenda (agendar/cancelar/mover) borra todo: la agenda es una sola para todos.
+      Las de OTROS procesos (otro worker) se notan por la versión compartida de la agenda
+      (agenda_version): cada resultado anota con cuál se leyó y no se usa si cambió.
+    - Los errores no se guardan.
+    - Hasta `max_conversations` conversaciones (las menos recientes se olvidan).
+    Métricas: tools.memo.hits / misses / invalidations; stats(recipient_id) por conversación (o por bloque).
+    """
+
+    def __init__(self, ttl: float, max_conversations: int):
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        # {recipient_id: {"entries": {key: (vence, resultado, versión de agenda)}, "hits": n, "misses": n}}
+        self._conversations: "OrderedDict[str, dict]" = OrderedDict()
+
+    @staticmethod
+    def key(tool_name: str, args: Dict[str, Any]) -> tuple:
+        """Argumentos equivalentes -> misma clave (ej: '9:00' y '09:00', o rango ignorado si hay hora exacta)."""
+        norm = {k: v.strip().lower() if isinstance(v, str) else v for k, v in args.items() if v not in (None, "")}
+        if tool_name == "consultar_disponibilidad":
+            # Sin fecha se buscan los próximos días desde HOY: la clave depende del día
+            if "fecha" in norm:
+                fecha = str(norm["fecha"])[:10]
+            else:
+                fecha = f"desde:{datetime.now(calendar.TZ_ARG).date().isoformat()}"
+            hora = _normalizar_hora(str(norm["hora_especifica"])) if "hora_especifica" in norm else None
+            rango = None
+            if not hora:
+                # Igual que el handler: sin rango es el día entero, "mañana" es 9-13 y cualquier otro 14-20
+                rango = "todo" if "rango_horario" not in args else (
+                    "mañana" if args["rango_horario"] == "mañana" else "tarde"
+                )
+            return (tool_name, fecha, hora, rango)
+        return (tool_name, json.dumps(norm, sort_keys=True, ensure_ascii=False, default=str))
+
+    def _conversation(self, recipient_id: str) -> dict:
+        conv = self._conversations.get(recipient_id)
+        if conv is None:
+            conv = self._conversations[recipient_id] = {"entries": {}, "hits": 0, "misses": 0}
+            if len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        else:
+            self._conversations.move_to_end(recipient_id)
+        return conv
+
+    def get(self, recipient_id: str, key: tuple, version: int = 0) -> Optional[str]:
+        conv = self._conversation(recipient_id)
+        entry = conv["entries"].get(key)
+        if entry and entry[0] > time.monotonic() and entry[2] == version:
+            conv["hits"] += 1
+            metrics.inc("tools.memo.hits")
+            return entry[1]
+        conv["entries"].pop(key, None)
+        conv["misses"] += 1
+        metrics.inc("tools.memo.misses")
+        return None
+
+    def put(self, recipient_id: str, key: tuple, result: str, version: int = 0):
+        self._conversation(recipient_id)["entries"][key] = (time.monotonic() + self.ttl, result, version)
+
+    def invalidate_all(self):
+        for conv in self._conversations.values():
+            conv["entries"].clear()
+        metrics.inc("tools.memo.invalidations")
+
+    def stats(self, recipient_id: str, since: Optional[dict] = None) -> dict:
+        """
+        Por conversación: aciertos, fallos, tasa de acierto y llamadas externas ahorradas.
+        Con `since` (un stats() anterior de la misma conversación), solo lo que pasó desde entonces (ej: un bloque).
+        """
+        conv = self._conversations.get(recipient_id) or {"hits": 0, "misses": 0}
+        since = since or {"hits": 0, "misses": 0}
+        # max(0, ...): si la conversación se olvidó en el medio, los contadores arrancaron de cero
+        hits = max(0, conv["hits"] - since["hits"])
+        misses = max(0, conv["misses"] - since["misses"])
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else None,
+            "saved_calls": hits,  # Cada acierto es una consulta a la agenda que no se hizo
+        }
+
+
+# Instancia global
+tool_memo = ToolMemo(ttl=settings.TOOL_MEMO_TTL_SECONDS, max_conversations=settings.TOOL_MEMO_MAX_CONVERSATIONS)
+
+
 # ==============================================================================
-# 2. HANDLER PRINCIPAL
+# 4. HANDLER PRINCIPAL
 # ==============================================================================
 
 async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: str = None) -> str:
     """
     Controlador central que recibe la orden de Gemini y ejecuta la lógica de negocio.
+    Las lecturas se memorizan por conversación (ver ToolMemo); las escrituras de agenda exitosas las invalidan.
+    """
+    memo_key = None
+    version = 0
+    if settings.TOOL_MEMO_ENABLED and recipient_id and tool_name in READ_ONLY_TOOLS:
+        memo_key = ToolMemo.key(tool_name, args)
+        version = await agenda_version.current()
+        cached = tool_memo.get(recipient_id, memo_key, version)
+        if cached is not None:
+            print(f"♻️ {tool_name} desde la memoria de la conversación de {recipient_id}")
+            return cached
+
+    result = await _ejecutar_tool(tool_name, args, recipient_id)
+
+    if memo_key and not _es_error(result):
+        tool_memo.put(recipient_id, memo_key, result, version)
+    elif tool_name in AGENDA_WRITE_TOOLS and str(result).startswith("✅"):
+        await _agenda_cambio()
+    return result
+
+
+async def _agenda_cambio():
+    """
+    El bot agendó/canceló/movió: lo leído antes (memoria y foto de turnos libres) ya no vale,
+    acá al instante y en los demás procesos vía la versión compartida de la agenda.
+    """
+    tool_memo.invalidate_all()
+    if availability.snapshot:
+        availability.snapshot.invalidate()
+    await agenda_version.bump()
+
+
+async def _ejecutar_tool(tool_name: str, args: Dict[str, Any], recipient_id: str = None) -> str:
     """
-    db = SessionLocal()
+    La lógica de negocio de cada tool.
+    La DB va por la sesión async; lo bloqueante (Google Calendar) corre en los pools de app.core.executors.
+    """
+    db = AsyncSessionLocal()
     try:
         # ----------------------------------------------------------------------
         # TOOL: CONSULTAR DISPONIBILIDAD
@@ -106,10 +286,12 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
             elif "rango_horario" in args:
                 filtro["time_range"] = (9, 13) if args["rango_horario"] == "mañana" else (14, 20)
             else:
-                filtro["time_range"] = (9, 20)
+                filtro["time_range"] = negocio.HORARIO
 
             filtros.append(filtro)
-            return calendar.consultar_disponibilidad(filtros)
+            # Se responde desde el espejo local; Google solo se consulta si está desactualizado
+            mirror = calendar_mirror.mirror if settings.CALENDAR_MIRROR_ENABLED else None
+            return await run_blocking("calendar", calendar.consultar_disponibilidad, filtros, mirror=mirror)
 
         # ----------------------------------------------------------------------
         # TOOL: REGISTRAR CLIENTE
@@ -117,16 +299,16 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
         elif tool_name == "registrar_cliente":
             if not recipient_id: return "Error: No ID usuario."
 
-            cliente = crud.cliente_barberia.get_one(db, ig_id=recipient_id)
+            cliente = await crud.cliente_barberia.aget_one(db, ig_id=recipient_id)
             if not cliente:
-                crud.cliente_barberia.create(
+                await crud.cliente_barberia.acreate(
                     db,
                     ig_id=recipient_id,
                     nombre=args.get("nombre"),
                     telefono=args.get("telefono")
                 )
             else:
-                crud.cliente_barberia.update(
+                await crud.cliente_barberia.aupdate(
                     db,
                     cliente,
                     nombre=args.get("nombre"),
@@ -142,10 +324,10 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
                 return "Error: No se pudo identificar al usuario de Instagram."
 
             # 1. Recuperar o actualizar cliente
-            cliente = crud.cliente_barberia.get_one(db, ig_id=recipient_id)
+            cliente = await crud.cliente_barberia.aget_one(db, ig_id=recipient_id)
             if not cliente:
                 # Si no existe, lo creamos con lo que venga (si viene)
-                cliente = crud.cliente_barberia.create(
+                cliente = await crud.cliente_barberia.acreate(
                     db,
                     ig_id=recipient_id,
                     nombre=args.get("nombre_cliente"),
@@ -157,14 +339,15 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
                 if args.get("nombre_cliente"): updates["nombre"] = args["nombre_cliente"]
                 if args.get("telefono_cliente"): updates["telefono"] = args["telefono_cliente"]
                 if updates:
-                    crud.cliente_barberia.update(db, cliente, **updates)
+                    await crud.cliente_barberia.aupdate(db, cliente, **updates)
 
             # Validar que tengamos datos reales antes de ir a Google
             nombre_final = cliente.nombre or "Cliente"
             telefono_final = cliente.telefono or "Sin teléfono"
 
             # 2. Llamada a Google Calendar API
-            res_google = calendar.agendar_evento(
+            res_google = await run_blocking(
+                "calendar", calendar.agendar_evento,
                 start_time=args["fecha_hora_inicio"],
                 client_name=nombre_final,
                 client_phone=telefono_final,
@@ -172,15 +355,17 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
             )
 
             if res_google["status"] == "success":
-                crud.turno_barberia.create(
+                inicio = datetime.fromisoformat(args["fecha_hora_inicio"])
+                await _espejo_reserva(res_google["id"], inicio)
+                await crud.turno_barberia.acreate(
                     db,
                     cliente_id=cliente.id,
-                    fecha_hora=datetime.fromisoformat(args["fecha_hora_inicio"]),
+                    fecha_hora=crud.hora_local(inicio),
                     google_event_id=res_google["id"],
                     estado="activo",
                     nota="Reserva vía Bot"
                 )
-                return f"✅ Turno agendado con éxito para {nombre_final}. El link es {res_google["link"]}"
+                return f"✅ Turno agendado con éxito para {nombre_final}. El link es {res_google['link']}"
             else:
                 return f"❌ Hubo un error al intentar reservar en el calendario: {res_google['message']}"
 
@@ -190,23 +375,24 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
         elif tool_name == "cancelar_turno":
             if not recipient_id: return "Error ID usuario."
 
-            cliente = crud.cliente_barberia.get_one(db, ig_id=recipient_id)
+            cliente = await crud.cliente_barberia.aget_one(db, ig_id=recipient_id)
             if not cliente:
                 return "No tienes turnos registrados con nosotros."
 
             # Buscar turnos activos futuros
-            turnos = crud.turno_barberia.get_multi(db, cliente_id=cliente.id, estado="activo")
-            turnos_futuros = [t for t in turnos if t.fecha_hora > datetime.now()]
+            turnos = await crud.turno_barberia.aget_multi(db, cliente_id=cliente.id, estado="activo")
+            turnos_futuros = [t for t in turnos if t.fecha_hora > crud.hora_local()]
 
             if not turnos_futuros:
                 return "No encontré ningún turno futuro activo para cancelar."
 
             turno_a_cancelar = turnos_futuros[0]
 
-            res_google = calendar.cancelar_evento(turno_a_cancelar.google_event_id)
+            res_google = await run_blocking("calendar", calendar.cancelar_evento, turno_a_cancelar.google_event_id)
 
             if res_google["status"] == "success":
-                crud.turno_barberia.update(db, turno_a_cancelar, estado="cancelado")
+                await _espejo_cancelacion(turno_a_cancelar.google_event_id)
+                await crud.turno_barberia.aupdate(db, turno_a_cancelar, estado="cancelado")
                 return f"✅ Turno del {turno_a_cancelar.fecha_hora.strftime('%d/%m %H:%M')} cancelado correctamente."
             else:
                 return "Hubo un error técnico al intentar cancelar el evento en Google."
@@ -215,11 +401,11 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
         # TOOL: MOVER TURNO
         # ----------------------------------------------------------------------
         elif tool_name == "mover_turno":
-            cliente = crud.cliente_barberia.get_one(db, ig_id=recipient_id)
+            cliente = await crud.cliente_barberia.aget_one(db, ig_id=recipient_id)
             if not cliente: return "No tienes turnos para reprogramar."
 
-            turnos = crud.turno_barberia.get_multi(db, cliente_id=cliente.id, estado="activo")
-            turnos_futuros = [t for t in turnos if t.fecha_hora > datetime.now()]
+            turnos = await crud.turno_barberia.aget_multi(db, cliente_id=cliente.id, estado="activo")
+            turnos_futuros = [t for t in turnos if t.fecha_hora > crud.hora_local()]
 
             if not turnos_futuros:
                 return "No tenés turnos activos para cambiar. ¿Querés agendar uno nuevo?"
@@ -227,7 +413,8 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
             turno_viejo = turnos_futuros[0]
 
             # Intentar agendar el nuevo
-            res_google_new = calendar.agendar_evento(
+            res_google_new = await run_blocking(
+                "calendar", calendar.agendar_evento,
                 start_time=args["fecha_hora_nueva"],
                 client_name=cliente.nombre,
                 client_phone=cliente.telefono or args.get("telefono_cliente")
@@ -237,15 +424,19 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
                 return f"❌ No pude reprogramar: El horario nuevo no está disponible o hubo un error ({res_google_new['message']})."
 
             # Si el nuevo funcionó, borramos el viejo
-            calendar.cancelar_evento(turno_viejo.google_event_id)
+            nuevo_inicio = datetime.fromisoformat(args["fecha_hora_nueva"])
+            await _espejo_reserva(res_google_new["id"], nuevo_inicio)
+            res_google_old = await run_blocking("calendar", calendar.cancelar_evento, turno_viejo.google_event_id)
+            if res_google_old["status"] == "success":
+                await _espejo_cancelacion(turno_viejo.google_event_id)
 
             # Actualizar DB
-            crud.turno_barberia.update(db, turno_viejo, estado="reprogramado_old")
+            await crud.turno_barberia.aupdate(db, turno_viejo, estado="reprogramado_old")
 
-            crud.turno_barberia.create(
+            await crud.turno_barberia.acreate(
                 db,
                 cliente_id=cliente.id,
-                fecha_hora=datetime.fromisoformat(args["fecha_hora_nueva"]),
+                fecha_hora=crud.hora_local(nuevo_inicio),
                 google_event_id=res_google_new["id"],
                 estado="activo",
                 nota="Reprogramado"
@@ -260,4 +451,64 @@ async def handle_tool_call(tool_name: str, args: Dict[str, Any], recipient_id: s
         print(f"Error crítico en tools: {e}")
         return "Ocurrió un error interno procesando la solicitud."
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
+
+
+# ==============================================================================
+# 5. VARIAS TOOLS EN UN MISMO TURNO
+# ==============================================================================
+
+async def _call_with_timeout(tool_name: str, args: Dict[str, Any], recipient_id: str, timeout: float,
+                             on_step: Optional[Callable] = None) -> str:
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        return await asyncio.wait_for(handle_tool_call(tool_name, args, recipient_id), timeout=timeout)
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        print(f"⏱️ Tool {tool_name} superó {timeout:g}s")
+        if tool_name in READ_ONLY_TOOLS:
+            return "La consulta tardó demasiado. Pedile al usuario un momento y volvé a intentar."
+        if tool_name in AGENDA_WRITE_TOOLS:
+            await _agenda_cambio()  # No sabemos si la agenda cambió: mejor volver a consultar
+        # Una escritura cortada pudo haber llegado a Google igual: que el modelo no confirme nada
+        return "La operación tardó demasiado y no sé si se completó. No confirmes nada, decile al usuario que lo verificás."
+    finally:
+        if on_step:
+            on_step(tool_name, time.perf_counter() - started, outcome)
+
+
+async def handle_tool_calls(calls: List[tuple], recipient_id: str = None, timeout: float = None,
+                            on_step: Optional[Callable] = None, deadline: Optional[float] = None) -> List[str]:
+    """
+    Ejecuta todas las tools que Gemini pidió en UNA respuesta: [(nombre, args), ...].
+    - Las de solo lectura corren en paralelo (entre sí y con las escrituras).
+    - Las que escriben corren de a una, en el orden en que las pidió el modelo
+      (ej: registrar_cliente antes que agendar_turno).
+    - Cada una tiene su timeout, recortado a lo que quede hasta `deadline` (time.monotonic()) al arrancarla:
+      una escritura que espera a las anteriores no se lleva el presupuesto entero.
+      Retorna los resultados en el mismo orden que `calls`.
+    `on_step(tool_name, segundos, resultado)` se llama al terminar cada tool ('ok' o 'timeout').
+    """
+    timeout = timeout or settings.TOOL_TIMEOUT_SECONDS
+    results: List[Any] = [None] * len(calls)
+
+    def _presupuesto() -> float:
+        return timeout if deadline is None else min(timeout, deadline - time.monotonic())
+
+    async def _leer(i: int):
+        results[i] = await _call_with_timeout(calls[i][0], calls[i][1], recipient_id, _presupuesto(), on_step)
+
+    async def _escribir_en_orden(indices: List[int]):
+        for i in indices:
+            presupuesto = _presupuesto()
+            if presupuesto <= 0:
+                # Ni la arrancamos: no quedó tiempo en el bloque
+                results[i] = "No llegué a hacer la operación por falta de tiempo. No confirmes nada, decile al usuario que lo reintentás."
+                continue
+            results[i] = await _call_with_timeout(calls[i][0], calls[i][1], recipient_id, presupuesto, on_step)
+
+    lecturas = [i for i, (name, _) in enumerate(calls) if name in READ_ONLY_TOOLS]
+    escrituras = [i for i, (name, _) in enumerate(calls) if name not in READ_ONLY_TOOLS]
+    await asyncio.gather(*[_leer(i) for i in lecturas], _escribir_en_orden(escrituras))
+    return results
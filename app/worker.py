@@ -0,0 +1,167 @@
+# app/worker.py
+"""
+Workers de IA: consumen la cola durable de conversaciones (app/services/jobs.py)
+y corren process_conversation_block fuera del proceso web.
+
+Uso:
+    USE_JOB_QUEUE=true uvicorn app.main:app          # el web solo recibe, guarda y encola
+    python -m app.worker --procesos 4 --concurrencia 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+from functools import partial
+
+from app.core.config import settings
+from app.core.database import async_engine
+from app.core.executors import shutdown_executors
+from app.core.metrics import metrics
+from app.routers.webhook import BloqueYaAtendido, process_conversation_block
+from app.services import availability, calendar_mirror, gemini, instagram
+from app.services.jobs import job_queue
+
+
+class ConversationWorker:
+    """
+    Toma trabajos de la cola y los procesa, hasta `concurrency` a la vez (siempre de usuarios distintos).
+    Mientras procesa, renueva el visibility timeout (heartbeat) para que otro worker no se lo robe.
+    """
+
+    def __init__(self, name: str, concurrency: int, poll_interval: float, handler=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        # Con Gemini caído el bloque falla y la cola lo reintenta (job_queue.fail), no se guarda en memoria
+        self.handler = handler or partial(process_conversation_block, park_on_outage=False)
+        self.running = set()
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        print(f"👷 Worker {self.name} listo (concurrencia {self.concurrency}).")
+        while not self._stop.is_set():
+            libres = self.concurrency - len(self.running)
+            trabajos = []
+            # Con el circuito de Gemini abierto no tomamos trabajos: fallarían y gastarían intentos
+            if libres > 0 and not gemini.breaker.is_open:
+                try:
+                    trabajos = await job_queue.claim(self.name, libres)
+                except Exception as e:
+                    print(f"⚠️ Worker {self.name}: error tomando trabajos: {e}")
+
+            for trabajo in trabajos:
+                task = asyncio.create_task(self._process(trabajo))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            metrics.set_gauge("worker.in_flight", len(self.running))
+
+            if not trabajos:
+                # Nada para hacer (o estamos llenos): esperamos un poco o hasta que nos paren
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        # Apagado prolijo: terminamos lo que ya tomamos (lo que no, vuelve a la cola por timeout)
+        if self.running:
+            print(f"⏳ Worker {self.name}: esperando {len(self.running)} trabajo(s) en curso...")
+            await asyncio.wait(self.running, timeout=job_queue.visibility_timeout)
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(job_queue.visibility_timeout / 3)
+            try:
+                await job_queue.extend(job_id, self.name)
+            except Exception as e:
+                print(f"⚠️ Worker {self.name}: error renovando trabajo {job_id}: {e}")
+
+    async def _process(self, trabajo: dict):
+        heartbeat = asyncio.create_task(self._heartbeat(trabajo["id"]))
+        print(f"🚀 [{self.name}] Procesando bloque para {trabajo['sender_id']}: {trabajo['texto']}")
+        try:
+            await self.handler(trabajo["sender_id"], trabajo["texto"])
+        except BloqueYaAtendido as e:
+            # Ya se agendó o se respondió: reintentarlo duplicaría el turno o el mensaje
+            heartbeat.cancel()
+            await job_queue.fail(trabajo, self.name, repr(e), retry=False)
+        except Exception as e:
+            heartbeat.cancel()
+            await job_queue.fail(trabajo, self.name, repr(e))
+        else:
+            heartbeat.cancel()
+            await job_queue.complete(trabajo["id"], self.name)
+
+
+async def run_worker(name: str, concurrency: int):
+    """Un proceso worker: su propio event loop, engine de DB y cliente de Instagram."""
+    worker = ConversationWorker(name, concurrency, settings.JOB_POLL_SECONDS)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    # Cliente de Instagram propio; también retoma envíos que dejó colgados un proceso caído
+    await instagram.startup()
+
+    # El espejo de agenda lo sincroniza el proceso web; acá solo lo releemos de la DB
+    background_tasks = []
+    if settings.CALENDAR_MIRROR_ENABLED:
+        background_tasks.append(asyncio.create_task(
+            calendar_mirror.mirror.follow(settings.CALENDAR_MIRROR_SYNC_SECONDS)
+        ))
+    # Cada proceso arma su propia foto de turnos libres (y la invalida con sus propias reservas)
+    if availability.snapshot:
+        background_tasks.append(asyncio.create_task(
+            availability.snapshot.run_forever(settings.AVAILABILITY_SNAPSHOT_REFRESH_SECONDS)
+        ))
+
+    try:
+        await worker.run()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        # Vacía la cola de envíos de ESTE proceso (lo que no salga queda en DB, con el lease liberado)
+        await instagram.shutdown()
+        shutdown_executors()
+        await async_engine.dispose()
+        print(f"👋 Worker {name} apagado.")
+
+
+def _proceso(name: str, concurrency: int):
+    asyncio.run(run_worker(name, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workers de IA de la cola de conversaciones")
+    parser.add_argument("--procesos", type=int, default=settings.WORKER_PROCESSES)
+    parser.add_argument("--concurrencia", type=int, default=settings.WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    base = f"{socket.gethostname()}-{os.getpid()}"
+    if args.procesos <= 1:
+        _proceso(f"{base}-0", args.concurrencia)
+        return
+
+    # 'spawn': cada proceso arranca limpio (sin heredar conexiones ni event loop del padre)
+    ctx = multiprocessing.get_context("spawn")
+    procesos = [
+        ctx.Process(target=_proceso, args=(f"{base}-{i}", args.concurrencia), name=f"worker-{i}")
+        for i in range(args.procesos)
+    ]
+    for p in procesos:
+        p.start()
+    try:
+        for p in procesos:
+            p.join()
+    except KeyboardInterrupt:
+        # Ctrl+C también les llega a los hijos (mismo grupo): esperamos a que cierren prolijo
+        for p in procesos:
+            p.join()
+
+
+if __name__ == "__main__":
+    main()